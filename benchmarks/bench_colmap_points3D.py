@@ -0,0 +1,111 @@
+import sys
+import time
+import struct
+import argparse
+import tempfile
+import numpy as np
+from pathlib import Path
+# run from any directory without installing gsplatstudio
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from gsplatstudio.data.colmap_helper import read_next_bytes, read_points3D_binary, read_points3D_text
+
+
+def legacy_read_points3D_binary(path_to_model_file):
+    with open(path_to_model_file, "rb") as fid:
+        num_points = read_next_bytes(fid, 8, "Q")[0]
+
+        xyzs = np.empty((num_points, 3))
+        rgbs = np.empty((num_points, 3))
+        errors = np.empty((num_points, 1))
+
+        for p_id in range(num_points):
+            binary_point_line_properties = read_next_bytes(
+                fid, num_bytes=43, format_char_sequence="QdddBBBd")
+            xyz = np.array(binary_point_line_properties[1:4])
+            rgb = np.array(binary_point_line_properties[4:7])
+            error = np.array(binary_point_line_properties[7])
+            track_length = read_next_bytes(
+                fid, num_bytes=8, format_char_sequence="Q")[0]
+            track_elems = read_next_bytes(
+                fid, num_bytes=8*track_length,
+                format_char_sequence="ii"*track_length)
+            xyzs[p_id] = xyz
+            rgbs[p_id] = rgb
+            errors[p_id] = error
+    return xyzs, rgbs, errors
+
+def legacy_read_points3D_text(path):
+    num_points = 0
+    with open(path, "r") as fid:
+        while True:
+            line = fid.readline()
+            if not line:
+                break
+            line = line.strip()
+            if len(line) > 0 and line[0] != "#":
+                num_points += 1
+
+    xyzs = np.empty((num_points, 3))
+    rgbs = np.empty((num_points, 3))
+    errors = np.empty((num_points, 1))
+    count = 0
+    with open(path, "r") as fid:
+        while True:
+            line = fid.readline()
+            if not line:
+                break
+            line = line.strip()
+            if len(line) > 0 and line[0] != "#":
+                elems = line.split()
+                xyzs[count] = np.array(tuple(map(float, elems[1:4])))
+                rgbs[count] = np.array(tuple(map(int, elems[4:7])))
+                errors[count] = np.array(float(elems[7]))
+                count += 1
+    return xyzs, rgbs, errors
+
+def write_synthetic_points3D(folder, num_points, max_track_length, seed=0):
+    rng = np.random.default_rng(seed)
+    xyzs = rng.normal(size=(num_points, 3)) * 100
+    rgbs = rng.integers(0, 256, size=(num_points, 3))
+    errors = rng.random(num_points)
+    track_lengths = rng.integers(2, max_track_length + 1, size=num_points)
+
+    bin_path, txt_path = Path(folder) / "points3D.bin", Path(folder) / "points3D.txt"
+    with open(bin_path, "wb") as bin_file, open(txt_path, "w") as txt_file:
+        bin_file.write(struct.pack("<Q", num_points))
+        txt_file.write("# 3D point list with one line of data per point:\n")
+        for idx in range(num_points):
+            track = rng.integers(0, 10000, size=2 * track_lengths[idx]).astype(np.int32)
+            bin_file.write(struct.pack("<QdddBBBdQ", idx, *xyzs[idx], *rgbs[idx], errors[idx], track_lengths[idx]))
+            bin_file.write(track.astype("<i4").tobytes())
+            txt_file.write(" ".join(map(str, [idx, *xyzs[idx], *rgbs[idx], errors[idx], *track])) + "\n")
+    return bin_path, txt_path
+
+def timed(fn, path, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(path)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark COLMAP points3D readers.")
+    parser.add_argument('-n', '--num_points', type=int, default=200000)
+    parser.add_argument('-t', '--max_track_length', type=int, default=12)
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        bin_path, txt_path = write_synthetic_points3D(folder, args.num_points, args.max_track_length)
+        for name, legacy_fn, fn, path in [("binary", legacy_read_points3D_binary, read_points3D_binary, bin_path),
+                                          ("text", legacy_read_points3D_text, read_points3D_text, txt_path)]:
+            expected, legacy_time = timed(legacy_fn, str(path), args.repeat)
+            result, new_time = timed(fn, str(path), args.repeat)
+            for e, r in zip(expected, result):
+                assert np.array_equal(e, r), f"{name} reader mismatch"
+            print(f"{name:>6}: {args.num_points} points | legacy {legacy_time:.3f}s | new {new_time:.3f}s | speedup {legacy_time / new_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import time
+import logging
+import argparse
+import torch
+import torch.nn as nn
+import sys
+from pathlib import Path
+# run from any directory without installing gsplatstudio
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import gsplatstudio
+from gsplatstudio.utils.gaussian_utils import get_expon_lr_func
+
+SHAPES = {"xyz": (3,), "f_dc": (1, 3), "f_rest": (15, 3), "opacity": (1,), "scaling": (3,), "rotation": (4,)}
+LRS = {"xyz": 1.6e-4, "f_dc": 0.0025, "f_rest": 0.0025 / 20.0, "opacity": 0.05, "scaling": 0.005, "rotation": 0.001}
+
+
+class LegacyAdam:
+    """adam+customLR-paramOptim before GrowableStorage: torch.optim.Adam, densification by torch.cat and masking."""
+    def init_optim(self, param_lr_group, spatial_lr_scale, max_iter):
+        self.optimizer = torch.optim.Adam(param_lr_group, lr=0.0, eps=1e-15)
+        self.xyz_lr_schedule = get_expon_lr_func(lr_init=0.00016 * spatial_lr_scale, lr_final=1.6e-06 * spatial_lr_scale,
+                                                 lr_delay_mult=0.01, max_steps=30000)
+        self.max_iter = max_iter
+
+    def update_lr(self, iteration):
+        for param_group in self.optimizer.param_groups:
+            if param_group["name"] == "xyz":
+                param_group["lr"] = self.xyz_lr_schedule(iteration)
+
+    def backward(self, loss):
+        loss.backward()
+
+    def update_optim(self, iteration, visibility_filter=None):
+        if iteration < self.max_iter:
+            self.optimizer.step()
+            self.optimizer.zero_grad(set_to_none=True)
+
+    def replace_params(self, names, new_param, new_moment):
+        """Swap the parameters of the named groups for new_param(name, param), their moments for new_moment(name, moment)."""
+        optimizable_tensors = {}
+        for group in self.optimizer.param_groups:
+            if group["name"] not in names:
+                continue
+            stored_state = self.optimizer.state.pop(group["params"][0], None)
+            group["params"][0] = nn.Parameter(new_param(group["name"], group["params"][0]).requires_grad_(True))
+            if stored_state is not None:
+                stored_state["exp_avg"] = new_moment(group["name"], stored_state["exp_avg"])
+                stored_state["exp_avg_sq"] = new_moment(group["name"], stored_state["exp_avg_sq"])
+                self.optimizer.state[group["params"][0]] = stored_state
+            optimizable_tensors[group["name"]] = group["params"][0]
+        return optimizable_tensors
+
+    def prune_optim(self, mask):
+        return self.replace_params(SHAPES, lambda name, param: param[mask], lambda name, moment: moment[mask])
+
+    def cat_tensors(self, tensors_dict):
+        return self.replace_params(SHAPES, lambda name, param: torch.cat((param, tensors_dict[name]), dim=0),
+                                   lambda name, moment: torch.cat((moment, torch.zeros_like(tensors_dict[name])), dim=0))
+
+    def replace_tensor(self, tensor, name):
+        return self.replace_params([name], lambda name, param: tensor, lambda name, moment: torch.zeros_like(tensor))
+
+def param_lr_groups(num_points, device, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return [{"params": [nn.Parameter(torch.randn(num_points, *shape, generator=generator).to(device))], "lr": LRS[name], "name": name}
+            for name, shape in SHAPES.items()]
+
+def synchronize(device):
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+
+def run(optim_type, num_points, args, optim_cfg={}):
+    optim = LegacyAdam() if optim_type == "legacy" else gsplatstudio.find(optim_type)(dict(optim_cfg), logging.getLogger("bench"))
+    groups = param_lr_groups(num_points, args.device)
+    optim.init_optim(groups, 1.0, args.steps + 1)
+    params = {group["name"]: group["params"][0] for group in groups}
+    generator = torch.Generator().manual_seed(1)
+    grads = {name: torch.randn(param.shape, generator=generator).to(args.device) for name, param in params.items()}
+
+    step_time = 0.0
+    for iteration in range(1, args.steps + 1):
+        # only the visible Gaussians of a view receive gradient
+        visibility_filter = (torch.rand(num_points, generator=generator) < args.visible_fraction).to(args.device)
+        optim.backward(sum((param * grads[name] * visibility_filter.view(-1, *[1] * (param.dim() - 1))).sum()
+                           for name, param in params.items()))
+        synchronize(args.device)
+        start = time.perf_counter()
+        optim.update_lr(iteration)
+        optim.update_optim(iteration, visibility_filter=visibility_filter)
+        synchronize(args.device)
+        step_time += time.perf_counter() - start
+
+    # densifications appending 10% clones and dropping 10%, the fastest one counts
+    densify_time = float("inf")
+    generator = torch.Generator().manual_seed(2)
+    for _ in range(args.densify_repeats):
+        clone = (torch.rand(params["xyz"].shape[0], generator=generator) < 0.1).to(args.device)
+        keep = (torch.rand(params["xyz"].shape[0] + int(clone.sum()), generator=generator) > 0.1).to(args.device)
+        start = time.perf_counter()
+        params.update(optim.cat_tensors({name: param.detach()[clone] for name, param in params.items()}))
+        params.update(optim.prune_optim(keep))
+        params.update(optim.replace_tensor(params["opacity"].detach() * 0.5, "opacity"))
+        synchronize(args.device)
+        densify_time = min(densify_time, time.perf_counter() - start)
+    return step_time / args.steps, densify_time, params["xyz"].detach()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Adam steps and densification updates of the paramOptims.")
+    parser.add_argument('-n', '--num_points', type=str, default="100000,1000000,3000000")
+    parser.add_argument('-s', '--steps', type=int, default=20)
+    parser.add_argument('-r', '--densify_repeats', type=int, default=3)
+    parser.add_argument('-v', '--visible_fraction', type=float, default=0.3)
+    parser.add_argument('-d', '--device', type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument('-t', '--num_threads', type=int, default=None)
+    args = parser.parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    for num_points in map(int, args.num_points.split(",")):
+        # legacy is the torch.optim.Adam baseline, adam is the current adam+customLR-paramOptim on GrowableStorage
+        legacy_step, legacy_densify, legacy_xyz = run("legacy", num_points, args)
+        adam_step, adam_densify, _ = run("adam+customLR-paramOptim", num_points, args)
+        flat_step, flat_densify, flat_xyz = run("flatAdam-paramOptim", num_points, args)
+        sparse_step, _, _ = run("flatAdam-paramOptim", num_points, args, {"sparse_update": True})
+        print(f"{num_points} points: step legacy {legacy_step * 1e3:.1f}ms | adam {adam_step * 1e3:.1f}ms | "
+              f"flat {flat_step * 1e3:.1f}ms ({legacy_step / flat_step:.2f}x) | sparse {sparse_step * 1e3:.1f}ms ({legacy_step / sparse_step:.2f}x)")
+        print(f"{' ' * len(str(num_points))} densify legacy {legacy_densify * 1e3:.1f}ms | adam {adam_densify * 1e3:.1f}ms ({legacy_densify / adam_densify:.2f}x) | "
+              f"flat {flat_densify * 1e3:.1f}ms ({legacy_densify / flat_densify:.2f}x) | xyz diff {(legacy_xyz - flat_xyz).abs().max().item():.1e}")
+
+
+if __name__ == "__main__":
+    main()
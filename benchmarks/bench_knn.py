@@ -0,0 +1,53 @@
+import time
+import argparse
+import torch
+import sys
+from pathlib import Path
+# run from any directory without installing gsplatstudio
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from gsplatstudio.utils.knn_utils import mean_knn_dist2, simple_knn_available, kdtree_available
+
+
+def synthetic_sfm_cloud(num_points, outlier_fraction=0.01, seed=0):
+    """Anisotropic blob with a sparse halo of far outliers, like a COLMAP sparse model."""
+    generator = torch.Generator().manual_seed(seed)
+    points = torch.randn(num_points, 3, generator=generator) * torch.tensor([5.0, 1.0, 0.2])
+    num_outliers = int(num_points * outlier_fraction)
+    points[:num_outliers] *= 50.0
+    return points
+
+def reference_mean_knn_dist2(points, ids, k=3, max_block_size=1 << 24):
+    result = []
+    chunk_size = max(1, max_block_size // points.shape[0])
+    for start in range(0, ids.shape[0], chunk_size):
+        chunk = ids[start:start + chunk_size]
+        dist2 = torch.cdist(points[chunk].double(), points.double()).pow(2)
+        dist2[torch.arange(chunk.shape[0]), chunk] = float("inf")
+        result.append(dist2.topk(k, largest=False).values.mean(dim=1))
+    return torch.cat(result)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark kNN backends for the initial Gaussian scales.")
+    parser.add_argument('-n', '--num_points', type=str, default="100000,1000000,10000000,50000000")
+    parser.add_argument('-s', '--num_samples', type=int, default=2000, help="points checked against brute force")
+    parser.add_argument('--num_threads', type=int, default=None)
+    args = parser.parse_args()
+
+    backends = ["grid"] + (["kdtree"] if kdtree_available() else []) + (["simple_knn"] if simple_knn_available() else [])
+    for num_points in map(int, args.num_points.split(",")):
+        points = synthetic_sfm_cloud(num_points)
+        ids = torch.randperm(num_points, generator=torch.Generator().manual_seed(1))[:args.num_samples]
+        expected = reference_mean_knn_dist2(points, ids)
+        for backend in backends:
+            kwargs = {"num_threads": args.num_threads} if backend != "simple_knn" else {}
+            start = time.perf_counter()
+            result = mean_knn_dist2(points, backend=backend, **kwargs)
+            if result.is_cuda:
+                torch.cuda.synchronize()
+            elapsed = time.perf_counter() - start
+            error = ((result[ids].cpu().double() - expected) / expected.clamp_min(1e-12)).abs().max().item()
+            print(f"{backend:>10}: {num_points} points | {elapsed:.2f}s | {num_points / elapsed / 1e6:.2f} M points/s | max rel error {error:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import time
+import logging
+import argparse
+import numpy as np
+import torch
+import sys
+from pathlib import Path
+# run from any directory without installing gsplatstudio
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import gsplatstudio
+from gsplatstudio.utils.camera_utils import BasicCamera
+from gsplatstudio.utils.gaussian_utils import inverse_sigmoid
+
+
+def ground_plane_scene(side, density, max_sh_degree, device, seed=0):
+    """Flat Gaussians covering a side x side ground plane in front of the camera, density per unit area."""
+    generator = torch.Generator().manual_seed(seed)
+    num_points = int(side * side * density)
+    xz = torch.rand(num_points, 2, generator=generator) * side - torch.tensor([side / 2, -0.5])
+    y = 1.5 + 0.02 * torch.randn(num_points, generator=generator)
+    scales = torch.tensor([0.12, 0.01, 0.12]) * (0.5 + torch.rand(num_points, 1, generator=generator))
+    colors = 0.5 * torch.stack((torch.sin(xz[:, 0]), torch.cos(0.7 * xz[:, 1]), torch.sin(0.3 * xz[:, 0] + 0.2 * xz[:, 1])), dim=1)
+    num_rest = (max_sh_degree + 1) ** 2 - 1
+    return {"xyz": torch.stack((xz[:, 0], y, xz[:, 1]), dim=1).to(device),
+            "f_dc": colors[:, None].to(device),
+            "f_rest": torch.zeros(num_points, num_rest, 3, device=device),
+            "opacity": inverse_sigmoid(torch.full((num_points, 1), 0.9, device=device)),
+            "scaling": torch.log(scales).to(device),
+            "rotation": torch.tensor([[1.0, 0.0, 0.0, 0.0]], device=device).repeat(num_points, 1)}
+
+def timed_render(renderer, representation, camera, repeat):
+    best, image = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with torch.no_grad():
+            image = renderer.render(representation, camera)["render"]
+        if image.is_cuda:
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - start)
+    return image, best
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LoD rendering against full rendering as the scene grows.")
+    parser.add_argument('-s', '--sides', type=str, default="16,32,64,128", help="ground plane sizes")
+    parser.add_argument('-d', '--density', type=float, default=40.0, help="Gaussians per unit area")
+    parser.add_argument('-t', '--threshold', type=float, default=2.0, help="lod_threshold in pixels")
+    parser.add_argument('--renderer', type=str, default="torchRasterizer-renderer")
+    parser.add_argument('--device', type=str, default="cpu")
+    parser.add_argument('--resolution', type=str, default="320,240")
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench_lod")
+    width, height = map(int, args.resolution.split(","))
+    camera = BasicCamera(R=np.eye(3), T=np.zeros(3), fov_x=1.2, fov_y=1.2 * height / width, height=height, width=width,
+                         z_far=1000.0, device=args.device)
+    renderer_cfg = {"background_color": [0, 0, 0], "override_color": [-1, -1, -1]}
+    if args.renderer == "torchRasterizer-renderer":
+        renderer_cfg["device"] = args.device
+    renderer = gsplatstudio.find(args.renderer)(renderer_cfg, logger)
+    lod_renderer = gsplatstudio.find(args.renderer)(dict(renderer_cfg, lod_threshold=args.threshold), logger)
+
+    for side in map(float, args.sides.split(",")):
+        representation = gsplatstudio.find("gaussian-representation")({"max_sh_degree": 1, "device": args.device}, logger)
+        representation.set_compact_tensors(ground_plane_scene(side, args.density, 1, args.device))
+        start = time.perf_counter()
+        representation.build_lod()
+        build_time = time.perf_counter() - start
+        full, full_time = timed_render(renderer, representation, camera, args.repeat)
+        lod, lod_time = timed_render(lod_renderer, representation, camera, args.repeat)
+        psnr = (-10.0 * torch.log10(((full - lod) ** 2).mean().clamp_min(1e-12))).item()
+        print(f"{representation.xyz.shape[0]:>9} Gaussians | build {build_time:.2f}s | full {full_time * 1000:.0f}ms | "
+              f"lod {lod_time * 1000:.0f}ms, {lod_renderer.stats['lod_cut_size']} nodes | PSNR {psnr:.1f}dB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import time
+import argparse
+import torch
+import torch.nn.functional as F
+from torch.autograd import Variable
+from math import exp
+import sys
+from pathlib import Path
+# run from any directory without installing gsplatstudio
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from gsplatstudio.models.loss.l1_ssim_loss import ssim
+
+
+def legacy_gaussian(window_size, sigma):
+    gauss = torch.Tensor([exp(-(x - window_size // 2) ** 2 / float(2 * sigma ** 2)) for x in range(window_size)])
+    return gauss / gauss.sum()
+
+def legacy_create_window(window_size, channel):
+    _1D_window = legacy_gaussian(window_size, 1.5).unsqueeze(1)
+    _2D_window = _1D_window.mm(_1D_window.t()).float().unsqueeze(0).unsqueeze(0)
+    window = Variable(_2D_window.expand(channel, 1, window_size, window_size).contiguous())
+    return window
+
+def legacy_ssim(img1, img2, window_size=11):
+    channel = img1.size(-3)
+    window = legacy_create_window(window_size, channel)
+    if img1.is_cuda:
+        window = window.cuda(img1.get_device())
+    window = window.type_as(img1)
+
+    mu1 = F.conv2d(img1, window, padding=window_size // 2, groups=channel)
+    mu2 = F.conv2d(img2, window, padding=window_size // 2, groups=channel)
+    mu1_sq = mu1.pow(2)
+    mu2_sq = mu2.pow(2)
+    mu1_mu2 = mu1 * mu2
+    sigma1_sq = F.conv2d(img1 * img1, window, padding=window_size // 2, groups=channel) - mu1_sq
+    sigma2_sq = F.conv2d(img2 * img2, window, padding=window_size // 2, groups=channel) - mu2_sq
+    sigma12 = F.conv2d(img1 * img2, window, padding=window_size // 2, groups=channel) - mu1_mu2
+    C1 = 0.01 ** 2
+    C2 = 0.03 ** 2
+    ssim_map = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2))
+    return ssim_map.mean()
+
+def timed(fn, predict, gt, repeat):
+    best, value, grad = float("inf"), None, None
+    for _ in range(repeat):
+        predict.grad = None
+        start = time.perf_counter()
+        value = fn(predict, gt)
+        value.backward()
+        best = min(best, time.perf_counter() - start)
+        grad = predict.grad
+    return value.item(), grad, best
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SSIM forward + backward on CPU.")
+    parser.add_argument('-s', '--sizes', type=str, default="256x256,512x512,1080x1920")
+    parser.add_argument('-b', '--batch_size', type=int, default=1)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-t', '--num_threads', type=int, default=0, help="torch threads, 0 keeps the default")
+    args = parser.parse_args()
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+
+    generator = torch.Generator().manual_seed(0)
+    for size in args.sizes.split(","):
+        height, width = map(int, size.split("x"))
+        shape = (args.batch_size, 3, height, width) if args.batch_size > 1 else (3, height, width)
+        gt = torch.rand(shape, generator=generator)
+        predict = (gt + 0.1 * torch.randn(shape, generator=generator)).clamp(0, 1).requires_grad_(True)
+        legacy_value, legacy_grad, legacy_time = timed(legacy_ssim, predict, gt, args.repeat)
+        value, grad, new_time = timed(ssim, predict, gt, args.repeat)
+        print(f"{size:>10} x{args.batch_size}: legacy {legacy_time * 1000:.1f}ms | new {new_time * 1000:.1f}ms | "
+              f"speedup {legacy_time / new_time:.2f}x | value diff {abs(value - legacy_value):.1e} | "
+              f"grad diff {(grad - legacy_grad).abs().max().item():.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,9 @@ import random
 import shutil
 from gsplatstudio.data.colmap_helper import *
 from gsplatstudio.data.base_data import BaseDataModule
+from gsplatstudio.data.image_cache import DiskImageCache, MemoryImageCache
+from gsplatstudio.data.manifest import DatasetManifest
+from gsplatstudio.utils.camera_utils import CameraBank
 
 
 @dataclass
@@ -18,6 +21,22 @@ class ColmapDataModuleConfig:
     resolution: int = -1
     resolution_scales: list = field(default_factory=list)
     shuffle: bool = True
+    # pool used to build the camera/image pairs, "thread" or "process"; workers <= 0 uses all cpus
+    loader_executor: str = "thread"
+    loader_workers: int = 8
+    # persistent uint8 cache of resized images, shared by experiments on the same source_path
+    image_cache: bool = False
+    image_cache_dir: str = ""
+    image_cache_workers: int = 8
+    # in-memory ground-truth cache, policy is one of "none", "host", "device" or "tiered"; budgets < 0 are unbounded.
+    # "none" keeps every image's float data as loaded, a "uint8" cache quantizes images that are not 8 bit
+    memory_cache_policy: str = "none"
+    memory_cache_dtype: str = "uint8"
+    memory_cache_host_budget_mb: float = 8192
+    memory_cache_device_budget_mb: float = 2048
+    # cached cameras, split and point cloud keyed by the sparse/0 and images listings, in <source_path>/cache by default
+    manifest: bool = False
+    manifest_dir: str = ""
 
 
 @gsplatstudio.register("colmap-data")
@@ -28,33 +47,7 @@ class ColmapDataModule(BaseDataModule):
         return ColmapDataModuleConfig
 
     def _run(self):
-        self.point_cloud, pair_list, ply_path = load_colmap_folder(self.cfg.source_path)
-
-        # Define train and test dataset
-        if self.cfg.eval != 0:
-            self.train_pair_list = [c for idx, c in enumerate(pair_list) if idx % self.cfg.eval != 0]
-            self.test_pair_list = [c for idx, c in enumerate(pair_list) if idx % self.cfg.eval == 0]
-        else:
-            self.train_pair_list = pair_list
-            self.test_pair_list = []
-
-        self.spatial_scale = get_spatial_scale(self.train_pair_list)["radius"]
-
-        input_ply_path = Path(self.view_dir) / "input.ply"
-        camera_path = Path(self.view_dir) /  "cameras.json"
-
-        # Save point cloud data
-        with open(ply_path, 'rb') as src_file, open(input_ply_path , 'wb') as dest_file:
-            dest_file.write(src_file.read())
-        # Save camera data
-        json_cams = [camera_image_pair.json for camera_image_pair in pair_list]
-        with open(camera_path, 'w') as file:
-            json.dump(json_cams, file)
-        
-        # Shuffle the dataset
-        if self.cfg.shuffle:
-            random.shuffle(self.train_pair_list)  # Multi-res consistent random shuffling
-            random.shuffle(self.train_pair_list)  # Multi-res consistent random shuffling
+        self._load_dataset()
 
     def _restore(self, data_source_path, iteration):
 
@@ -73,34 +66,73 @@ class ColmapDataModule(BaseDataModule):
         if source_folder.exists():
             shutil.copytree(source_folder, target_folder)
 
-        self.point_cloud, pair_list, ply_path = load_colmap_folder(self.cfg.source_path)
+        self._load_dataset()
 
-        # Define train and test dataset
-        if self.cfg.eval != 0:
-            self.train_pair_list = [c for idx, c in enumerate(pair_list) if idx % self.cfg.eval != 0]
-            self.test_pair_list = [c for idx, c in enumerate(pair_list) if idx % self.cfg.eval == 0]
+    def _load_dataset(self):
+        manifest = DatasetManifest(self.cfg.source_path, self.cfg.eval, self.cfg.manifest_dir) if self.cfg.manifest else None
+        if manifest is not None and manifest.exists():
+            pair_list, train_index, test_index, self.spatial_scale, self.point_cloud, ply_bytes, cameras_json = manifest.load()
         else:
-            self.train_pair_list = pair_list
-            self.test_pair_list = []
-
-        self.spatial_scale = get_spatial_scale(self.train_pair_list)["radius"]
-
-        input_ply_path = Path(self.view_dir) / "input.ply"
-        camera_path = Path(self.view_dir) /  "cameras.json"
-
-        # Save point cloud data
-        with open(ply_path, 'rb') as src_file, open(input_ply_path , 'wb') as dest_file:
-            dest_file.write(src_file.read())
-        # Save camera data
-        json_cams = [camera_image_pair.json for camera_image_pair in pair_list]
-        with open(camera_path, 'w') as file:
-            json.dump(json_cams, file)
+            self.point_cloud, pair_list, ply_path = load_colmap_folder(self.cfg.source_path, self.cfg.loader_workers, self.cfg.loader_executor)
+            # Define train and test dataset
+            if self.cfg.eval != 0:
+                train_index = [idx for idx in range(len(pair_list)) if idx % self.cfg.eval != 0]
+                test_index = [idx for idx in range(len(pair_list)) if idx % self.cfg.eval == 0]
+            else:
+                train_index, test_index = list(range(len(pair_list))), []
+            self.spatial_scale = get_spatial_scale([pair_list[idx] for idx in train_index])["radius"]
+            if manifest is not None:
+                try:
+                    manifest.save(pair_list, train_index, test_index, self.spatial_scale, self.point_cloud, ply_path)
+                except OSError as e:
+                    # e.g. a read-only or shared dataset directory, the manifest only saves time
+                    self.logger.warning(f"Cannot write the dataset manifest {manifest.path}! Error: {e} Continue without it")
+            with open(ply_path, 'rb') as src_file:
+                ply_bytes = src_file.read()
+            cameras_json = json.dumps([camera_image_pair.json for camera_image_pair in pair_list]).encode("utf-8")
+
+        # device-resident matrices of all cameras, the pairs' cameras index into it
+        self.camera_bank = CameraBank([camera_image_pair.camera for camera_image_pair in pair_list], device=self.cfg.device)
+        self.train_pair_list = [pair_list[idx] for idx in train_index]
+        self.test_pair_list = [pair_list[idx] for idx in test_index]
+        if self.cfg.image_cache:
+            self._setup_image_cache(pair_list)
+        self._setup_memory_cache(pair_list)
+
+        # Save point cloud and camera data
+        with open(Path(self.view_dir) / "input.ply", 'wb') as dest_file:
+            dest_file.write(ply_bytes)
+        with open(Path(self.view_dir) / "cameras.json", 'wb') as file:
+            file.write(cameras_json)
         
         # Shuffle the dataset
         if self.cfg.shuffle:
             random.shuffle(self.train_pair_list)  # Multi-res consistent random shuffling
             random.shuffle(self.train_pair_list)  # Multi-res consistent random shuffling
 
+    def _setup_image_cache(self, pair_list):
+        cache_dir = Path(self.cfg.image_cache_dir) if self.cfg.image_cache_dir else Path(self.cfg.source_path) / "cache" / "images"
+        images = [camera_image_pair.image for camera_image_pair in pair_list]
+        for resolution_scale in self.cfg.resolution_scales:
+            disk_cache = DiskImageCache(cache_dir, images, self.cfg.resolution, resolution_scale,
+                                        num_workers=self.cfg.image_cache_workers, logger=self.logger)
+            for image in images:
+                image.disk_cache[image.get_resolution(self.cfg.resolution, resolution_scale)] = disk_cache
+
+    def _setup_memory_cache(self, pair_list):
+        if self.cfg.memory_cache_policy == "none":
+            # every image keeps its own float data, on the device of the data module
+            self.memory_cache = None
+            for camera_image_pair in pair_list:
+                camera_image_pair.image.device = self.cfg.device
+            return
+        self.memory_cache = MemoryImageCache(policy=self.cfg.memory_cache_policy, device=self.cfg.device,
+                                             dtype=self.cfg.memory_cache_dtype,
+                                             host_budget_mb=self.cfg.memory_cache_host_budget_mb,
+                                             device_budget_mb=self.cfg.memory_cache_device_budget_mb)
+        for camera_image_pair in pair_list:
+            camera_image_pair.image.memory_cache = self.memory_cache
+
     def get_train_pair_list(self):
         return self.train_pair_list
 
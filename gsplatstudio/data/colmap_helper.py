@@ -1,18 +1,21 @@
+import mmap
 import collections
 import numpy as np
 from pathlib import Path
 import struct
 import numpy as np
 from PIL import Image
-from plyfile import PlyData, PlyElement
 from pathlib import Path
 from gsplatstudio.utils.type_utils import *
 from gsplatstudio.utils.graphics_utils import *
 from gsplatstudio.utils.camera_utils import *
 
-from concurrent.futures import ThreadPoolExecutor
-from gsplatstudio.utils.graphics_utils import qvec2rotmat
+import os
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from gsplatstudio.utils.graphics_utils import qvec2rotmat, qvec2rotmat_batch
 from gsplatstudio.utils.graphics_utils import BasicPointCloud
+from gsplatstudio.utils.ply_utils import write_ply, load_ply_element, read_ply_columns
 
 from tqdm import tqdm
 
@@ -54,27 +57,48 @@ class ColmapImage:
     def __init__(self,uid: int,
                     qvec: np.array,
                     tvec: np.array,
-                    xys: np.array,
-                    point3D_ids: np.array,
                     camera_id: int,
-                    name: str):
+                    name: str,
+                    xys: np.array = None,
+                    point3D_ids: np.array = None,
+                    points2D: np.array = None,
+                    rotmat: np.array = None):
         self.uid = uid
         self.camera_id = camera_id
         self.name = name
         self.qvec = qvec
         self.tvec = tvec
-        self.point3D_ids = point3D_ids
-        self.xys = xys
+        self.rotmat = rotmat
+        # points2D is a POINT2D_DTYPE view into the memory-mapped model file,
+        # xys and point3D_ids are only decoded from it when accessed
+        self.points2D = points2D
+        self._point3D_ids = point3D_ids
+        self._xys = xys
 
     @property
+    def xys(self):
+        if self._xys is None and self.points2D is not None:
+            return np.array(self.points2D["xy"])
+        return self._xys
+    @property
+    def point3D_ids(self):
+        if self._point3D_ids is None and self.points2D is not None:
+            return np.array(self.points2D["point3D_id"])
+        return self._point3D_ids
+    @property
     def R(self):
-        return np.transpose(qvec2rotmat(self.qvec))
+        rotmat = self.rotmat if self.rotmat is not None else qvec2rotmat(self.qvec)
+        return np.transpose(rotmat)
     @property
     def T(self):
         return np.array(self.tvec)
 
 
 
+IMAGE_RECORD_SIZE = 64
+IMAGE_RECORD_DTYPE = np.dtype([("image_id", "<i4"), ("qvec", "<f8", (4,)), ("tvec", "<f8", (3,)), ("camera_id", "<i4")])
+POINT2D_DTYPE = np.dtype([("xy", "<f8", (2,)), ("point3D_id", "<i8")])
+
 def read_next_bytes(fid, num_bytes, format_char_sequence, endian_character="<"):
     """Read and unpack the next bytes from a binary file.
     :param fid:
@@ -88,36 +112,42 @@ def read_next_bytes(fid, num_bytes, format_char_sequence, endian_character="<"):
 
 def read_extrinsics_binary(path_to_model_file):
     """
+    The file is memory-mapped: names are located with a single find per image, poses
+    and camera ids are decoded in bulk and the 2D observations stay lazy views.
     see: src/base/reconstruction.cc
         void Reconstruction::ReadImagesBinary(const std::string& path)
         void Reconstruction::WriteImagesBinary(const std::string& path)
     """
-    images = {}
     with open(path_to_model_file, "rb") as fid:
-        num_reg_images = read_next_bytes(fid, 8, "Q")[0]
-        for _ in range(num_reg_images):
-            binary_image_properties = read_next_bytes(
-                fid, num_bytes=64, format_char_sequence="idddddddi")
-            image_id = binary_image_properties[0]
-            qvec = np.array(binary_image_properties[1:5])
-            tvec = np.array(binary_image_properties[5:8])
-            camera_id = binary_image_properties[8]
-            image_name = ""
-            current_char = read_next_bytes(fid, 1, "c")[0]
-            while current_char != b"\x00":   # look for the ASCII 0 entry
-                image_name += current_char.decode("utf-8")
-                current_char = read_next_bytes(fid, 1, "c")[0]
-            num_points2D = read_next_bytes(fid, num_bytes=8,
-                                           format_char_sequence="Q")[0]
-            x_y_id_s = read_next_bytes(fid, num_bytes=24*num_points2D,
-                                       format_char_sequence="ddq"*num_points2D)
-            xys = np.column_stack([tuple(map(float, x_y_id_s[0::3])),
-                                   tuple(map(float, x_y_id_s[1::3]))])
-            point3D_ids = np.array(tuple(map(int, x_y_id_s[2::3])))
-            images[image_id] = ColmapImage(
-                uid=image_id, qvec=qvec, tvec=tvec,
-                camera_id=camera_id, name=image_name,
-                xys=xys, point3D_ids=point3D_ids)
+        model_file = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+    buffer = np.frombuffer(model_file, dtype=np.uint8)
+    unpack_length = struct.Struct("<Q").unpack_from
+    num_reg_images = unpack_length(model_file, 0)[0]
+
+    # Record layout: image_id (i) | qvec (dddd) | tvec (ddd) | camera_id (i) | name (\0-terminated)
+    #                | num_points2D (Q) | points2D (ddq * num_points2D)
+    offsets, names, points2D = [], [], []
+    offset = 8
+    for _ in range(num_reg_images):
+        offsets.append(offset)
+        name_end = model_file.find(b"\x00", offset + IMAGE_RECORD_SIZE)
+        names.append(model_file[offset + IMAGE_RECORD_SIZE:name_end].decode("utf-8"))
+        num_points2D = unpack_length(model_file, name_end + 1)[0]
+        points2D_start = name_end + 9
+        offset = points2D_start + POINT2D_DTYPE.itemsize * num_points2D
+        points2D.append(buffer[points2D_start:offset].view(POINT2D_DTYPE))
+
+    images = {}
+    if num_reg_images == 0:
+        return images
+    offsets = np.asarray(offsets, dtype=np.int64)
+    records = buffer[offsets[:, None] + np.arange(IMAGE_RECORD_SIZE)].view(IMAGE_RECORD_DTYPE)[:, 0]
+    rotmats = qvec2rotmat_batch(records["qvec"])
+    for idx, image_id in enumerate(records["image_id"].tolist()):
+        images[image_id] = ColmapImage(
+            uid=image_id, qvec=records["qvec"][idx], tvec=records["tvec"][idx],
+            camera_id=int(records["camera_id"][idx]), name=names[idx],
+            points2D=points2D[idx], rotmat=rotmats[idx])
     return images
 
 def read_intrinsics_binary(path_to_model_file):
@@ -128,24 +158,20 @@ def read_intrinsics_binary(path_to_model_file):
     """
     cameras = {}
     with open(path_to_model_file, "rb") as fid:
-        num_cameras = read_next_bytes(fid, 8, "Q")[0]
-        for _ in range(num_cameras):
-            camera_properties = read_next_bytes(
-                fid, num_bytes=24, format_char_sequence="iiQQ")
-            camera_id = camera_properties[0]
-            model_id = camera_properties[1]
-            model_name = GCAMERA_MODEL_IDS[camera_properties[1]].model_name
-            width = camera_properties[2]
-            height = camera_properties[3]
-            num_params = GCAMERA_MODEL_IDS[model_id].num_params
-            params = read_next_bytes(fid, num_bytes=8*num_params,
-                                     format_char_sequence="d"*num_params)
-            cameras[camera_id] = ColmapCamera(uid=camera_id,
-                                        model=model_name,
-                                        width=width,
-                                        height=height,
-                                        params=np.array(params))
-        assert len(cameras) == num_cameras
+        data = fid.read()
+    num_cameras = struct.unpack_from("<Q", data, 0)[0]
+    offset = 8
+    for _ in range(num_cameras):
+        camera_id, model_id, width, height = struct.unpack_from("<iiQQ", data, offset)
+        num_params = GCAMERA_MODEL_IDS[model_id].num_params
+        params = np.frombuffer(data, dtype="<f8", count=num_params, offset=offset + 24)
+        offset += 24 + 8 * num_params
+        cameras[camera_id] = ColmapCamera(uid=camera_id,
+                                    model=GCAMERA_MODEL_IDS[model_id].model_name,
+                                    width=width,
+                                    height=height,
+                                    params=params.astype(np.float64))
+    assert len(cameras) == num_cameras
     return cameras
 
 def read_intrinsics_text(path):
@@ -198,6 +224,10 @@ def read_extrinsics_text(path):
                     uid=image_id, qvec=qvec, tvec=tvec,
                     camera_id=camera_id, name=image_name,
                     xys=xys, point3D_ids=point3D_ids)
+    if images:
+        rotmats = qvec2rotmat_batch(np.stack([image.qvec for image in images.values()]))
+        for image, rotmat in zip(images.values(), rotmats):
+            image.rotmat = rotmat
     return images
 
 def process_camera_image_pair(idx, extr, intr, images_folder):
@@ -216,21 +246,25 @@ def process_camera_image_pair(idx, extr, intr, images_folder):
     camera = BasicCamera(R=extr.R, T=extr.T, fov_y=fov_y, fov_x=fov_x, width=intr.width, height=intr.height,
                         uid=intr.uid)
     image_path = Path(images_folder) / extr.name
-    image = BasicImage(data = Image.open(str(image_path)), path=image_path, name=extr.name)
+    image = BasicImage(path=image_path, name=extr.name, lazy=True)
     cam_img_pair = CameraImagePair(cam=camera, img = image, uid=idx)
     return cam_img_pair
 
-def get_colmap_camera_image_pair_list(cam_extrinsics, cam_intrinsics, images_folder):
-    cam_img_pair_list = []
-    with ThreadPoolExecutor() as executor:
-        futures = []
-        for idx, key in enumerate(cam_extrinsics.keys()):
-            extr = cam_extrinsics[key]
-            intr = cam_intrinsics[extr.camera_id]
-            futures.append(executor.submit(process_camera_image_pair, idx, extr, intr, images_folder))
-
-        for future in tqdm(futures, total=len(futures)):
-            cam_img_pair_list.append(future.result())
+def get_colmap_camera_image_pair_list(cam_extrinsics, cam_intrinsics, images_folder, num_workers=8, executor="thread"):
+    executor_class = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}[executor]
+    extrinsics = list(cam_extrinsics.values())
+    if executor == "process":
+        # Keep the pickled payload small, the 2D observations are not needed to build the pairs
+        extrinsics = [ColmapImage(uid=extr.uid, qvec=extr.qvec, tvec=extr.tvec, camera_id=extr.camera_id,
+                                  name=extr.name, rotmat=extr.rotmat) for extr in extrinsics]
+    intrinsics = [cam_intrinsics[extr.camera_id] for extr in extrinsics]
+
+    max_workers = num_workers if num_workers > 0 else os.cpu_count()
+    chunksize = max(1, len(extrinsics) // (4 * max_workers))
+    with executor_class(max_workers=max_workers) as pool:
+        results = pool.map(process_camera_image_pair, range(len(extrinsics)), extrinsics, intrinsics,
+                               repeat(images_folder), chunksize=chunksize)
+        cam_img_pair_list = list(tqdm(results, total=len(extrinsics)))
 
     return cam_img_pair_list
 
@@ -258,105 +292,106 @@ def get_spatial_scale(cam_image_pair_list):
 
     return {"translate": translate, "radius": radius}
 
-def read_points3D_binary(path_to_model_file):
+POINT3D_RECORD_SIZE = 43
+POINT3D_RECORD_DTYPE = np.dtype([("xyz", "<f8", (3,)), ("rgb", "u1", (3,)), ("error", "<f8")])
+
+def iter_points3D_binary(path_to_model_file, chunk_size=1 << 16):
     """
+    Yield (xyzs, rgbs, errors) chunks of at most chunk_size points from points3D.bin.
+    The file is memory-mapped and tracks are skipped by their length field. Every record
+    starts where the track of the previous one ends, so only this offset scan runs per
+    point; the fixed-size fields of a chunk are then copied with one gather from a view
+    that has a record at every byte.
     see: src/base/reconstruction.cc
         void Reconstruction::ReadPoints3DBinary(const std::string& path)
         void Reconstruction::WritePoints3DBinary(const std::string& path)
     """
-
-
+    buffer = np.memmap(path_to_model_file, dtype=np.uint8, mode="r")
+    unpack_length = struct.Struct("<Q").unpack_from
+    num_points = unpack_length(buffer, 0)[0]
+    if num_points == 0:
+        return
+    # Record layout: point3D_id (Q) | xyz (ddd) | rgb (BBB) | error (d) | track_length (Q) | track (ii * track_length)
+    records = np.ndarray(shape=(buffer.shape[0] - POINT3D_RECORD_DTYPE.itemsize + 1,), dtype=POINT3D_RECORD_DTYPE,
+                         buffer=buffer, strides=(1,))
+    track_length_offset, fixed_size = POINT3D_RECORD_SIZE, POINT3D_RECORD_SIZE + 8
+    offset = 8
+    for start in range(0, num_points, chunk_size):
+        count = min(chunk_size, num_points - start)
+        offsets = []
+        append = offsets.append
+        for _ in range(count):
+            append(offset)
+            offset += fixed_size + 8 * unpack_length(buffer, offset + track_length_offset)[0]
+        # the fields follow the 8-byte point3D_id
+        chunk = records[np.asarray(offsets, dtype=np.int64) + 8]
+        yield chunk["xyz"], chunk["rgb"], chunk["error"][:, None]
+
+def read_points3D_binary(path_to_model_file, chunk_size=1 << 16):
     with open(path_to_model_file, "rb") as fid:
         num_points = read_next_bytes(fid, 8, "Q")[0]
 
-        xyzs = np.empty((num_points, 3))
-        rgbs = np.empty((num_points, 3))
-        errors = np.empty((num_points, 1))
-
-        for p_id in range(num_points):
-            binary_point_line_properties = read_next_bytes(
-                fid, num_bytes=43, format_char_sequence="QdddBBBd")
-            xyz = np.array(binary_point_line_properties[1:4])
-            rgb = np.array(binary_point_line_properties[4:7])
-            error = np.array(binary_point_line_properties[7])
-            track_length = read_next_bytes(
-                fid, num_bytes=8, format_char_sequence="Q")[0]
-            track_elems = read_next_bytes(
-                fid, num_bytes=8*track_length,
-                format_char_sequence="ii"*track_length)
-            xyzs[p_id] = xyz
-            rgbs[p_id] = rgb
-            errors[p_id] = error
+    xyzs = np.empty((num_points, 3))
+    rgbs = np.empty((num_points, 3))
+    errors = np.empty((num_points, 1))
+    start = 0
+    for xyz, rgb, error in iter_points3D_binary(path_to_model_file, chunk_size):
+        end = start + xyz.shape[0]
+        xyzs[start:end] = xyz
+        rgbs[start:end] = rgb
+        errors[start:end] = error
+        start = end
     return xyzs, rgbs, errors
 
-def read_points3D_text(path):
+def iter_points3D_text(path, chunk_size=1 << 16):
     """
+    Yield (xyzs, rgbs, errors) chunks of at most chunk_size points from points3D.txt
+    in a single pass. Only the leading POINT3D_ID, X, Y, Z, R, G, B, ERROR fields
+    of every line are split off; the track is never tokenized.
     see: src/base/reconstruction.cc
         void Reconstruction::ReadPoints3DText(const std::string& path)
         void Reconstruction::WritePoints3DText(const std::string& path)
     """
-    xyzs = None
-    rgbs = None
-    errors = None
-    num_points = 0
-    with open(path, "r") as fid:
-        while True:
-            line = fid.readline()
-            if not line:
-                break
-            line = line.strip()
-            if len(line) > 0 and line[0] != "#":
-                num_points += 1
-
+    def to_arrays(rows):
+        values = np.fromstring(" ".join(rows), sep=" ").reshape(-1, 7)
+        return values[:, 0:3], values[:, 3:6].astype(np.uint8), values[:, 6:7]
 
-    xyzs = np.empty((num_points, 3))
-    rgbs = np.empty((num_points, 3))
-    errors = np.empty((num_points, 1))
-    count = 0
+    rows = []
     with open(path, "r") as fid:
-        while True:
-            line = fid.readline()
-            if not line:
-                break
+        for line in fid:
             line = line.strip()
             if len(line) > 0 and line[0] != "#":
-                elems = line.split()
-                xyz = np.array(tuple(map(float, elems[1:4])))
-                rgb = np.array(tuple(map(int, elems[4:7])))
-                error = np.array(float(elems[7]))
-                xyzs[count] = xyz
-                rgbs[count] = rgb
-                errors[count] = error
-                count += 1
-
+                rows.append(" ".join(line.split(None, 8)[1:8]))
+                if len(rows) == chunk_size:
+                    yield to_arrays(rows)
+                    rows = []
+    if rows:
+        yield to_arrays(rows)
+
+def read_points3D_text(path, chunk_size=1 << 16):
+    chunks = list(iter_points3D_text(path, chunk_size))
+    if not chunks:
+        return np.empty((0, 3)), np.empty((0, 3)), np.empty((0, 1))
+    xyzs = np.concatenate([xyz for xyz, _, _ in chunks]).astype(np.float64)
+    rgbs = np.concatenate([rgb for _, rgb, _ in chunks]).astype(np.float64)
+    errors = np.concatenate([error for _, _, error in chunks]).astype(np.float64)
     return xyzs, rgbs, errors
 
 def fetchPly(path):
-    plydata = PlyData.read(path)
-    vertices = plydata['vertex']
-    positions = np.vstack([vertices['x'], vertices['y'], vertices['z']]).T
-    colors = np.vstack([vertices['red'], vertices['green'], vertices['blue']]).T / 255.0
-    normals = np.vstack([vertices['nx'], vertices['ny'], vertices['nz']]).T
+    vertices = load_ply_element(path, "vertex")
+    positions = read_ply_columns(vertices, ['x', 'y', 'z'])
+    colors = read_ply_columns(vertices, ['red', 'green', 'blue'], dtype=np.uint8) / 255.0
+    normals = read_ply_columns(vertices, ['nx', 'ny', 'nz'])
     return BasicPointCloud(points=positions, colors=colors, normals=normals)
 
 def storePly(path, xyz, rgb):
-    # Define the dtype for the structured array
-    dtype = [('x', 'f4'), ('y', 'f4'), ('z', 'f4'),
-            ('nx', 'f4'), ('ny', 'f4'), ('nz', 'f4'),
-            ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
-    
-    normals = np.zeros_like(xyz)
-
-    elements = np.empty(xyz.shape[0], dtype=dtype)
-    attributes = np.concatenate((xyz, normals, rgb), axis=1)
-    elements[:] = list(map(tuple, attributes))
-
-    # Create the PlyData object and write to file
-    vertex_element = PlyElement.describe(elements, 'vertex')
-    ply_data = PlyData([vertex_element])
-    ply_data.write(path)
+    write_ply(path, [
+        (['x', 'y', 'z'], 'f4', xyz),
+        (['nx', 'ny', 'nz'], 'f4', None),
+        (['red', 'green', 'blue'], 'u1', rgb),
+    ])
 
-def load_colmap_folder(colmap_folder):
+def load_colmap_folder(colmap_folder, num_workers=8, executor="thread"):
     try:
         cameras_extrinsic_file = Path(colmap_folder) / "sparse" / "0" / "images.bin"
         cameras_intrinsic_file = Path(colmap_folder) / "sparse" / "0" / "cameras.bin"
@@ -368,7 +403,8 @@ def load_colmap_folder(colmap_folder):
         cam_extrinsics = read_extrinsics_text(str(cameras_extrinsic_file))
         cam_intrinsics = read_intrinsics_text(str(cameras_intrinsic_file))
     images_folder = Path(colmap_folder) / "images"
-    pair_list_unsorted = get_colmap_camera_image_pair_list(cam_extrinsics=cam_extrinsics, cam_intrinsics=cam_intrinsics, images_folder=images_folder)
+    pair_list_unsorted = get_colmap_camera_image_pair_list(cam_extrinsics=cam_extrinsics, cam_intrinsics=cam_intrinsics, images_folder=images_folder,
+                                                           num_workers=num_workers, executor=executor)
     pair_list = sorted(pair_list_unsorted.copy(), key = lambda x : x.image.name)
 
 
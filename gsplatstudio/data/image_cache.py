@@ -0,0 +1,202 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+import torch
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+
+class DiskImageCache:
+    """
+    Resized ground-truth images of one dataset and resolution, packed as raw uint8
+    [channels, height, width] blocks in a single memory-mapped file.
+
+    The cache file is content-addressed: its name is a hash of every image path,
+    mtime, size and target resolution, so experiments sharing a source_path reuse it
+    and any change to the images or resolution builds a new one.
+    """
+    def __init__(self, cache_dir, images, resolution_input, resolution_scale, num_workers=8, logger=None):
+        self.cache_dir = Path(cache_dir)
+        self.logger = logger
+        self.resolution_input, self.resolution_scale = resolution_input, resolution_scale
+
+        entries = []
+        for image in sorted(images, key=lambda image: str(image.path)):
+            stat = os.stat(image.path)
+            height, width = image.get_resolution(resolution_input, resolution_scale)
+            entries.append((str(Path(image.path).resolve()), stat.st_mtime_ns, stat.st_size, image.channels, height, width))
+        self.key = hashlib.sha1(json.dumps(entries).encode("utf-8")).hexdigest()
+        self.data_path = self.cache_dir / f"{self.key}.u8"
+        self.index_path = self.cache_dir / f"{self.key}.json"
+
+        if not self.index_path.exists():
+            self.build(images, entries, num_workers)
+        with open(self.index_path, "r") as file:
+            self.index = {path: (offset, tuple(shape)) for path, offset, shape in json.load(file)}
+        self.buffer = np.memmap(self.data_path, dtype=np.uint8, mode="r") if self.data_path.stat().st_size > 0 else None
+
+    def build(self, images, entries, num_workers):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        index, offset = [], 0
+        for path, _, _, channels, height, width in entries:
+            index.append((path, offset, (channels, height, width)))
+            offset += channels * height * width
+        if self.logger is not None:
+            self.logger.info(f"Building image cache {self.data_path} for {len(entries)} images ({offset / 2**20:.1f} MiB)...")
+
+        # Write to private temporary files and rename, parallel trials may build the same cache
+        tmp_suffix = f".tmp-{os.getpid()}"
+        tmp_data_path = self.data_path.with_name(self.data_path.name + tmp_suffix)
+        tmp_index_path = self.index_path.with_name(self.index_path.name + tmp_suffix)
+        if offset > 0:
+            buffer = np.memmap(tmp_data_path, dtype=np.uint8, mode="w+", shape=(offset,))
+            slots = {path: (start, shape) for path, start, shape in index}
+
+            def write(image):
+                start, shape = slots[str(Path(image.path).resolve())]
+                data = image.load_resolution_data(shape[1:])
+                assert tuple(data.shape) == shape, f"Unexpected image shape {tuple(data.shape)} for {image.path}, expected {shape}"
+                data = (data * 255.0).round().clamp(0, 255).to(torch.uint8)
+                buffer[start:start + data.numel()] = data.numpy().reshape(-1)
+
+            with ThreadPoolExecutor(max_workers=num_workers if num_workers > 0 else os.cpu_count()) as pool:
+                list(tqdm(pool.map(write, images), total=len(images), desc="Building image cache"))
+            buffer.flush()
+            del buffer
+        else:
+            tmp_data_path.touch()
+        with open(tmp_index_path, "w") as file:
+            json.dump(index, file)
+        os.replace(tmp_data_path, self.data_path)
+        os.replace(tmp_index_path, self.index_path)
+
+    def __contains__(self, path):
+        return str(Path(path).resolve()) in self.index
+
+    def read(self, path):
+        """Return the cached image as a [channels, height, width] uint8 tensor."""
+        offset, shape = self.index[str(Path(path).resolve())]
+        data = np.array(self.buffer[offset:offset + int(np.prod(shape))]).reshape(shape)
+        return torch.from_numpy(data)
+
+
+class MemoryImageCache:
+    """
+    LRU cache of ground-truth images shared by all BasicImages of a data module.
+
+    Images are kept compact (uint8 or float16) and normalized to float32 on the device
+    when requested. Two tiers with separate byte budgets are available: host memory
+    (pinned when the device is a GPU) and device memory. The placement policy is one of
+        "none":   nothing is cached, every request loads the image again
+        "host":   cache in host memory only
+        "device": cache in device memory only
+        "tiered": cache in device memory, entries evicted from it are demoted to host memory
+    A budget < 0 is unbounded. On a cpu device both tiers are host memory, so "device" and
+    "tiered" behave like "host".
+    """
+    POLICIES = ("none", "host", "device", "tiered")
+
+    def __init__(self, policy="tiered", device="cuda", dtype="uint8", host_budget_mb=-1, device_budget_mb=-1):
+        assert policy in self.POLICIES, f"Unknown image cache policy {policy}, expected one of {self.POLICIES}"
+        assert dtype in ("uint8", "float16"), f"Unknown image cache dtype {dtype}, expected uint8 or float16"
+        self.device = torch.device(device)
+        self.dtype = torch.uint8 if dtype == "uint8" else torch.float16
+        if self.device.type == "cpu" and policy in ("device", "tiered"):
+            policy = "host"
+        self.policy = policy
+        self.tiers = {"host": OrderedDict(), "device": OrderedDict()}
+        self.used = {"host": 0, "device": 0}
+        self.budget = {"host": self.to_bytes(host_budget_mb) if policy in ("host", "tiered") else 0,
+                       "device": self.to_bytes(device_budget_mb) if policy in ("device", "tiered") else 0}
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        # prefetch workers share the cache with the training loop
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def to_bytes(budget_mb):
+        return float("inf") if budget_mb < 0 else budget_mb * 2**20
+
+    @property
+    def stats(self):
+        return {
+            "image_cache_hits": self.hits,
+            "image_cache_misses": self.misses,
+            "image_cache_evictions": self.evictions,
+            "image_cache_host_mb": self.used["host"] / 2**20,
+            "image_cache_device_mb": self.used["device"] / 2**20,
+        }
+
+    def to_compact(self, data):
+        if data.dtype == self.dtype:
+            return data
+        if data.dtype == torch.uint8:
+            return (data.float() / 255.0).to(self.dtype)
+        if self.dtype == torch.uint8:
+            return (data * 255.0).round().clamp(0, 255).to(torch.uint8)
+        return data.to(self.dtype)
+
+    def normalize(self, compact):
+        data = compact.to(self.device, non_blocking=True)
+        if data.dtype == torch.uint8:
+            return data.float() / 255.0
+        return data.float()
+
+    def lookup(self, key):
+        """Return the compact tensor cached under key (on the host or the device) or None."""
+        with self.lock:
+            for tier in ("device", "host"):
+                compact = self.tiers[tier].get(key)
+                if compact is not None:
+                    self.tiers[tier].move_to_end(key)
+                    self.hits += 1
+                    if tier == "host" and self.policy == "tiered":
+                        self._pop(tier, key)
+                        compact = self._place("device", key, compact)
+                    return compact
+            self.misses += 1
+            return None
+
+    def insert(self, key, compact):
+        """Cache a compact tensor following the placement policy and return the stored tensor."""
+        with self.lock:
+            if self.policy == "none" or key in self.tiers["device"] or key in self.tiers["host"]:
+                return compact
+            return self._place("host" if self.policy == "host" else "device", key, compact)
+
+    def get(self, key, loader):
+        """Return the float32 image cached under key, calling loader() on a miss."""
+        compact = self.lookup(key)
+        if compact is None:
+            compact = self.insert(key, self.to_compact(loader()))
+        return self.normalize(compact)
+
+    def _pop(self, tier, key):
+        compact = self.tiers[tier].pop(key)
+        self.used[tier] -= compact.numel() * compact.element_size()
+        return compact
+
+    def _place(self, tier, key, compact):
+        size = compact.numel() * compact.element_size()
+        if size > self.budget[tier]:
+            if tier == "device" and self.policy == "tiered":
+                return self._place("host", key, compact)
+            return compact
+        while self.used[tier] + size > self.budget[tier]:
+            evicted_key, _ = next(iter(self.tiers[tier].items()))
+            evicted = self._pop(tier, evicted_key)
+            self.evictions += 1
+            if tier == "device" and self.policy == "tiered":
+                self._place("host", evicted_key, evicted)
+        if tier == "device":
+            compact = compact.to(self.device, non_blocking=True)
+        else:
+            compact = compact.cpu()
+            if self.device.type == "cuda":
+                compact = compact.pin_memory()
+        self.tiers[tier][key] = compact
+        self.used[tier] += size
+        return compact
@@ -0,0 +1,93 @@
+import os
+import json
+import hashlib
+import numpy as np
+from pathlib import Path
+from gsplatstudio.utils.camera_utils import BasicCamera, BasicImage, CameraImagePair
+from gsplatstudio.utils.graphics_utils import BasicPointCloud
+
+MANIFEST_VERSION = 1
+# written next to the sparse model by the first load, not part of the reconstruction itself
+DERIVED_SPARSE_FILES = ["points3D.ply"]
+
+
+class DatasetManifest:
+    """
+    Everything ColmapDataModule derives from a COLMAP folder, stored as one uncompressed npz:
+    camera arrays, image names and sizes, train/test split, spatial scale, point cloud and
+    the bytes of input.ply and cameras.json.
+
+    The file name is a hash of the sparse/0 and images listings (names, sizes, mtimes) and
+    the split setting, so a changed dataset gets a new manifest and experiments sharing a
+    source_path share it.
+    """
+    def __init__(self, source_path, eval, cache_dir=None):
+        self.source_path = Path(source_path)
+        self.cache_dir = Path(cache_dir) if cache_dir else self.source_path / "cache"
+        self.key = self.compute_key(eval)
+        self.path = self.cache_dir / f"manifest_{self.key}.npz"
+
+    def compute_key(self, eval):
+        entries = [MANIFEST_VERSION, eval]
+        for folder in [self.source_path / "sparse" / "0", self.source_path / "images"]:
+            listing = []
+            if folder.is_dir():
+                for entry in os.scandir(folder):
+                    if entry.is_file() and entry.name not in DERIVED_SPARSE_FILES:
+                        stat = entry.stat()
+                        listing.append((entry.name, stat.st_size, stat.st_mtime_ns))
+            entries.append(sorted(listing))
+        return hashlib.sha1(json.dumps(entries).encode("utf-8")).hexdigest()
+
+    def exists(self):
+        return self.path.exists()
+
+    def save(self, pair_list, train_index, test_index, spatial_scale, point_cloud, ply_path):
+        cameras = [pair.camera for pair in pair_list]
+        images = [pair.image for pair in pair_list]
+        with open(ply_path, "rb") as file:
+            ply_bytes = file.read()
+        cameras_json = json.dumps([pair.json for pair in pair_list]).encode("utf-8")
+        arrays = {
+            "pair_uid": np.array([pair.uid for pair in pair_list], dtype=np.int64),
+            "camera_uid": np.array([camera.uid for camera in cameras], dtype=np.int64),
+            "R": np.array([camera.R for camera in cameras], dtype=np.float64).reshape(-1, 3, 3),
+            "T": np.array([camera.T for camera in cameras], dtype=np.float64).reshape(-1, 3),
+            "fov": np.array([(camera.fov_x, camera.fov_y) for camera in cameras], dtype=np.float64).reshape(-1, 2),
+            "camera_size": np.array([(camera.width, camera.height) for camera in cameras], dtype=np.int64).reshape(-1, 2),
+            "image_name": np.array([image.name for image in images], dtype=np.str_),
+            "image_shape": np.array([(image.channels, image.height, image.width) for image in images], dtype=np.int64).reshape(-1, 3),
+            "train_index": np.asarray(train_index, dtype=np.int64),
+            "test_index": np.asarray(test_index, dtype=np.int64),
+            "spatial_scale": np.asarray(spatial_scale),
+            "ply": np.frombuffer(ply_bytes, dtype=np.uint8),
+            "cameras_json": np.frombuffer(cameras_json, dtype=np.uint8),
+        }
+        if point_cloud is not None:
+            arrays.update(points=point_cloud.points, colors=point_cloud.colors, normals=point_cloud.normals)
+
+        # Private temporary file and rename, parallel trials may write the same manifest
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + f".tmp-{os.getpid()}.npz")
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """Return (pair_list, train_index, test_index, spatial_scale, point_cloud, ply_bytes, cameras_json_bytes)."""
+        with np.load(self.path) as manifest:
+            arrays = {name: manifest[name] for name in manifest.files}
+        images_folder = self.source_path / "images"
+        pair_list = []
+        for idx, name in enumerate(arrays["image_name"].tolist()):
+            width, height = arrays["camera_size"][idx].tolist()
+            fov_x, fov_y = arrays["fov"][idx].tolist()
+            camera = BasicCamera(R=arrays["R"][idx], T=arrays["T"][idx], fov_y=fov_y, fov_x=fov_x,
+                                 width=width, height=height, uid=int(arrays["camera_uid"][idx]))
+            image = BasicImage(path=images_folder / name, name=name, lazy=True,
+                               shape=tuple(arrays["image_shape"][idx].tolist()))
+            pair_list.append(CameraImagePair(cam=camera, img=image, uid=int(arrays["pair_uid"][idx])))
+        point_cloud = None
+        if "points" in arrays:
+            point_cloud = BasicPointCloud(points=arrays["points"], colors=arrays["colors"], normals=arrays["normals"])
+        return (pair_list, arrays["train_index"].tolist(), arrays["test_index"].tolist(),
+                arrays["spatial_scale"][()], point_cloud, arrays["ply"].tobytes(), arrays["cameras_json"].tobytes())
@@ -0,0 +1,108 @@
+import time
+import torch
+from random import randint
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ViewpointSampler:
+    """
+    Draws training views exactly like VanillaTrainer: a random view is popped from a
+    copy of the train list that is refilled once empty. Drawing ahead of time gives the
+    same order for a given seed as long as nothing else consumes the random module.
+    """
+    def __init__(self, get_pair_list, total):
+        self.get_pair_list = get_pair_list
+        self.remaining = total
+        self.viewpoint_stack = None
+
+    def __len__(self):
+        return self.remaining
+
+    def next(self):
+        if self.remaining <= 0:
+            return None
+        self.remaining -= 1
+        if not self.viewpoint_stack:
+            self.viewpoint_stack = self.get_pair_list().copy()
+        return self.viewpoint_stack.pop(randint(0, len(self.viewpoint_stack)-1))
+
+
+class ViewpointPrefetcher:
+    """
+    Loads the ground truth of the next `depth` training views in worker threads.
+
+    Workers decode (or read from the image caches) into pinned host buffers and start the
+    host-to-device copy on a side CUDA stream; the training loop only waits on the copy
+    event, so I/O, decode and transfer overlap with render and backward.
+    """
+    def __init__(self, get_pair_list, total, resolution_input, resolution_scale, device, depth=4, num_workers=2):
+        self.sampler = ViewpointSampler(get_pair_list, total)
+        self.resolution_input, self.resolution_scale = resolution_input, resolution_scale
+        self.device = torch.device(device)
+        self.depth = depth
+        self.stream = torch.cuda.Stream(device=self.device) if self.device.type == "cuda" else None
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.queue = deque()
+        self.stall_time = 0.0
+        self.last_stall_time = 0.0
+        self.fill()
+
+    @property
+    def stats(self):
+        return {"prefetch_stall_ms": self.last_stall_time * 1000.0,
+                "prefetch_total_stall_ms": self.stall_time * 1000.0}
+
+    def fill(self):
+        while len(self.queue) < self.depth:
+            viewpoint_pair = self.sampler.next()
+            if viewpoint_pair is None:
+                break
+            self.queue.append((viewpoint_pair, self.executor.submit(self.load, viewpoint_pair.image)))
+
+    def load(self, image):
+        resolution = image.get_resolution(self.resolution_input, self.resolution_scale)
+        key = (str(image.path), resolution)
+        cache = image.memory_cache
+        data = cache.lookup(key) if cache is not None else None
+        is_cached = data is not None
+        if not is_cached:
+            data = image.read_resolution_data(resolution)
+            if cache is not None:
+                data = cache.to_compact(data)
+        event = None
+        if self.stream is not None and data.device.type == "cpu":
+            data = data.pin_memory()
+            with torch.cuda.stream(self.stream):
+                data = data.to(self.device, non_blocking=True)
+                event = torch.cuda.Event()
+                event.record(self.stream)
+        return data, event, key, cache, is_cached
+
+    def next(self):
+        """Return the next (viewpoint_pair, gt_image) in sampling order, gt_image on the device."""
+        viewpoint_pair, future = self.queue.popleft()
+        start = time.perf_counter()
+        data, event, key, cache, is_cached = future.result()
+        self.last_stall_time = time.perf_counter() - start
+        self.stall_time += self.last_stall_time
+        self.fill()
+
+        if event is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_event(event)
+            data.record_stream(current_stream)
+        if cache is not None:
+            if not is_cached:
+                data = cache.insert(key, data)
+            return viewpoint_pair, cache.normalize(data)
+        data = data.to(self.device)
+        if data.dtype == torch.uint8:
+            data = data.float() / 255.0
+        return viewpoint_pair, data
+
+    def close(self):
+        for _, future in self.queue:
+            future.cancel()
+        self.queue.clear()
+        self.executor.shutdown(wait=True)
@@ -1,8 +1,7 @@
 import gsplatstudio
 import torch
 import torch.nn.functional as F
-from torch.autograd import Variable
-from math import exp
+from functools import lru_cache
 from gsplatstudio.utils.type_utils import *
 from gsplatstudio.models.loss.base_loss import BaseLoss
 
@@ -30,47 +29,85 @@ def l1_loss(network_output, gt):
 def l2_loss(network_output, gt):
     return ((network_output - gt) ** 2).mean()
 
-def gaussian(window_size, sigma):
-    gauss = torch.Tensor([exp(-(x - window_size // 2) ** 2 / float(2 * sigma ** 2)) for x in range(window_size)])
-    return gauss / gauss.sum()
+SSIM_C1 = 0.01 ** 2
+SSIM_C2 = 0.03 ** 2
+
+@lru_cache(maxsize=None)
+def gaussian_window(window_size, sigma, dtype, device):
+    """Normalized 1D Gaussian window, cached per size, dtype and device."""
+    coords = torch.arange(window_size, dtype=torch.float64) - window_size // 2
+    gauss = torch.exp(-coords ** 2 / (2 * sigma ** 2))
+    return (gauss / gauss.sum()).to(device=device, dtype=dtype)
+
+def filter_maps(maps, window):
+    """Separable Gaussian filter of maps [..., H, W] with zero padding, all maps at once."""
+    size, radius = window.shape[0], window.shape[0] // 2
+    height, width = maps.shape[-2:]
+    if maps.is_cuda:
+        flat = maps.reshape(-1, 1, height, width)
+        flat = F.conv2d(flat, window.view(1, 1, 1, size), padding=(0, radius))
+        return F.conv2d(flat, window.view(1, 1, size, 1), padding=(radius, 0)).view(maps.shape)
+    # on CPU shifted multiply-adds beat convolutions with thin kernels
+    weights = window.tolist()
+    padded = F.pad(maps, (radius, radius))
+    rows = padded[..., 0:width] * weights[0]
+    for k in range(1, size):
+        rows.add_(padded[..., k:k + width], alpha=weights[k])
+    padded = F.pad(rows, (0, 0, radius, radius))
+    result = padded[..., 0:height, :] * weights[0]
+    for k in range(1, size):
+        result.add_(padded[..., k:k + height, :], alpha=weights[k])
+    return result
+
+def ssim_terms(img1, img2, window):
+    moments = filter_maps(torch.stack((img1, img2, img1 * img1, img2 * img2, img1 * img2)), window)
+    mu1, mu2, e11, e22, e12 = moments.unbind(0)
+    A1 = 2 * mu1 * mu2 + SSIM_C1
+    A2 = 2 * (e12 - mu1 * mu2) + SSIM_C2
+    B1 = mu1 * mu1 + mu2 * mu2 + SSIM_C1
+    B2 = (e11 - mu1 * mu1) + (e22 - mu2 * mu2) + SSIM_C2
+    return mu1, mu2, A1, A2, B1, B2
+
+
+class SSIMFunction(torch.autograd.Function):
+    """
+    SSIM map of [B, C, H, W] images reduced per image, with an analytic backward that keeps the
+    inputs and the five filtered moments only, instead of every intermediate of the graph.
+    """
+    @staticmethod
+    def forward(ctx, img1, img2, window):
+        mu1, mu2, A1, A2, B1, B2 = ssim_terms(img1, img2, window)
+        ssim_map = (A1 * A2) / (B1 * B2)
+        ctx.save_for_backward(img1, img2, mu1, mu2, A1, A2, B1, B2, window)
+        return ssim_map.flatten(1).mean(1)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        img1, img2, mu1, mu2, A1, A2, B1, B2, window = ctx.saved_tensors
+        grad_map = (grad_output / img1[0].numel()).view(-1, 1, 1, 1)
+        S = (A1 * A2) / (B1 * B2)
+        # derivatives of the map with respect to the filtered moments mu, E[x^2] and E[xy]
+        d_e11 = -grad_map * S / B2
+        d_e12 = grad_map * 2 * A1 / (B1 * B2)
+        d_mu1 = grad_map * (2 * mu2 * (A2 - A1) / (B1 * B2) - 2 * mu1 * S / B1 + 2 * mu1 * S / B2)
+        d_mu2 = grad_map * (2 * mu1 * (A2 - A1) / (B1 * B2) - 2 * mu2 * S / B1 + 2 * mu2 * S / B2)
+        # the symmetric window makes the filter its own adjoint
+        d_mu1, d_mu2, d_e11, d_e12 = filter_maps(torch.stack((d_mu1, d_mu2, d_e11, d_e12)), window).unbind(0)
+        grad1 = d_mu1 + 2 * img1 * d_e11 + img2 * d_e12 if ctx.needs_input_grad[0] else None
+        grad2 = d_mu2 + 2 * img2 * d_e11 + img1 * d_e12 if ctx.needs_input_grad[1] else None
+        return grad1, grad2, None
 
-def create_window(window_size, channel):
-    _1D_window = gaussian(window_size, 1.5).unsqueeze(1)
-    _2D_window = _1D_window.mm(_1D_window.t()).float().unsqueeze(0).unsqueeze(0)
-    window = Variable(_2D_window.expand(channel, 1, window_size, window_size).contiguous())
-    return window
 
 def ssim(img1, img2, window_size=11, size_average=True):
-    channel = img1.size(-3)
-    window = create_window(window_size, channel)
-
-    if img1.is_cuda:
-        window = window.cuda(img1.get_device())
-    window = window.type_as(img1)
-
-    return _ssim(img1, img2, window, window_size, channel, size_average)
-
-def _ssim(img1, img2, window, window_size, channel, size_average=True):
-    mu1 = F.conv2d(img1, window, padding=window_size // 2, groups=channel)
-    mu2 = F.conv2d(img2, window, padding=window_size // 2, groups=channel)
-
-    mu1_sq = mu1.pow(2)
-    mu2_sq = mu2.pow(2)
-    mu1_mu2 = mu1 * mu2
-
-    sigma1_sq = F.conv2d(img1 * img1, window, padding=window_size // 2, groups=channel) - mu1_sq
-    sigma2_sq = F.conv2d(img2 * img2, window, padding=window_size // 2, groups=channel) - mu2_sq
-    sigma12 = F.conv2d(img1 * img2, window, padding=window_size // 2, groups=channel) - mu1_mu2
-
-    C1 = 0.01 ** 2
-    C2 = 0.03 ** 2
-
-    ssim_map = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2))
-
+    """SSIM of [C, H, W] or [B, C, H, W] images, averaged over everything or per image."""
+    unbatched = img1.dim() == 3
+    if unbatched:
+        img1, img2 = img1.unsqueeze(0), img2.unsqueeze(0)
+    window = gaussian_window(window_size, 1.5, img1.dtype, img1.device)
+    values = SSIMFunction.apply(img1, img2.to(img1.dtype), window)
     if size_average:
-        return ssim_map.mean()
-    else:
-        return ssim_map.mean(1).mean(1).mean(1)
+        return values.mean()
+    return values[0] if unbatched else values
 
 def mse(img1, img2):
     return (((img1 - img2)) ** 2).view(img1.shape[0], -1).mean(1, keepdim=True)
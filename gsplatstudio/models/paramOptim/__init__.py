@@ -1,4 +1,5 @@
 from . import (
     adam_customlr_paramOptim,
+    flat_adam_paramOptim,
     base_paramOptim
-)
\ No newline at end of file
+)
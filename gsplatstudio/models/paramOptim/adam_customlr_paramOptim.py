@@ -3,6 +3,8 @@ import torch.nn as nn
 import gsplatstudio
 from gsplatstudio.utils.gaussian_utils import get_expon_lr_func
 from gsplatstudio.utils.type_utils import *
+from gsplatstudio.utils.growable_storage import GrowableStorage
+from gsplatstudio.utils.checkpoint_utils import compact_storage
 from gsplatstudio.models.paramOptim.base_paramOptim import BaseParamOptim
 
 
@@ -16,10 +18,13 @@ class AdamWithcustomlrParamOptimConfig:
     rotation_lr: float = 0.001
     scaling_lr: float = 0.005
     opacity_lr: float = 0.05
+    # parameters and moments keep spare rows for densification and grow by this factor when they run out
+    growth_factor: float = 2.0
 
 
 @gsplatstudio.register("adam+customLR-paramOptim")
 class AdamWithcustomlrParamOptim(BaseParamOptim):
+    reserves_capacity = True
 
     @property
     def config_class(self):
@@ -27,12 +32,23 @@ class AdamWithcustomlrParamOptim(BaseParamOptim):
     
     @property
     def state(self):
-        return self.optimizer.state_dict()
+        state = self.optimizer.state_dict()
+        # the per-parameter dicts are the live ones, copy them around the compacted moments
+        state["state"] = {index: {key: compact_storage(value) if torch.is_tensor(value) else value for key, value in param_state.items()}
+                          for index, param_state in state["state"].items()}
+        return state
     
     def _restore(self, state, spatial_lr_scale, param_lr_group, max_iter):
         self.optimizer = torch.optim.Adam(param_lr_group, lr=0.0, eps=1e-15)
         self.optimizer.load_state_dict(state)
+        self.stores = {}
+        # step counters live on the host, keep them there if the checkpoint was mapped to the device
+        for param_state in self.optimizer.state.values():
+            if torch.is_tensor(param_state.get("step")):
+                param_state["step"] = param_state["step"].cpu()
         self.spatial_lr_scale = spatial_lr_scale 
+        self.base_lrs = {group["name"]: group["lr"] for group in param_lr_group}
+        self.lr_scale = 1.0
         self.xyz_lr_schedule = get_expon_lr_func(lr_init=self.cfg.position_lr_init*spatial_lr_scale,
                                                         lr_final=self.cfg.position_lr_final*spatial_lr_scale,
                                                         lr_delay_mult=self.cfg.position_lr_delay_mult,
@@ -41,6 +57,9 @@ class AdamWithcustomlrParamOptim(BaseParamOptim):
 
     def init_optim(self, param_lr_group, spatial_lr_scale, max_iter):
         self.optimizer = torch.optim.Adam(param_lr_group, lr=0.0, eps=1e-15)
+        self.stores = {}
+        self.base_lrs = {group["name"]: group["lr"] for group in param_lr_group}
+        self.lr_scale = 1.0
         self.xyz_lr_schedule = get_expon_lr_func(lr_init=self.cfg.position_lr_init*spatial_lr_scale,
                                                 lr_final=self.cfg.position_lr_final*spatial_lr_scale,
                                                 lr_delay_mult=self.cfg.position_lr_delay_mult,
@@ -50,33 +69,22 @@ class AdamWithcustomlrParamOptim(BaseParamOptim):
     def update_lr(self,iteration):
         for param_group in self.optimizer.param_groups:
             if param_group["name"] == "xyz":
-                lr = self.xyz_lr_schedule(iteration)
+                lr = self.xyz_lr_schedule(iteration) * self.lr_scale
                 param_group['lr'] = lr
                 return lr
+
+    def set_lr_scale(self, scale):
+        self.lr_scale = scale
+        for param_group in self.optimizer.param_groups:
+            param_group['lr'] = self.base_lrs[param_group["name"]] * scale
             
-    def update_optim(self,iteration):
+    def update_optim(self,iteration, visibility_filter=None):
         if iteration < self.max_iter:
             self.optimizer.step()
             self.optimizer.zero_grad(set_to_none = True)
 
     def prune_optim(self, mask):
-        optimizable_tensors = {}
-        for group in self.optimizer.param_groups:
-            stored_state = self.optimizer.state.get(group['params'][0], None)
-            if stored_state is not None:
-                stored_state["exp_avg"] = stored_state["exp_avg"][mask]
-                stored_state["exp_avg_sq"] = stored_state["exp_avg_sq"][mask]
-
-                del self.optimizer.state[group['params'][0]]
-                group["params"][0] = nn.Parameter((group["params"][0][mask].requires_grad_(True)))
-                self.optimizer.state[group['params'][0]] = stored_state
-
-                optimizable_tensors[group["name"]] = group["params"][0]
-            else:
-                group["params"][0] = nn.Parameter(group["params"][0][mask].requires_grad_(True))
-                optimizable_tensors[group["name"]] = group["params"][0]
-        
-        return optimizable_tensors
+        return self.rebuild_tensors(torch.nonzero(mask).squeeze(1), None)
 
     def replace_tensor(self, tensor, name):
         optimizable_tensors = {}
@@ -94,25 +102,40 @@ class AdamWithcustomlrParamOptim(BaseParamOptim):
         return optimizable_tensors
 
     def cat_tensors(self, tensors_dict):
+        num_points = self.optimizer.param_groups[0]["params"][0].shape[0]
+        return self.rebuild_tensors(torch.arange(num_points, device=tensors_dict["xyz"].device), tensors_dict)
+
+    def rebuild_tensors(self, keep_index, tensors_dict, chunk_size=None):
         optimizable_tensors = {}
         for group in self.optimizer.param_groups:
             assert len(group["params"]) == 1
-            extension_tensor = tensors_dict[group["name"]]
+            extension_tensor = None if tensors_dict is None else tensors_dict[group["name"]]
             stored_state = self.optimizer.state.get(group['params'][0], None)
+            tensor = self.rebuild_rows((group["name"], "param"), group["params"][0].detach(), keep_index, extension_tensor, chunk_size)
             if stored_state is not None:
-                stored_state["exp_avg"] = torch.cat((stored_state["exp_avg"], torch.zeros_like(extension_tensor)), dim=0)
-                stored_state["exp_avg_sq"] = torch.cat((stored_state["exp_avg_sq"], torch.zeros_like(extension_tensor)), dim=0)
-
+                for key in ["exp_avg", "exp_avg_sq"]:
+                    stored_state[key] = self.rebuild_rows((group["name"], key), stored_state[key], keep_index,
+                                                          None if extension_tensor is None else torch.zeros_like(extension_tensor), chunk_size)
                 del self.optimizer.state[group['params'][0]]
-                group["params"][0] = nn.Parameter(torch.cat((group["params"][0], extension_tensor), dim=0).requires_grad_(True))
+            group["params"][0] = nn.Parameter(tensor.requires_grad_(True))
+            if stored_state is not None:
                 self.optimizer.state[group['params'][0]] = stored_state
-                optimizable_tensors[group["name"]] = group["params"][0]
-            else:
-                group["params"][0] = nn.Parameter(torch.cat((group["params"][0], extension_tensor), dim=0).requires_grad_(True))
-                optimizable_tensors[group["name"]] = group["params"][0]
+            optimizable_tensors[group["name"]] = group["params"][0]
 
         return optimizable_tensors
-    
+
+    def rebuild_rows(self, key, tensor, keep_index, extension_tensor, chunk_size=None):
+        """Compact the rows keep_index of tensor in place and append extension_tensor, in the reserved capacity."""
+        store = self.stores.get(key)
+        # tensors replaced since the last rebuild, e.g. by replace_tensor or Adam's first step, get a store of their own
+        if store is None or tensor.untyped_storage().data_ptr() != store.storage.untyped_storage().data_ptr():
+            store = GrowableStorage(tensor, growth_factor=self.cfg.growth_factor)
+            self.stores[key] = store
+        store.compact(keep_index, chunk_size)
+        if extension_tensor is not None:
+            store.append(extension_tensor.detach())
+        return store.active
+
     def print_state(self):
         state_dict = self.optimizer.state_dict()
         for param_group in state_dict['param_groups']:
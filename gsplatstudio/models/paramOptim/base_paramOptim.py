@@ -4,6 +4,9 @@ from gsplatstudio.utils.config import parse_structured
 
 
 class BaseParamOptim(ABC):
+    # whether the parameters live in storage with spare capacity that densification reuses
+    reserves_capacity = False
+
     def __init__(self, cfg, logger) -> None:
         self.cfg = parse_structured(self.config_class, cfg)
         self.logger = logger
@@ -27,12 +30,27 @@ class BaseParamOptim(ABC):
         pass
         
     @abstractmethod 
-    def update_optim(self, iteration):
+    def update_optim(self, iteration, visibility_filter=None):
+        """visibility_filter marks the Gaussians that received gradient in this step, if the caller knows them."""
+        pass
+
+    def backward(self, loss):
+        """Backpropagate loss into the parameters of this paramOptim."""
+        loss.backward()
+
+    @abstractmethod
+    def rebuild_tensors(self, keep_index, tensors_dict, chunk_size=None):
+        """Keep the rows keep_index and append tensors_dict behind them in one pass; returns the new parameters."""
+        pass
+
+    @abstractmethod
+    def set_lr_scale(self, scale):
+        """Multiply every learning rate by scale, e.g. for steps over several views."""
         pass
 
     def restore(self, state, max_iter, **kwargs):
         self.logger.info(f"Start restoring paramOptim {self.__class__.__name__}...")
-        self._restore(state, max_iter, **kwargs)
+        self._restore(state, max_iter=max_iter, **kwargs)
         self.logger.info(f"End restoring paramOptim {self.__class__.__name__}...")
 
 
@@ -0,0 +1,238 @@
+import math
+import warnings
+import torch
+import torch.nn as nn
+import gsplatstudio
+from gsplatstudio.utils.gaussian_utils import get_expon_lr_func
+from gsplatstudio.utils.type_utils import *
+from gsplatstudio.utils.growable_storage import GrowableStorage
+from gsplatstudio.utils.checkpoint_utils import compact_storage
+from gsplatstudio.models.paramOptim.base_paramOptim import BaseParamOptim
+
+@dataclass
+class FlatAdamParamOptimConfig:
+    position_lr_delay_mult: float = 0.01
+    position_lr_final: float = 1.6e-06
+    position_lr_init:float =  0.00016
+    position_lr_max_steps: float = 30000
+    feature_lr: float = 0.0025
+    rotation_lr: float = 0.001
+    scaling_lr: float = 0.005
+    opacity_lr: float = 0.05
+    beta1: float = 0.9
+    beta2: float = 0.999
+    eps: float = 1e-15
+    # step only the Gaussians in the visibility filter, with per-Gaussian step counts for the bias correction
+    sparse_update: bool = False
+    # the buffers keep spare rows for densification and grow by this factor when they run out
+    growth_factor: float = 2.0
+
+
+@gsplatstudio.register("flatAdam-paramOptim")
+class FlatAdamParamOptim(BaseParamOptim):
+    """
+    Adam over all Gaussian attributes at once. Parameters, first and second moments are the
+    three planes of one [3, N, D] buffer and the gradients one [N, D] buffer; every attribute
+    is a column range of them, exposed as a leaf nn.Parameter that shares its storage, so
+    autograd accumulates straight into the flat gradient. A step is a handful of whole-buffer
+    ops with per-column learning rates. The buffers reserve capacity beyond the N active rows:
+    appended Gaussians are written behind them and pruning compacts the kept rows in place.
+
+    With sparse_update, a step gathers the rows of the visible Gaussians, updates them and
+    scatters them back; the others keep their moments, like in a step they were not part of.
+    """
+    reserves_capacity = True
+
+    @property
+    def config_class(self):
+        return FlatAdamParamOptimConfig
+
+    @property
+    def state(self):
+        return {
+            "names": self.names,
+            "step": self.step,
+            "row_step": compact_storage(self.row_step),
+            "exp_avg": compact_storage(self.buffer[1]),
+            "exp_avg_sq": compact_storage(self.buffer[2])
+        }
+
+    def _restore(self, state, max_iter, spatial_lr_scale, param_lr_group):
+        self.init_optim(param_lr_group, spatial_lr_scale, max_iter)
+        assert state["names"] == self.names, f"Checkpoint holds {state['names']}, expected {self.names}"
+        self.step = state["step"]
+        self.row_step.copy_(state["row_step"])
+        self.buffer[1].copy_(state["exp_avg"])
+        self.buffer[2].copy_(state["exp_avg_sq"])
+
+    def init_optim(self, param_lr_group, spatial_lr_scale, max_iter):
+        self.names = [group["name"] for group in param_lr_group]
+        params = [group["params"][0] for group in param_lr_group]
+        self.shapes = {name: tuple(param.shape[1:]) for name, param in zip(self.names, params)}
+        self.columns, self.dim = {}, 0
+        for name, shape in self.shapes.items():
+            self.columns[name] = (self.dim, self.dim + math.prod(shape))
+            self.dim += math.prod(shape)
+        device, dtype = params[0].device, params[0].dtype
+
+        flat = torch.cat([param.detach().flatten(1) for param in params], dim=1)
+        self.store = GrowableStorage(torch.stack((flat, torch.zeros_like(flat), torch.zeros_like(flat))), dim=1, growth_factor=self.cfg.growth_factor)
+        self.grad_store = GrowableStorage(torch.zeros_like(flat), growth_factor=self.cfg.growth_factor)
+        self.row_step_store = GrowableStorage(torch.zeros(flat.shape[0], dtype=torch.int32, device=device), growth_factor=self.cfg.growth_factor)
+        self.step = 0
+        self.base_lrs = {group["name"]: group["lr"] for group in param_lr_group}
+        self.lr_scale = 1.0
+        self.column_lr = torch.empty(self.dim, dtype=dtype, device=device)
+        for name, lr in self.base_lrs.items():
+            self.set_lr(name, lr)
+        # the representation keeps the parameter objects it passed in, make them share the buffer
+        for param, view in zip(params, self.views(self.buffer[0]).values()):
+            param.data = view
+        self.params = dict(zip(self.names, params))
+        self.attach_grads()
+        self.xyz_lr_schedule = get_expon_lr_func(lr_init=self.cfg.position_lr_init*spatial_lr_scale,
+                                                lr_final=self.cfg.position_lr_final*spatial_lr_scale,
+                                                lr_delay_mult=self.cfg.position_lr_delay_mult,
+                                                max_steps=self.cfg.position_lr_max_steps)
+        self.max_iter = max_iter
+
+    def views(self, flat):
+        return {name: flat[:, start:end].view(flat.shape[0], *self.shapes[name]) for name, (start, end) in self.columns.items()}
+
+    @property
+    def buffer(self):
+        return self.store.active
+
+    @property
+    def grad(self):
+        return self.grad_store.active
+
+    @property
+    def row_step(self):
+        return self.row_step_store.active
+
+    @property
+    def capacity(self):
+        return self.store.capacity
+
+    def reset_grads(self):
+        # the gradients of this iteration belong to the rows before the topology change
+        self.grad_store.resize(self.store.count)
+        self.grad.zero_()
+        self.grads_attached = False
+
+    def parameters(self):
+        """Fresh leaf parameters over the current buffer, without gradient like new nn.Parameters."""
+        self.params = {name: nn.Parameter(view) for name, view in self.views(self.buffer[0]).items()}
+        return dict(self.params)
+
+    def attach_grads(self):
+        """Route the gradients into the flat buffer, autograd then accumulates into it in place."""
+        for param, view in zip(self.params.values(), self.views(self.grad).values()):
+            if param.grad is not None:
+                view.copy_(param.grad)
+            param.grad = view
+        self.grads_attached = True
+
+    def backward(self, loss):
+        with warnings.catch_warnings():
+            # parameters and their gradients are column slices of the flat buffers on purpose
+            warnings.filterwarnings("ignore", message="grad and param do not obey the gradient layout contract")
+            loss.backward()
+
+    def set_lr(self, name, lr):
+        start, end = self.columns[name]
+        self.column_lr[start:end] = float(lr)
+
+    def update_lr(self, iteration):
+        lr = self.xyz_lr_schedule(iteration) * self.lr_scale
+        self.set_lr("xyz", lr)
+        return lr
+
+    def set_lr_scale(self, scale):
+        self.lr_scale = scale
+        for name, lr in self.base_lrs.items():
+            self.set_lr(name, lr * scale)
+
+    def update_optim(self, iteration, visibility_filter=None):
+        if not self.grads_attached:
+            # parameters created since the backward pass have no gradient, torch.optim.Adam skips them
+            has_grad = any(param.grad is not None for param in self.params.values())
+            self.attach_grads()
+            if not has_grad:
+                return
+        if iteration >= self.max_iter:
+            return
+        if self.cfg.sparse_update and visibility_filter is not None:
+            self.sparse_step(torch.nonzero(visibility_filter).squeeze(1))
+        else:
+            self.dense_step()
+
+    def dense_step(self):
+        self.step += 1
+        self.row_step.add_(1)
+        beta1, beta2 = self.cfg.beta1, self.cfg.beta2
+        params, exp_avg, exp_avg_sq = self.buffer.unbind(0)
+        exp_avg.lerp_(self.grad, 1 - beta1)
+        exp_avg_sq.mul_(beta2).addcmul_(self.grad, self.grad, value=1 - beta2)
+        update = exp_avg_sq.sqrt().div_(math.sqrt(1 - beta2 ** self.step)).add_(self.cfg.eps)
+        update.reciprocal_().mul_(exp_avg).mul_(self.column_lr / -(1 - beta1 ** self.step))
+        params.add_(update)
+        self.grad.zero_()
+
+    def sparse_step(self, rows):
+        """Adam step of the given rows only; gradients of the other rows are expected to be zero."""
+        self.step += 1
+        beta1, beta2 = self.cfg.beta1, self.cfg.beta2
+        self.row_step.index_add_(0, rows, torch.ones_like(rows, dtype=self.row_step.dtype))
+        # bias corrections in double, 1 - beta2 ** step loses digits in single precision
+        step = self.row_step[rows].double()[:, None]
+        neg_bias_correction1 = (beta1 ** step - 1).to(self.buffer.dtype)
+        bias_correction2_sqrt = (1 - beta2 ** step).sqrt_().to(self.buffer.dtype)
+        grad = self.grad.index_select(0, rows)
+        rows_state = self.buffer.index_select(1, rows)
+        params, exp_avg, exp_avg_sq = rows_state.unbind(0)
+        exp_avg.lerp_(grad, 1 - beta1)
+        exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+        update = exp_avg_sq.sqrt().div_(bias_correction2_sqrt).add_(self.cfg.eps)
+        update.reciprocal_().mul_(exp_avg).mul_(self.column_lr).div_(neg_bias_correction1)
+        params.add_(update)
+        self.buffer.index_copy_(1, rows, rows_state)
+        self.grad.index_fill_(0, rows, 0.0)
+
+    def prune_optim(self, mask):
+        return self.rebuild_tensors(torch.nonzero(mask).squeeze(1), None)
+
+    def rebuild_tensors(self, keep_index, tensors_dict, chunk_size=None):
+        self.store.compact(keep_index, chunk_size)
+        self.row_step_store.compact(keep_index, chunk_size)
+        if tensors_dict is not None:
+            self.append_rows(tensors_dict)
+        self.reset_grads()
+        return self.parameters()
+
+    def replace_tensor(self, tensor, name):
+        start, end = self.columns[name]
+        self.buffer[0, :, start:end] = tensor.detach().flatten(1)
+        # zero moments and gradient: the next step leaves the new values as they are
+        self.buffer[1:, :, start:end] = 0.0
+        self.grad[:, start:end] = 0.0
+        return {name: self.params[name]}
+
+    def cat_tensors(self, tensors_dict):
+        self.append_rows(tensors_dict)
+        self.reset_grads()
+        return self.parameters()
+
+    def append_rows(self, tensors_dict):
+        extension = torch.cat([tensors_dict[name].detach().flatten(1) for name in self.names], dim=1)
+        start = self.store.count
+        self.store.resize(start + extension.shape[0])
+        rows = self.store.rows(start, self.store.count)
+        rows[0].copy_(extension)
+        rows[1:].zero_()
+        self.row_step_store.append(self.row_step.new_zeros(extension.shape[0]))
+
+    def print_state(self):
+        for name, (start, end) in self.columns.items():
+            print(f"{name}: columns {start}-{end}, exp_avg-{(self.buffer.shape[1], end - start)}, exp_avg_sq-{(self.buffer.shape[1], end - start)}")
@@ -1,4 +1,5 @@
 from . import (
     base_renderer,
-    diffRasterizer
+    diffRasterizer,
+    torchRasterizer
 )
\ No newline at end of file
@@ -7,6 +7,8 @@ class BaseRenderer(ABC):
     def __init__(self, cfg, logger) -> None:
         self.cfg = parse_structured(self.config_class, cfg)
         self.logger = logger
+        # per-render statistics for the recorder
+        self.stats = {}
 
     @property
     @abstractmethod
@@ -15,4 +17,17 @@ class BaseRenderer(ABC):
 
     @abstractmethod
     def render(self, representation, camera):
-        pass
\ No newline at end of file
+        pass
+
+    def render_views(self, representation, cameras):
+        """Render the cameras of a batched training step, one render package per camera."""
+        return [self.render(representation, camera) for camera in cameras]
+
+    def select_lod(self, representation, camera):
+        """The cut of representation.lod for camera when lod_threshold is set, otherwise representation itself."""
+        threshold = getattr(self.cfg, "lod_threshold", 0.0)
+        if threshold <= 0 or getattr(representation, "lod", None) is None:
+            return representation
+        index = representation.lod.cut(camera, threshold)
+        self.stats["lod_cut_size"] = index.shape[0]
+        return representation.lod.subset(representation, index)
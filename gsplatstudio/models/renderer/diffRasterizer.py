@@ -1,8 +1,8 @@
-import math
+import time
 import torch
 import gsplatstudio
-from diff_gaussian_rasterization import GaussianRasterizationSettings, GaussianRasterizer
 from gsplatstudio.utils.sh_utils import eval_sh
+from gsplatstudio.utils.graphics_utils import frustum_cull_mask
 from gsplatstudio.utils.type_utils import *
 from gsplatstudio.models.renderer.base_renderer import BaseRenderer
 
@@ -16,11 +16,21 @@ class DiffRasterizerRendererConfig:
     prefiltered: bool = False
     override_color: list = field(default_factory=list)
     use_full_opacity: bool = False
+    # render only the Gaussians whose bounding spheres may reach the image
+    frustum_culling: bool = False
+    # every n-th culled render also times a full and a culled forward pass to report the time saved, 0 disables
+    culling_timing_interval: int = 100
+    # render the cut of representation.lod whose nodes project to at most this many pixels, 0 disables
+    lod_threshold: float = 0.0
     
 
 @gsplatstudio.register("diffRasterizer-renderer")
 class DiffRasterizerRenderer(BaseRenderer):
     
+    def __init__(self, cfg, logger):
+        super().__init__(cfg, logger)
+        self.num_renders = 0
+
     @property
     def config_class(self):
         return DiffRasterizerRendererConfig
@@ -37,6 +47,7 @@ class DiffRasterizerRenderer(BaseRenderer):
         Render the scene. 
         Background tensor (bg_color) must be on GPU!
         """
+        representation = self.select_lod(representation, camera)
     
         # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
         screenspace_points = torch.zeros_like(representation.xyz, dtype=representation.xyz.dtype, requires_grad=True, device="cuda") + 0
@@ -45,9 +56,60 @@ class DiffRasterizerRenderer(BaseRenderer):
         except:
             pass
 
+        index = None
+        if self.cfg.frustum_culling:
+            cull_start = time.perf_counter()
+            index = self.cull(representation, camera)
+            cull_time = time.perf_counter() - cull_start
+            self.stats["culled_fraction"] = 1.0 - index.shape[0] / max(representation.xyz.shape[0], 1)
+            self.stats["cull_time_ms"] = cull_time * 1000.0
+            self.num_renders += 1
+            if self.cfg.culling_timing_interval > 0 and self.num_renders % self.cfg.culling_timing_interval == 0:
+                self.stats["cull_time_saved_ms"] = self.time_saved(representation, camera, index, cull_time)
+
+        rendered_image, radii = self.rasterize(representation, camera, screenspace_points, index)
+        if index is not None:
+            # Culled Gaussians are invisible, as if the rasterizer had skipped them
+            full_radii = torch.zeros(representation.xyz.shape[0], dtype=radii.dtype, device=radii.device)
+            radii = full_radii.index_copy(0, index, radii)
+
+        # Those Gaussians that were frustum culled or had a radius of 0 were not visible.
+        # They will be excluded from value updates used in the splitting criteria.
+        return {"render": rendered_image,
+                "viewspace_points": screenspace_points,
+                "visibility_filter" : radii > 0,
+                "radii": radii}
+
+    def cull(self, representation, camera):
+        """Indices of the Gaussians whose 3-sigma bounding spheres may touch the camera's image."""
+        with torch.no_grad():
+            radii3D = 3.0 * self.cfg.scaling_modifier * representation.scaling.max(dim=1).values
+            mask = frustum_cull_mask(representation.xyz, radii3D, camera.world_view_transform, camera.full_proj_transform,
+                                     camera.tanfovx, camera.tanfovy, int(camera.height), int(camera.width))
+            return torch.nonzero(mask).squeeze(1)
+
+    def time_saved(self, representation, camera, index, cull_time):
+        """Forward time of a full render minus the culled render and the culling itself, in ms."""
+        def timed(subset):
+            torch.cuda.synchronize()
+            start = time.perf_counter()
+            with torch.no_grad():
+                self.rasterize(representation, camera, torch.zeros_like(representation.xyz), subset)
+            torch.cuda.synchronize()
+            return time.perf_counter() - start
+        return (timed(None) - timed(index) - cull_time) * 1000.0
+
+    def rasterize(self, representation, camera, screenspace_points, index=None):
+        """Rasterize all Gaussians, or only the rows in index; returns the image and the radii of those rows."""
+        # the CUDA extension is only needed once this renderer actually renders
+        from diff_gaussian_rasterization import GaussianRasterizationSettings, GaussianRasterizer
+
+        def select(tensor):
+            return tensor if index is None else tensor[index]
+
         # Set up rasterization configuration
-        tanfovx = math.tan(camera.fov_x * 0.5)
-        tanfovy = math.tan(camera.fov_y * 0.5)
+        tanfovx = camera.tanfovx
+        tanfovy = camera.tanfovy
 
         raster_settings = GaussianRasterizationSettings(
             image_height=int(camera.height),
@@ -66,12 +128,12 @@ class DiffRasterizerRenderer(BaseRenderer):
 
         rasterizer = GaussianRasterizer(raster_settings=raster_settings)
 
-        means3D = representation.xyz
-        means2D = screenspace_points
+        means3D = select(representation.xyz)
+        means2D = select(screenspace_points)
         if self.cfg.use_full_opacity:
-            opacity = torch.ones_like(representation.opacity, dtype=representation.opacity.dtype, requires_grad=False, device="cuda")
+            opacity = torch.ones_like(means3D[:, :1], dtype=representation.opacity.dtype, requires_grad=False, device="cuda")
         else:
-            opacity = representation.opacity
+            opacity = select(representation.opacity)
 
         # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
         # scaling / rotation by the rasterizer.
@@ -79,29 +141,30 @@ class DiffRasterizerRenderer(BaseRenderer):
         rotations = None
         cov3D_precomp = None
         if self.cfg.compute_cov3D_python:
-            cov3D_precomp = representation.covariance(self.cfg.scaling_modifier)
+            cov3D_precomp = select(representation.covariance(self.cfg.scaling_modifier))
         else:
-            scales = representation.scaling
-            rotations = representation.rotation
+            scales = select(representation.scaling)
+            rotations = select(representation.rotation)
 
         # If precomputed colors are provided, use them. Otherwise, if it is desired to precompute colors
         # from SHs in Python, do it. If not, then SH -> RGB conversion will be done by rasterizer.
         shs = None
         colors_precomp = None
         if self.cfg.override_color == [-1,-1,-1]:
+            features = select(representation.features)
             if self.cfg.convert_SHs_python:
-                shs_view = representation.features.transpose(1, 2).view(-1, 3, (representation.max_sh_degree+1)**2)
-                dir_pp = (representation.xyz - camera.camera_center.repeat(representation.features.shape[0], 1))
+                shs_view = features.transpose(1, 2).view(-1, 3, (representation.max_sh_degree+1)**2)
+                dir_pp = (means3D - camera.camera_center.repeat(features.shape[0], 1))
                 dir_pp_normalized = dir_pp/dir_pp.norm(dim=1, keepdim=True)
                 sh2rgb = eval_sh(representation.sh_degree, shs_view, dir_pp_normalized)
                 colors_precomp = torch.clamp_min(sh2rgb + 0.5, 0.0)
             else:
-                shs = representation.features
+                shs = features
         else:
             colors_precomp = self.cfg.override_color
 
         # Rasterize visible Gaussians to image, obtain their radii (on screen). 
-        rendered_image, radii = rasterizer(
+        return rasterizer(
             means3D = means3D,
             means2D = means2D,
             shs = shs,
@@ -110,10 +173,3 @@ class DiffRasterizerRenderer(BaseRenderer):
             scales = scales,
             rotations = rotations,
             cov3D_precomp = cov3D_precomp)
-
-        # Those Gaussians that were frustum culled or had a radius of 0 were not visible.
-        # They will be excluded from value updates used in the splitting criteria.
-        return {"render": rendered_image,
-                "viewspace_points": screenspace_points,
-                "visibility_filter" : radii > 0,
-                "radii": radii}
\ No newline at end of file
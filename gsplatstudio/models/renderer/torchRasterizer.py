@@ -0,0 +1,232 @@
+import os
+import torch
+import gsplatstudio
+from concurrent.futures import ThreadPoolExecutor
+from gsplatstudio.utils.sh_utils import eval_sh
+from gsplatstudio.utils.gaussian_utils import build_scaling_rotation
+from gsplatstudio.utils.type_utils import *
+from gsplatstudio.models.renderer.base_renderer import BaseRenderer
+
+# Constants of diff_gaussian_rasterization
+NEAR_PLANE = 0.2
+COV2D_DILATION = 0.3
+ALPHA_MAX = 0.99
+ALPHA_MIN = 1.0 / 255.0
+TRANSMITTANCE_MIN = 1e-4
+
+@dataclass
+class TorchRasterizerRendererConfig:
+    background_color: list = field(default_factory=list)
+    scaling_modifier: float = 1.0
+    override_color: list = field(default_factory=list)
+    use_full_opacity: bool = False
+    device: str = "cpu"
+    tile_size: int = 16
+    # tiles composited together, each padded to the longest Gaussian list of its batch
+    tiles_per_batch: int = 16
+    # upper bound on pixels x Gaussians evaluated at once in a batch
+    chunk_elements: int = 1 << 22
+    # threads compositing tile batches, <= 0 uses all cpus
+    num_threads: int = 4
+    # render the cut of representation.lod whose nodes project to at most this many pixels, 0 disables
+    lod_threshold: float = 0.0
+
+
+@gsplatstudio.register("torchRasterizer-renderer")
+class TorchRasterizerRenderer(BaseRenderer):
+    """
+    Reference implementation of diff_gaussian_rasterization in PyTorch, runs on any device.
+
+    Gaussians are projected with the same EWA approximation, binned into screen tiles,
+    sorted by depth within every tile and alpha-composited front to back with early
+    termination. Everything is differentiable through autograd; viewspace_points receives
+    the gradient of the NDC means like in the CUDA rasterizer.
+    """
+    @property
+    def config_class(self):
+        return TorchRasterizerRendererConfig
+
+    @property
+    def background_color(self):
+        if self.cfg.background_color == [-1,-1,-1]: # random background
+            return torch.rand((3), device=self.cfg.device)
+        else:
+            return torch.tensor(self.cfg.background_color, dtype=torch.float32, device=self.cfg.device)
+
+    def render(self, representation, camera):
+        representation = self.select_lod(representation, camera)
+        means3D = representation.xyz
+        device = means3D.device
+
+        # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
+        screenspace_points = torch.zeros_like(means3D, dtype=means3D.dtype, requires_grad=True) + 0
+        try:
+            screenspace_points.retain_grad()
+        except:
+            pass
+
+        height, width = int(camera.height), int(camera.width)
+        viewmatrix = camera.world_view_transform.to(device=device, dtype=means3D.dtype)
+        projmatrix = camera.full_proj_transform.to(device=device, dtype=means3D.dtype)
+        campos = camera.camera_center.to(device=device, dtype=means3D.dtype)
+
+        means2D, conics, depths, radii = self.project(means3D, screenspace_points, representation, viewmatrix, projmatrix,
+                                                      camera.tanfovx, camera.tanfovy, height, width)
+        visible_index = torch.nonzero(radii > 0).squeeze(1)
+
+        if self.cfg.use_full_opacity:
+            opacity = torch.ones_like(representation.opacity, dtype=representation.opacity.dtype, requires_grad=False)
+        else:
+            opacity = representation.opacity
+        colors = self.compute_colors(representation, campos, visible_index)
+
+        rendered_image = self.rasterize(means2D[visible_index], conics[visible_index], opacity[visible_index, 0],
+                                        colors, depths[visible_index], radii[visible_index], height, width,
+                                        self.background_color.to(device))
+
+        return {"render": rendered_image,
+                "viewspace_points": screenspace_points,
+                "visibility_filter" : radii > 0,
+                "radii": radii}
+
+    def project(self, means3D, screenspace_points, representation, viewmatrix, projmatrix, tanfovx, tanfovy, height, width):
+        """Pixel-space means, conics, view depths and integer radii (0 when culled) of all Gaussians."""
+        homogeneous = torch.cat((means3D, torch.ones_like(means3D[:, :1])), dim=1)
+        p_hom = homogeneous @ projmatrix
+        p_proj = p_hom[:, :3] / (p_hom[:, 3:4] + 1e-7)
+        p_view = homogeneous @ viewmatrix
+        in_frustum = p_view[:, 2].detach() > NEAR_PLANE
+
+        # EWA splatting: cov2D = J W cov3D W^T J^T, W being the world-to-view rotation
+        L = build_scaling_rotation(self.cfg.scaling_modifier * representation.scaling, representation.rotation)
+        cov3D = L @ L.transpose(1, 2)
+        focal_x, focal_y = width / (2.0 * tanfovx), height / (2.0 * tanfovy)
+        tz = torch.where(in_frustum, p_view[:, 2], torch.ones_like(p_view[:, 2]))
+        tx = (p_view[:, 0] / tz).clamp(-1.3 * tanfovx, 1.3 * tanfovx) * tz
+        ty = (p_view[:, 1] / tz).clamp(-1.3 * tanfovy, 1.3 * tanfovy) * tz
+        zeros = torch.zeros_like(tz)
+        J = torch.stack((torch.stack((focal_x / tz, zeros, -focal_x * tx / (tz * tz)), dim=1),
+                         torch.stack((zeros, focal_y / tz, -focal_y * ty / (tz * tz)), dim=1)), dim=1)
+        T = J @ viewmatrix[:3, :3].T
+        cov2D = T @ cov3D @ T.transpose(1, 2)
+
+        a = cov2D[:, 0, 0] + COV2D_DILATION
+        b = cov2D[:, 0, 1]
+        c = cov2D[:, 1, 1] + COV2D_DILATION
+        det = a * c - b * b
+        valid = in_frustum & (det.detach() > 0)
+        det = torch.where(valid, det, torch.ones_like(det))
+        conics = torch.stack((c / det, -b / det, a / det), dim=1)
+
+        with torch.no_grad():
+            mid = 0.5 * (a + c)
+            lambda1 = mid + torch.sqrt(torch.clamp_min(mid * mid - det, 0.1))
+            radius = torch.ceil(3.0 * torch.sqrt(lambda1))
+
+        # ndc2Pix, screenspace_points only carries the gradient of the NDC means
+        ndc = p_proj[:, :2] + screenspace_points[:, :2]
+        means2D = ((ndc + 1.0) * torch.tensor([width, height], dtype=ndc.dtype, device=ndc.device) - 1.0) * 0.5
+
+        with torch.no_grad():
+            rect_min, rect_max = self.tile_rect(means2D, radius, height, width)
+            touched = ((rect_max - rect_min).prod(dim=1) > 0) & valid
+            radii = torch.where(touched, radius, torch.zeros_like(radius)).int()
+        return means2D, conics, p_view[:, 2].detach(), radii
+
+    def tile_rect(self, means2D, radius, height, width):
+        tile = self.cfg.tile_size
+        grid = torch.tensor([(width + tile - 1) // tile, (height + tile - 1) // tile], device=means2D.device)
+        rect_min = torch.trunc((means2D - radius[:, None]) / tile).long()
+        rect_max = torch.trunc((means2D + radius[:, None] + tile - 1) / tile).long()
+        rect_min = torch.minimum(grid, rect_min.clamp_min(0))
+        rect_max = torch.minimum(grid, rect_max.clamp_min(0))
+        return rect_min, rect_max
+
+    def compute_colors(self, representation, campos, index):
+        if self.cfg.override_color not in ([], [-1,-1,-1]):
+            override = torch.tensor(self.cfg.override_color, dtype=torch.float32, device=campos.device)
+            return override.expand(index.shape[0], 3)
+        xyz = representation.xyz[index]
+        shs_view = representation.features[index].transpose(1, 2).view(-1, 3, (representation.max_sh_degree+1)**2)
+        dir_pp = xyz - campos
+        dir_pp_normalized = dir_pp/dir_pp.norm(dim=1, keepdim=True)
+        sh2rgb = eval_sh(representation.sh_degree, shs_view, dir_pp_normalized)
+        return torch.clamp_min(sh2rgb + 0.5, 0.0)
+
+    def rasterize(self, means2D, conics, opacity, colors, depths, radii, height, width, background):
+        tile = self.cfg.tile_size
+        grid_x, grid_y = (width + tile - 1) // tile, (height + tile - 1) // tile
+        num_tiles, device = grid_x * grid_y, means2D.device
+
+        # Duplicate every Gaussian for each tile it touches, then sort by (tile, depth)
+        with torch.no_grad():
+            rect_min, rect_max = self.tile_rect(means2D, radii.to(means2D.dtype), height, width)
+            extent = rect_max - rect_min
+            counts = extent.prod(dim=1)
+            gaussian_ids = torch.repeat_interleave(torch.arange(counts.shape[0], device=device), counts)
+            local = torch.arange(gaussian_ids.shape[0], device=device) - torch.repeat_interleave(torch.cumsum(counts, 0) - counts, counts)
+            tile_x = rect_min[gaussian_ids, 0] + local % extent[gaussian_ids, 0]
+            tile_y = rect_min[gaussian_ids, 1] + local // extent[gaussian_ids, 0]
+            tile_ids = tile_y * grid_x + tile_x
+            order = torch.argsort(depths[gaussian_ids], stable=True)
+            order = order[torch.argsort(tile_ids[order], stable=True)]
+            gaussian_ids, tile_ids = gaussian_ids[order], tile_ids[order]
+            tile_counts = torch.bincount(tile_ids, minlength=num_tiles)
+            tile_starts = torch.cumsum(tile_counts, 0) - tile_counts
+
+            # Batch tiles of similar length to keep the padding small
+            busy_tiles = torch.nonzero(tile_counts).squeeze(1)
+            busy_tiles = busy_tiles[torch.argsort(tile_counts[busy_tiles])]
+            batches = list(torch.split(busy_tiles, self.cfg.tiles_per_batch))
+            offsets = torch.arange(tile, device=device)
+            pixel_y, pixel_x = torch.meshgrid(offsets, offsets, indexing="ij")
+            pixel_offsets = torch.stack((pixel_x.reshape(-1), pixel_y.reshape(-1)), dim=1).to(means2D.dtype)
+
+        def composite(batch):
+            with torch.no_grad():
+                lengths = tile_counts[batch]
+                max_length = int(lengths.max())
+                slots = torch.arange(max_length, device=device)
+                valid = slots[None] < lengths[:, None]
+                ids = gaussian_ids[torch.where(valid, tile_starts[batch, None] + slots[None], 0)]
+                corner = torch.stack((batch % grid_x, batch // grid_x), dim=1).to(means2D.dtype) * tile
+                pixels = corner[:, None, :] + pixel_offsets[None]
+            num_pixels = pixels.shape[1]
+            chunk = max(1, self.cfg.chunk_elements // (batch.shape[0] * num_pixels))
+
+            transmittance = torch.ones((batch.shape[0], num_pixels), dtype=means2D.dtype, device=device)
+            done = torch.zeros((batch.shape[0], num_pixels), dtype=torch.bool, device=device)
+            color = torch.zeros((batch.shape[0], num_pixels, 3), dtype=means2D.dtype, device=device)
+            for start in range(0, max_length, chunk):
+                chunk_ids, chunk_valid = ids[:, start:start + chunk], valid[:, start:start + chunk]
+                d = means2D[chunk_ids][:, None, :, :] - pixels[:, :, None, :]
+                conic = conics[chunk_ids][:, None]
+                power = -0.5 * (conic[..., 0] * d[..., 0] * d[..., 0] + conic[..., 2] * d[..., 1] * d[..., 1]) \
+                        - conic[..., 1] * d[..., 0] * d[..., 1]
+                alpha = torch.clamp_max(opacity[chunk_ids][:, None] * torch.exp(power), ALPHA_MAX)
+                keep = (power <= 0) & (alpha >= ALPHA_MIN) & chunk_valid[:, None] & ~done[..., None]
+                alpha = torch.where(keep, alpha, torch.zeros_like(alpha))
+                # exclusive transmittance, a Gaussian is dropped once it would take T below the threshold
+                passed = torch.cumprod(1.0 - alpha, dim=-1)
+                before = transmittance[..., None] * torch.cat((torch.ones_like(passed[..., :1]), passed[..., :-1]), dim=-1)
+                included = (transmittance[..., None] * passed).detach() >= TRANSMITTANCE_MIN
+                weights = alpha * before * included
+                color = color + weights @ colors[chunk_ids]
+                transmittance = transmittance - weights.sum(dim=-1)
+                done = done | (keep & ~included).any(dim=-1)
+                if bool(done.all()):
+                    break
+            return color + transmittance[..., None] * background
+
+        num_threads = self.cfg.num_threads if self.cfg.num_threads > 0 else os.cpu_count()
+        if num_threads > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=num_threads) as pool:
+                batch_colors = list(pool.map(composite, batches))
+        else:
+            batch_colors = [composite(batch) for batch in batches]
+
+        tiles = background.to(means2D.dtype).expand(num_tiles, tile * tile, 3)
+        if batches:
+            tiles = tiles.index_copy(0, torch.cat(batches), torch.cat(batch_colors))
+        image = tiles.reshape(grid_y, grid_x, tile, tile, 3).permute(4, 0, 2, 1, 3).reshape(3, grid_y * tile, grid_x * tile)
+        return image[:, :height, :width]
@@ -1,10 +1,15 @@
+import os
 import torch
 import numpy as np
 from torch import nn
-from plyfile import PlyData, PlyElement
 from gsplatstudio.utils.sh_utils import RGB2SH
-from simple_knn._C import distCUDA2
 from gsplatstudio.utils.graphics_utils import BasicPointCloud
+from gsplatstudio.utils.ply_utils import ply_header, write_ply, load_ply_element, read_ply_columns
+from gsplatstudio.utils.compression_utils import encode_gaussians, decode_gaussians
+from gsplatstudio.utils.spatial_index import GridIndex
+from gsplatstudio.utils.knn_utils import mean_knn_dist2
+from gsplatstudio.utils.lod_utils import build_hierarchy, GaussianHierarchy
+from gsplatstudio.utils.checkpoint_utils import compact_storage
 from gsplatstudio.utils.gaussian_utils import inverse_sigmoid, build_covariance_from_scaling_rotation
 import gsplatstudio
 from gsplatstudio.utils.type_utils import *
@@ -14,6 +19,8 @@ from gsplatstudio.models.representation.base_repr import BaseRepr
 class GaussianReprConfig:
     max_sh_degree: int = 3
     device: str = "cuda"
+    # "auto", "simple_knn", "kdtree" or "grid", see knn_utils.mean_knn_dist2
+    knn_backend: str = "auto"
 
 @gsplatstudio.register("gaussian-representation")
 class GaussianRepr(BaseRepr):
@@ -29,6 +36,9 @@ class GaussianRepr(BaseRepr):
         self._opacity = torch.empty(0)
         self.max_sh_degree = self.cfg.max_sh_degree
         self.spatial_lr_scale = 0
+        self._spatial_index = None
+        # level-of-detail hierarchy used by the renderers' lod_threshold, see build_lod / load_lod
+        self.lod = None
         self.scaling_activation = torch.exp
         self.scaling_inverse_activation = torch.log
         self.covariance_activation = build_covariance_from_scaling_rotation
@@ -52,6 +62,26 @@ class GaussianRepr(BaseRepr):
     def xyz(self):
         return self._xyz
     
+    @property
+    def spatial_index(self):
+        """Grid index over xyz, built on first use and refreshed with the moved points after that."""
+        if self._spatial_index is None:
+            self._spatial_index = GridIndex(self._xyz)
+        else:
+            self._spatial_index.refresh(self._xyz)
+        return self._spatial_index
+
+    def prune_spatial_index(self, valid_mask):
+        if self._spatial_index is not None:
+            self._spatial_index.prune(valid_mask, points=self._xyz)
+
+    def rebuild_spatial_index(self, valid_mask):
+        """After the rows of valid_mask were kept and new ones appended behind them."""
+        if self._spatial_index is not None:
+            num_kept = int(valid_mask.sum())
+            self._spatial_index.prune(valid_mask, points=self._xyz[:num_kept])
+            self._spatial_index.append(self._xyz[num_kept:])
+
     @property
     def features(self):
         features_dc = self._features_dc
@@ -68,14 +98,15 @@ class GaussianRepr(BaseRepr):
 
     @property
     def state(self):
+        # the parameters may be views into the storage of a paramOptim
         return (
             self.sh_degree,
-            self._xyz,
-            self._features_dc,
-            self._features_rest,
-            self._scaling,
-            self._rotation,
-            self._opacity,
+            compact_storage(self._xyz),
+            compact_storage(self._features_dc),
+            compact_storage(self._features_rest),
+            compact_storage(self._scaling),
+            compact_storage(self._rotation),
+            compact_storage(self._opacity),
         )
 
     def increment_sh_degree(self):
@@ -91,12 +122,13 @@ class GaussianRepr(BaseRepr):
         features[:, 3:, 1:] = 0.0
         self.logger.info(f"Number of points at initialisation : {fused_point_cloud.shape[0]}", )
 
-        dist2 = torch.clamp_min(distCUDA2(torch.from_numpy(np.asarray(pcd.points)).float().to(self.cfg.device)), 0.0000001)
+        dist2 = mean_knn_dist2(torch.from_numpy(np.asarray(pcd.points)).float(), backend=self.cfg.knn_backend)
+        dist2 = torch.clamp_min(dist2.to(self.cfg.device), 0.0000001)
         scales = torch.log(torch.sqrt(dist2))[...,None].repeat(1, 3)
-        rots = torch.zeros((fused_point_cloud.shape[0], 4), device="cuda")
+        rots = torch.zeros((fused_point_cloud.shape[0], 4), device=self.cfg.device)
         rots[:, 0] = 1
 
-        opacities = inverse_sigmoid(0.1 * torch.ones((fused_point_cloud.shape[0], 1), dtype=torch.float, device="cuda"))
+        opacities = inverse_sigmoid(0.1 * torch.ones((fused_point_cloud.shape[0], 1), dtype=torch.float, device=self.cfg.device))
 
         self._xyz = nn.Parameter(fused_point_cloud.requires_grad_(True))
         self._features_dc = nn.Parameter(features[:,:,0:1].transpose(1, 2).contiguous().requires_grad_(True))
@@ -104,6 +136,8 @@ class GaussianRepr(BaseRepr):
         self._scaling = nn.Parameter(scales.requires_grad_(True))
         self._rotation = nn.Parameter(rots.requires_grad_(True))
         self._opacity = nn.Parameter(opacities.requires_grad_(True))
+        self._spatial_index = None
+        self.lod = None
         
     def print_parameters(self):
         for name, param in self.named_parameters():
@@ -136,6 +170,8 @@ class GaussianRepr(BaseRepr):
             self._rotation = param_dict.get("rotation")
         if "opacity" in param_dict:
             self._opacity = param_dict.get("opacity")
+        # the LoD hierarchy indexes the previous Gaussians, build_lod again for the new ones
+        self.lod = None
 
     def construct_list_of_attributes(self):
         l = ['x', 'y', 'z', 'nx', 'ny', 'nz']
@@ -151,66 +187,121 @@ class GaussianRepr(BaseRepr):
             l.append('rot_{}'.format(i))
         return l
 
-    def save_ply(self, path):
-        xyz = self._xyz.detach().cpu().numpy()
-        normals = np.zeros_like(xyz)
-        f_dc = self._features_dc.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
-        f_rest = self._features_rest.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
-        opacities = self._opacity.detach().cpu().numpy()
-        scale = self._scaling.detach().cpu().numpy()
-        rotation = self._rotation.detach().cpu().numpy()
-
-        dtype_full = [(attribute, 'f4') for attribute in self.construct_list_of_attributes()]
-
-        elements = np.empty(xyz.shape[0], dtype=dtype_full)
-        attributes = np.concatenate((xyz, normals, f_dc, f_rest, opacities, scale, rotation), axis=1)
-        elements[:] = list(map(tuple, attributes))
-        el = PlyElement.describe(elements, 'vertex')
-        PlyData([el]).write(path)
-
-    def load_ply(self, path):
-        plydata = PlyData.read(path)
-
-        xyz = np.stack((np.asarray(plydata.elements[0]["x"]),
-                        np.asarray(plydata.elements[0]["y"]),
-                        np.asarray(plydata.elements[0]["z"])),  axis=1)
-        opacities = np.asarray(plydata.elements[0]["opacity"])[..., np.newaxis]
-
-        features_dc = np.zeros((xyz.shape[0], 3, 1))
-        features_dc[:, 0, 0] = np.asarray(plydata.elements[0]["f_dc_0"])
-        features_dc[:, 1, 0] = np.asarray(plydata.elements[0]["f_dc_1"])
-        features_dc[:, 2, 0] = np.asarray(plydata.elements[0]["f_dc_2"])
-
-        extra_f_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("f_rest_")]
-        extra_f_names = sorted(extra_f_names, key = lambda x: int(x.split('_')[-1]))
-        assert len(extra_f_names)==3*(self.max_sh_degree + 1) ** 2 - 3
-        features_extra = np.zeros((xyz.shape[0], len(extra_f_names)))
-        for idx, attr_name in enumerate(extra_f_names):
-            features_extra[:, idx] = np.asarray(plydata.elements[0][attr_name])
-        # Reshape (P,F*SH_coeffs) to (P, F, SH_coeffs except DC)
-        features_extra = features_extra.reshape((features_extra.shape[0], 3, (self.max_sh_degree + 1) ** 2 - 1))
-
-        scale_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("scale_")]
-        scale_names = sorted(scale_names, key = lambda x: int(x.split('_')[-1]))
-        scales = np.zeros((xyz.shape[0], len(scale_names)))
-        for idx, attr_name in enumerate(scale_names):
-            scales[:, idx] = np.asarray(plydata.elements[0][attr_name])
-
-        rot_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("rot")]
-        rot_names = sorted(rot_names, key = lambda x: int(x.split('_')[-1]))
-        rots = np.zeros((xyz.shape[0], len(rot_names)))
-        for idx, attr_name in enumerate(rot_names):
-            rots[:, idx] = np.asarray(plydata.elements[0][attr_name])
-
-        self._xyz = nn.Parameter(torch.tensor(xyz, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._features_dc = nn.Parameter(torch.tensor(features_dc, dtype=torch.float, device="cuda").transpose(1, 2).contiguous().requires_grad_(True))
-        self._features_rest = nn.Parameter(torch.tensor(features_extra, dtype=torch.float, device="cuda").transpose(1, 2).contiguous().requires_grad_(True))
-        self._opacity = nn.Parameter(torch.tensor(opacities, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._scaling = nn.Parameter(torch.tensor(scales, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._rotation = nn.Parameter(torch.tensor(rots, dtype=torch.float, device="cuda").requires_grad_(True))
+    def save_ply(self, path, chunk_size=1 << 20, tensors=None):
+        # tensors: snapshot from compact_tensors to write instead of the live parameters
+        tensors = tensors if tensors is not None else self.compact_tensors()
+        # transposed views, the writer flattens them chunk by chunk
+        f_dc = tensors["f_dc"].transpose(1, 2)
+        f_rest = tensors["f_rest"].transpose(1, 2)
+        attributes = self.construct_list_of_attributes()
+        columns = [(['x', 'y', 'z'], tensors["xyz"]), (['nx', 'ny', 'nz'], None)]
+        for prefix, data in [('f_dc_', f_dc), ('f_rest_', f_rest), ('opacity', tensors["opacity"]),
+                             ('scale_', tensors["scaling"]), ('rot_', tensors["rotation"])]:
+            columns.append(([attribute for attribute in attributes if attribute.startswith(prefix)], data))
+        write_ply(path, [(names, 'f4', data) for names, data in columns], chunk_size=chunk_size)
 
-        self.sh_degree = self.max_sh_degree
+    def load_ply(self, path, rows=None, device=None):
+        """
+        Load Gaussians from a PLY written by save_ply, replacing every attribute.
+        rows: slice, index array or boolean mask of the Gaussians to load, all by default
+        device: device of the loaded tensors, cfg.device by default
+        """
+        self.set_compact_tensors(self.read_ply_tensors(path, rows=rows, device=device))
+
+    def read_ply_tensors(self, path, attributes=None, rows=None, device=None):
+        """
+        Tensors of a PLY written by save_ply by compact_tensors name, without touching the model.
+        The binary body is memory-mapped and every attribute group is converted to float32 with a
+        single copy.
+        attributes: subset of ("xyz", "f_dc", "f_rest", "opacity", "scaling", "rotation") to read, all by default
+        rows: slice, index array or boolean mask of the Gaussians to read, all by default
+        device: device of the tensors, cfg.device by default
+        """
+        attributes = attributes if attributes is not None else ["xyz", "f_dc", "f_rest", "opacity", "scaling", "rotation"]
+        device = device if device is not None else self.cfg.device
+        vertices = load_ply_element(path, "vertex")
+        if rows is not None:
+            vertices = vertices[rows]
+        num_points = len(vertices)
+
+        def property_names(prefix):
+            names = [name for name in vertices.dtype.names if name.startswith(prefix)]
+            return sorted(names, key = lambda x: int(x.split('_')[-1]))
+
+        def to_tensor(array):
+            return torch.from_numpy(array).to(device)
+
+        tensors = {}
+        if "xyz" in attributes:
+            tensors["xyz"] = to_tensor(read_ply_columns(vertices, ['x', 'y', 'z']))
+        if "f_dc" in attributes:
+            features_dc = read_ply_columns(vertices, property_names("f_dc_")).reshape(num_points, 3, 1)
+            tensors["f_dc"] = to_tensor(np.ascontiguousarray(features_dc.transpose(0, 2, 1)))
+        if "f_rest" in attributes:
+            extra_f_names = property_names("f_rest_")
+            assert len(extra_f_names)==3*(self.max_sh_degree + 1) ** 2 - 3
+            # Reshape (P,F*SH_coeffs) to (P, F, SH_coeffs except DC)
+            features_extra = read_ply_columns(vertices, extra_f_names).reshape(num_points, 3, (self.max_sh_degree + 1) ** 2 - 1)
+            tensors["f_rest"] = to_tensor(np.ascontiguousarray(features_extra.transpose(0, 2, 1)))
+        if "opacity" in attributes:
+            tensors["opacity"] = to_tensor(read_ply_columns(vertices, ['opacity']))
+        if "scaling" in attributes:
+            tensors["scaling"] = to_tensor(read_ply_columns(vertices, property_names("scale_")))
+        if "rotation" in attributes:
+            tensors["rotation"] = to_tensor(read_ply_columns(vertices, property_names("rot")))
+        return tensors
     
+    def compact_tensors(self):
+        return {"xyz": self._xyz, "f_dc": self._features_dc, "f_rest": self._features_rest,
+                "opacity": self._opacity, "scaling": self._scaling, "rotation": self._rotation}
+
+    def set_compact_tensors(self, tensors):
+        def to_parameter(tensor):
+            return nn.Parameter(tensor.requires_grad_(True))
+        self._xyz = to_parameter(tensors["xyz"])
+        self._features_dc = to_parameter(tensors["f_dc"])
+        self._features_rest = to_parameter(tensors["f_rest"])
+        self._opacity = to_parameter(tensors["opacity"])
+        self._scaling = to_parameter(tensors["scaling"])
+        self._rotation = to_parameter(tensors["rotation"])
+        self.sh_degree = self.max_sh_degree
+        self._spatial_index = None
+        self.lod = None
+
+    def save_compact(self, path, sh_codebook_size=4096, geometry_codebook_size=4096,
+                     position_format="uint16", kmeans_iterations=10):
+        """
+        Save in the vector-quantized compact format (see compression_utils.encode_gaussians).
+        Returns the compression ratio against save_ply and the per-attribute RMSE of the decoded model.
+        """
+        tensors = self.compact_tensors()
+        _, errors = encode_gaussians(path, tensors, sh_codebook_size=sh_codebook_size,
+                                     geometry_codebook_size=geometry_codebook_size,
+                                     position_format=position_format, kmeans_iterations=kmeans_iterations)
+        num_points = self._xyz.shape[0]
+        attributes = self.construct_list_of_attributes()
+        ply_bytes = len(ply_header(num_points, [(name, 'f4') for name in attributes])) + num_points * 4 * len(attributes)
+        report = {"num_points": num_points, "compact_bytes": os.path.getsize(path), "ply_bytes": ply_bytes}
+        report["compression_ratio"] = ply_bytes / max(report["compact_bytes"], 1)
+        report.update(errors)
+        self.logger.info(f"Compact model: {report['compact_bytes'] / 2**20:.2f} MB, "
+                         f"{report['compression_ratio']:.1f}x smaller than PLY")
+        return report
+
+    def load_compact(self, path, device=None):
+        self.set_compact_tensors(decode_gaussians(path, device if device is not None else self.cfg.device))
+
+    def build_lod(self, depth=16):
+        self.lod = build_hierarchy(self.compact_tensors(), depth=depth)
+        self.logger.info(f"LoD hierarchy: {self.lod.num_nodes} nodes over {self.lod.num_leaves} Gaussians")
+        return self.lod
+
+    def save_lod(self, path, depth=16):
+        (self.lod if self.lod is not None else self.build_lod(depth)).save(path)
+
+    def load_lod(self, path, device=None):
+        self.lod = GaussianHierarchy.load(path, device if device is not None else self.cfg.device)
+
     def _restore(self, state, spatial_lr_scale):
         (self.sh_degree,
         self._xyz,
@@ -219,4 +310,6 @@ class GaussianRepr(BaseRepr):
         self._scaling,
         self._rotation,
         self._opacity) = state
-        self.spatial_lr_scale = spatial_lr_scale
\ No newline at end of file
+        self.spatial_lr_scale = spatial_lr_scale
+        self._spatial_index = None
+        self.lod = None
\ No newline at end of file
@@ -7,6 +7,8 @@ class BaseStructOptim(ABC):
     def __init__(self, cfg, logger) -> None:
         self.cfg = parse_structured(self.config_class, cfg)
         self.logger = logger
+        # per-step statistics for the recorder
+        self.stats = {}
 
     @property
     @abstractmethod
@@ -1,7 +1,10 @@
+import math
 import torch
 import gsplatstudio
 from gsplatstudio.utils.gaussian_utils import build_rotation, inverse_sigmoid
 from gsplatstudio.utils.type_utils import *
+from gsplatstudio.utils.growable_storage import GrowableStorage
+from gsplatstudio.utils.checkpoint_utils import compact_storage
 from gsplatstudio.models.structOptim.base_structOptim import BaseStructOptim
 
 @dataclass
@@ -16,6 +19,12 @@ class SplitWithCloneWithPruneConfig:
     min_opacity: float = 0.005
     num_split: int = 2
     size_threshold: int = 20
+    # rows built, appended and compacted per chunk when densification rebuilds the parameters, 0 takes all at once
+    densify_chunk_size: int = 0
+    # caps on the Gaussian count and on the memory of their parameters, gradients and Adam
+    # moments; densification then keeps the candidates with the largest gradients, 0 disables
+    max_gaussians: int = 0
+    max_memory_mb: float = 0.0
 
 @gsplatstudio.register("split+clone+prune-structOptim")
 class SplitWithCloneWithPrune(BaseStructOptim):
@@ -27,33 +36,39 @@ class SplitWithCloneWithPrune(BaseStructOptim):
     @property
     def state(self):
         return (
-            self.max_radii2D,
-            self.xyz_gradient_accum,
-            self.denom  
+            compact_storage(self.max_radii2D),
+            compact_storage(self.xyz_gradient_accum),
+            compact_storage(self.denom)
         )
     
     def _restore(self, state, spatial_lr_scale):
-        (self.max_radii2D,
-        self.xyz_gradient_accum,
-        self.denom) = state
+        max_radii2D, xyz_gradient_accum, denom = state
+        self.stat_store = GrowableStorage(torch.cat((xyz_gradient_accum, denom, max_radii2D[:, None].float()), dim=1))
+        self.bind_stats()
         self.spatial_lr_scale = spatial_lr_scale
 
     def init_optim(self, representation, spatial_lr_scale):
         self.spatial_lr_scale = spatial_lr_scale
+        self.stat_store = None
         self.reset_stats(representation)      
         
     def update_optim(self, iteration, representation, paramOptim, render_pkg, is_white_background):
-        viewspace_point_tensor, visibility_filter, radii = render_pkg["viewspace_points"], render_pkg["visibility_filter"], render_pkg["radii"]
+        # a batched step passes the render packages of all its views
+        render_pkgs = render_pkg if isinstance(render_pkg, list) else [render_pkg]
         if iteration < self.cfg.densify_until_iter:
-            # Keep track of max radii in image-space for pruning
-            self.max_radii2D[visibility_filter] = torch.max(self.max_radii2D[visibility_filter], radii[visibility_filter])
-            self.xyz_gradient_accum[visibility_filter] += torch.norm(viewspace_point_tensor.grad[visibility_filter,:2], dim=-1, keepdim=True)
-            self.denom[visibility_filter] += 1
+            for render_pkg in render_pkgs:
+                viewspace_point_tensor, visibility_filter, radii = render_pkg["viewspace_points"], render_pkg["visibility_filter"], render_pkg["radii"]
+                # Keep track of max radii in image-space for pruning
+                self.max_radii2D[visibility_filter] = torch.max(self.max_radii2D[visibility_filter], radii[visibility_filter])
+                self.xyz_gradient_accum[visibility_filter] += torch.norm(viewspace_point_tensor.grad[visibility_filter,:2], dim=-1, keepdim=True)
+                self.denom[visibility_filter] += 1
 
             if iteration > self.cfg.densify_from_iter and iteration % self.cfg.densification_interval == 0:
                 self.densify_and_prune(iteration, representation, paramOptim)
             if iteration % self.cfg.opacity_reset_interval == 0 or (is_white_background and iteration == self.cfg.densify_from_iter):
                 self.reset_model_opacity(representation, paramOptim)
+        self.stats["num_gaussians"] = representation.xyz.shape[0]
+        self.stats["gaussian_memory_mb"] = representation.xyz.shape[0] * self.gaussian_bytes(representation) / 2**20
     
     def should_start_limit_size(self,iteration):
         return iteration > self.cfg.opacity_reset_interval
@@ -61,82 +76,168 @@ class SplitWithCloneWithPrune(BaseStructOptim):
     def densify_and_prune(self, iteration, representation, paramOptim):
         grads = self.xyz_gradient_accum / self.denom
         grads[grads.isnan()] = 0.0
-        
-        self.densify_and_clone(representation, paramOptim, grads)
-        self.densify_and_split(representation, paramOptim, grads)
 
-        prune_mask = (representation.opacity < self.cfg.min_opacity).squeeze()
+        plan = self.plan_densification(iteration, representation, grads)
+        self.apply_densification(plan, representation, paramOptim)
+        # releasing the cached blocks only helps when every densification reallocates the model
+        if not paramOptim.reserves_capacity:
+            torch.cuda.empty_cache()
+
+    def row_chunks(self, num_rows):
+        chunk_size = self.cfg.densify_chunk_size or max(num_rows, 1)
+        return [slice(start, start + chunk_size) for start in range(0, max(num_rows, 1), chunk_size)]
+
+    def plan_densification(self, iteration, representation, grads):
+        """
+        The rows that cloning, splitting and the final pruning keep, clone and split, decided on
+        the current tensors so they can be applied in one pass. The result is the same as running
+        the three passes one after the other: the kept rows in order, then the clones, then the
+        split children, from the same split samples. Under a budget only the candidates with the
+        largest gradients that fit next to the Gaussians surviving the pruning are densified.
+        """
+        num_split = self.cfg.num_split
+        chunks = self.row_chunks(representation.xyz.shape[0])
+        max_scaling = torch.cat([representation.scaling_activation(representation._scaling[rows]).max(dim=1).values for rows in chunks])
+        low_opacity = torch.cat([(representation.opacity_activation(representation._opacity[rows]) < self.cfg.min_opacity).squeeze(1) for rows in chunks])
+
+        selected = grads.squeeze(1) >= self.cfg.densify_grad_threshold
+        small = max_scaling <= self.cfg.percent_dense * self.spatial_lr_scale
+        split_index = torch.nonzero(selected & ~small).squeeze(1)
+
+        # clones and split children have the opacity of their source
+        prune_mask = low_opacity
+        child_prune_mask = low_opacity[split_index]
         if self.should_start_limit_size(iteration):
-            big_points_vs = self.max_radii2D > self.cfg.size_threshold
-            big_points_ws = representation.scaling.max(dim=1).values > 0.1 * self.spatial_lr_scale
-            prune_mask = torch.logical_or(torch.logical_or(prune_mask, big_points_vs), big_points_ws)
-        self.prune_points(prune_mask, representation, paramOptim)
-        torch.cuda.empty_cache()
-
-    def densify_and_clone(self, representation, paramOptim, grads):
-        # Extract points that satisfy the gradient condition
-        selected_pts_mask = torch.where(torch.norm(grads, dim=-1) >= self.cfg.densify_grad_threshold, True, False)
-        selected_pts_mask = torch.logical_and(selected_pts_mask,
-                                              torch.max(representation.scaling, dim=1).values <= self.cfg.percent_dense*self.spatial_lr_scale)
-        
-        new_tensors_dict = {
-            "xyz": representation._xyz[selected_pts_mask],
-            "f_dc": representation._features_dc[selected_pts_mask],
-            "f_rest": representation._features_rest[selected_pts_mask],
-            "opacity": representation._opacity[selected_pts_mask],
-            "scaling" : representation._scaling[selected_pts_mask],
-            "rotation" : representation._rotation[selected_pts_mask]
-        }
-        
-        self.densification_postfix(representation, paramOptim, new_tensors_dict)
-
-    def densify_and_split(self, representation, paramOptim, grads):
-        # Extract points that satisfy the gradient condition
-        padded_grad = torch.zeros((representation.xyz.shape[0]), device="cuda")
-        padded_grad[:grads.shape[0]] = grads.squeeze()
-        selected_pts_mask = torch.where(padded_grad >= self.cfg.densify_grad_threshold, True, False)
-        selected_pts_mask = torch.logical_and(selected_pts_mask,
-                                              torch.max(representation.scaling, dim=1).values > self.cfg.percent_dense*self.spatial_lr_scale)
-
-        stds = representation.scaling[selected_pts_mask].repeat(self.cfg.num_split,1)
-        means = torch.zeros((stds.size(0), 3),device="cuda")
+            # the densification has reset the 2D radii by then, only the world-space size counts
+            prune_mask = prune_mask | (max_scaling > 0.1 * self.spatial_lr_scale)
+            child_scaling = representation.scaling_activation(representation.scaling_inverse_activation(
+                representation.scaling_activation(representation._scaling[split_index]) / (0.8 * num_split)))
+            child_prune_mask = child_prune_mask | (child_scaling.max(dim=1).values > 0.1 * self.spatial_lr_scale)
+        # clones of pruned Gaussians are pruned with them
+        clone_index = torch.nonzero(selected & small & ~prune_mask).squeeze(1)
+
+        budget = self.gaussian_budget(representation)
+        if budget is not None:
+            num_candidates = clone_index.shape[0] + split_index.shape[0]
+            # a split replaces its source with its surviving children
+            split_cost = num_split * (~child_prune_mask).long() - (~prune_mask[split_index]).long()
+            clone_taken, split_taken = self.select_within_budget(grads.squeeze(1), clone_index, split_index, split_cost,
+                                                                 budget - int((~prune_mask).sum()))
+            clone_index, split_index, child_prune_mask = clone_index[clone_taken], split_index[split_taken], child_prune_mask[split_taken]
+            self.stats["densify_skipped"] = num_candidates - clone_index.shape[0] - split_index.shape[0]
+
+        stds = representation.scaling_activation(representation._scaling[split_index]).repeat(num_split, 1)
+        means = torch.zeros((stds.size(0), 3), device=representation.xyz.device)
         samples = torch.normal(mean=means, std=stds)
-        rots = build_rotation(representation._rotation[selected_pts_mask]).repeat(self.cfg.num_split,1,1)
-        
-        new_tensors_dict = {
-            "xyz": torch.bmm(rots, samples.unsqueeze(-1)).squeeze(-1) + representation.xyz[selected_pts_mask].repeat(self.cfg.num_split, 1),
-            "f_dc": representation._features_dc[selected_pts_mask].repeat(self.cfg.num_split,1,1),
-            "f_rest": representation._features_rest[selected_pts_mask].repeat(self.cfg.num_split,1,1),
-            "opacity": representation._opacity[selected_pts_mask].repeat(self.cfg.num_split,1),
-            "scaling" : representation.scaling_inverse_activation(representation.scaling[selected_pts_mask].repeat(self.cfg.num_split,1) / (0.8*self.cfg.num_split)),
-            "rotation" : representation._rotation[selected_pts_mask].repeat(self.cfg.num_split,1)
+
+        keep_mask = ~prune_mask
+        keep_mask[split_index] = False
+        return {
+            "keep_index": torch.nonzero(keep_mask).squeeze(1),
+            "clone_index": clone_index,
+            "split_index": split_index,
+            "split_samples": samples,
+            "split_keep": ~child_prune_mask.repeat(num_split)
+        }
+
+    def gaussian_bytes(self, representation):
+        """Bytes per Gaussian: parameters, gradients, both Adam moments and the densification statistics."""
+        param_bytes = sum(math.prod(tensor.shape[1:]) * tensor.element_size() for tensor in representation.compact_tensors().values())
+        return 4 * param_bytes + 3 * 4
+
+    def gaussian_budget(self, representation):
+        """The number of Gaussians allowed by max_gaussians and max_memory_mb, None without a cap."""
+        budgets = []
+        if self.cfg.max_gaussians > 0:
+            budgets.append(self.cfg.max_gaussians)
+        if self.cfg.max_memory_mb > 0:
+            budgets.append(int(self.cfg.max_memory_mb * 2**20) // self.gaussian_bytes(representation))
+        return min(budgets) if budgets else None
+
+    def select_within_budget(self, scores, clone_index, split_index, split_cost, room):
+        """Masks of the clones and splits taken, by decreasing score, while their added rows fit in room."""
+        costs = torch.cat((torch.ones_like(clone_index), split_cost))
+        order = torch.argsort(torch.cat((scores[clone_index], scores[split_index])), descending=True, stable=True)
+        fits = torch.cumsum(costs[order], dim=0) <= room
+        num_taken = int(fits.long().cumprod(dim=0).sum())
+        taken = torch.zeros(costs.shape[0], dtype=torch.bool, device=costs.device)
+        taken[order[:num_taken]] = True
+        return taken[:clone_index.shape[0]], taken[clone_index.shape[0]:]
+
+    def split_children(self, representation, split_index, samples, children):
+        """The split children of flat index children, child c = j * len(split_index) + s being the j-th of split_index[s]."""
+        num_split = self.cfg.num_split
+        source = split_index[children % max(split_index.shape[0], 1)]
+        scaling = representation.scaling_activation(representation._scaling[source])
+        rots = build_rotation(representation._rotation[source])
+        return {
+            "xyz": torch.bmm(rots, samples[children].unsqueeze(-1)).squeeze(-1) + representation.xyz[source],
+            "f_dc": representation._features_dc[source],
+            "f_rest": representation._features_rest[source],
+            "opacity": representation._opacity[source],
+            "scaling" : representation.scaling_inverse_activation(scaling / (0.8 * num_split)),
+            "rotation" : representation._rotation[source]
         }
 
-        self.densification_postfix(representation, paramOptim, new_tensors_dict)
-        prune_filter = torch.cat((selected_pts_mask, torch.zeros(self.cfg.num_split * selected_pts_mask.sum(), device="cuda", dtype=bool)))
-        self.prune_points(prune_filter, representation, paramOptim)
+    def new_rows(self, plan, representation, rows):
+        """The slice rows of the appended Gaussians: the clones followed by the split children that are kept."""
+        clone_index = plan["clone_index"]
+        num_clones = clone_index.shape[0]
+        children = torch.nonzero(plan["split_keep"]).squeeze(1)
+        clones = {name: tensor[clone_index[rows]] for name, tensor in representation.compact_tensors().items()}
+        children = self.split_children(representation, plan["split_index"], plan["split_samples"],
+                                       children[max(rows.start - num_clones, 0):max(rows.stop - num_clones, 0)])
+        return {name: torch.cat((clones[name], children[name])) for name in clones}
+
+    def apply_densification(self, plan, representation, paramOptim):
+        """
+        Keep the rows of the plan and append clones and split children behind them. Without a
+        densify_chunk_size this is one paramOptim rebuild. With one, and a paramOptim that reserves
+        capacity, the new rows are built and appended densify_chunk_size at a time behind the current
+        rows, which so stay in place as their sources, and the kept rows are compacted last.
+        """
+        num_points = representation.xyz.shape[0]
+        num_new = plan["clone_index"].shape[0] + int(plan["split_keep"].sum())
+        chunk_size = self.cfg.densify_chunk_size or None
+        if chunk_size is not None and paramOptim.reserves_capacity:
+            for start in range(0, num_new, chunk_size):
+                new_tensors_dict = self.new_rows(plan, representation, slice(start, min(start + chunk_size, num_new)))
+                representation.update_params(paramOptim.cat_tensors(new_tensors_dict))
+            keep_index = torch.cat((plan["keep_index"], torch.arange(num_points, num_points + num_new, device=plan["keep_index"].device)))
+            optimizable_tensors = paramOptim.rebuild_tensors(keep_index, None, chunk_size=chunk_size)
+        else:
+            new_tensors_dict = self.new_rows(plan, representation, slice(0, num_new))
+            optimizable_tensors = paramOptim.rebuild_tensors(plan["keep_index"], new_tensors_dict, chunk_size=chunk_size)
+        representation.update_params(optimizable_tensors)
+        valid_points_mask = torch.zeros(num_points, dtype=torch.bool, device=representation.xyz.device)
+        valid_points_mask[plan["keep_index"]] = True
+        representation.rebuild_spatial_index(valid_points_mask)
+        self.reset_stats(representation)
 
     def prune_points(self, mask, representation, paramOptim):
         valid_points_mask = ~mask
         optimizable_tensors = paramOptim.prune_optim(valid_points_mask)
         representation.update_params(optimizable_tensors)
+        representation.prune_spatial_index(valid_points_mask)
 
-        self.xyz_gradient_accum = self.xyz_gradient_accum[valid_points_mask]
-        self.denom = self.denom[valid_points_mask]
-        self.max_radii2D = self.max_radii2D[valid_points_mask]
-
-    def densification_postfix(self, representation, paramOptim, new_tensors_dict):
-        optimizable_tensors = paramOptim.cat_tensors(new_tensors_dict)
-        representation.update_params(optimizable_tensors)
-        self.reset_stats(representation)
+        self.stat_store.compact(torch.nonzero(valid_points_mask).squeeze(1))
+        self.bind_stats()
 
     def reset_model_opacity(self, representation, paramOptim):
         opacities_new = inverse_sigmoid(torch.min(representation.opacity, torch.ones_like(representation.opacity)*0.01))
         optimizable_tensors = paramOptim.replace_tensor(opacities_new, "opacity")
-        representation._opacity = optimizable_tensors["opacity"]
+        representation.update_params(optimizable_tensors)
 
     def reset_stats(self, representation):
-        self.xyz_gradient_accum = torch.zeros((representation.xyz.shape[0], 1), device="cuda")
-        self.denom = torch.zeros((representation.xyz.shape[0], 1), device="cuda")
-        self.max_radii2D = torch.zeros((representation.xyz.shape[0]), device="cuda")
+        num_points = representation.xyz.shape[0]
+        if self.stat_store is None:
+            self.stat_store = GrowableStorage(torch.zeros((num_points, 3), device=representation.xyz.device))
+        self.stat_store.resize(num_points)
+        self.stat_store.active.zero_()
+        self.bind_stats()
+
+    def bind_stats(self):
+        # gradient accumulator, denominator and max 2D radius are the columns of one growable storage
+        stats = self.stat_store.active
+        self.xyz_gradient_accum, self.denom, self.max_radii2D = stats[:, 0:1], stats[:, 1:2], stats[:, 2]
 
@@ -1,7 +1,11 @@
+import copy
 from pathlib import Path
 from abc import abstractmethod, ABC
 import torch
 from gsplatstudio.utils.config import parse_structured
+from gsplatstudio.utils.checkpoint_utils import write_sharded, save_sharded
+from gsplatstudio.utils.lod_utils import build_hierarchy, lod_path
+from gsplatstudio.utils.compression_utils import compact_path, psnr_drift
 
 
 class BaseTrainer(ABC):
@@ -10,6 +14,8 @@ class BaseTrainer(ABC):
         self.logger = logger
         self.first_iteration = 1
         self.iteration = 0
+        # AsyncSaver used by save_ckpt and save_scene, None saves synchronously
+        self.saver = None
     
     @property
     @abstractmethod
@@ -45,14 +51,49 @@ class BaseTrainer(ABC):
 
     def save_ckpt(self, iteration):
         self.logger.info(f"Saving Checkpoint in ITER {iteration}")
-        filename = f"{iteration}.pth"
-        torch.save(self.state, str(Path(self.ckpt_dir) / filename))
+        # "pth" pickles the whole state, "sharded" writes a directory with one blob per component
+        if getattr(self.cfg, "ckpt_format", "pth") == "sharded":
+            ckpt_path, writer = Path(self.ckpt_dir) / f"{iteration}", write_sharded
+        else:
+            ckpt_path, writer = Path(self.ckpt_dir) / f"{iteration}.pth", torch.save
+        if self.saver is not None:
+            self.saver.save(ckpt_path, self.state, writer=writer)
+        elif writer is write_sharded:
+            save_sharded(self.state, ckpt_path)
+        else:
+            torch.save(self.state, str(ckpt_path))
     
     def save_scene(self, iteration):
         self.logger.info(f"Saving Gaussians in ITER {iteration}")
         ply_path = Path(self.view_dir) / f"point_cloud/iteration_{iteration}" / "point_cloud.ply"
         ply_path.parent.mkdir(parents=True, exist_ok=True)
-        self.representation.save_ply(ply_path)
+        if self.saver is not None:
+            self.saver.save(ply_path, self.representation.compact_tensors(),
+                            writer=lambda tensors, path: self.representation.save_ply(path, tensors=tensors))
+        else:
+            self.representation.save_ply(ply_path)
+        # level-of-detail hierarchy stored next to the PLY
+        if getattr(self.cfg, "save_lod", False):
+            if self.saver is not None:
+                self.saver.save(lod_path(ply_path), self.representation.compact_tensors(),
+                                writer=lambda tensors, path: build_hierarchy(tensors).save(path))
+            else:
+                build_hierarchy(self.representation.compact_tensors()).save(lod_path(ply_path))
+        # vector-quantized model stored next to the PLY
+        if getattr(self.cfg, "save_compact", False):
+            self.save_compact(compact_path(ply_path))
+
+    def save_compact(self, path):
+        """Write the compact model and report its compression ratio and the PSNR drift against the full model."""
+        report = self.representation.save_compact(path)
+        compressed = copy.copy(self.representation)
+        compressed.load_compact(path)
+        pair_list = self.data.get_test_pair_list() or self.data.get_train_pair_list()
+        report.update(psnr_drift(self.renderer, self.representation, compressed, pair_list,
+                                 self.data.cfg.resolution, self.data.cfg.resolution_scales[0]))
+        self.logger.info(f"Compact model PSNR {report['compressed_psnr']:.2f} dB, drift {report['psnr_drift']:.3f} dB")
+        self.recorder.snapshot_stats(report)
+        return report
     
     def set(self, name, value):
         setattr(self, name, value)
@@ -1,3 +1,5 @@
+import time
+import math
 import torch
 from random import randint
 import gsplatstudio
@@ -5,6 +7,9 @@ from pathlib import Path
 from gsplatstudio.models.trainer.base_trainer import BaseTrainer
 from gsplatstudio.utils.type_utils import *
 from gsplatstudio.utils.progress_bar import ProgressBar
+from gsplatstudio.data.prefetcher import ViewpointPrefetcher
+from gsplatstudio.utils.async_saver import AsyncSaver
+from gsplatstudio.utils.checkpoint_utils import ShardedCheckpoint, is_sharded
 
 @dataclass
 class GaussTrainerConfig:
@@ -13,6 +18,24 @@ class GaussTrainerConfig:
     save_iterations: list = field(default_factory=list)
     test_iterations: list = field(default_factory=list)
     ckpt_iterations: list = field(default_factory=list)
+    # number of upcoming training views loaded ahead by worker threads, 0 loads in the loop
+    prefetch_depth: int = 0
+    prefetch_workers: int = 2
+    # write scenes and checkpoints in a background thread from pinned host snapshots
+    async_save: bool = False
+    max_inflight_saves: int = 1
+    # "pth" or "sharded" (memory-mapped directory with one blob per component)
+    ckpt_format: str = "pth"
+    # also write point_cloud_lod.pth, the LoD hierarchy for the renderers' lod_threshold
+    save_lod: bool = False
+    # also write point_cloud.gsvq, the compact model, and log its compression ratio and PSNR drift
+    save_compact: bool = False
+    # views rendered per optimizer step; schedules (densification, lr, saving) still count steps
+    batch_size: int = 1
+    # "mean" or "sum" of the per-view losses
+    loss_reduction: str = "mean"
+    # learning rates multiplied by "none": 1, "linear": batch_size or "sqrt": sqrt(batch_size)
+    lr_scaling: str = "none"
 
 @gsplatstudio.register("vanilla-trainer")
 class VanillaTrainer(BaseTrainer):
@@ -51,22 +74,37 @@ class VanillaTrainer(BaseTrainer):
         # init structOptim from representation
         self.structOptim.init_optim(self.representation, spatial_lr_scale)
 
-    def restore_components(self, system_path, iteration):
-        ckpt_path = Path(system_path) / f"{iteration}.pth"
+    def restore_components(self, system_path, iteration, components=None):
+        """
+        Restore from a .pth or sharded checkpoint. components limits the restore to a subset of
+        ("representation", "structOptim", "paramOptim"), e.g. only the representation for rendering;
+        sharded checkpoints then never read the other shards.
+        """
+        components = components if components is not None else ["representation", "structOptim", "paramOptim"]
+        device = self.representation.cfg.device
+        ckpt_path = Path(system_path) / f"{iteration}"
+        if not is_sharded(ckpt_path):
+            ckpt_path = Path(system_path) / f"{iteration}.pth"
         try:
-            ckpt_dict = torch.load(ckpt_path)
-            spatial_lr_scale = ckpt_dict["data"]
+            if is_sharded(ckpt_path):
+                ckpt = ShardedCheckpoint(ckpt_path)
+                load = lambda name, target_device: ckpt.load(name, device=target_device)
+            else:
+                # checkpoints written by AsyncSaver hold host tensors
+                ckpt_dict = torch.load(ckpt_path, map_location=device)
+                load = lambda name, target_device: ckpt_dict[name]
+            spatial_lr_scale = load("data", "cpu")
+
+            if "representation" in components:
+                self.representation.restore(state = load("representation", device), spatial_lr_scale = spatial_lr_scale)
+            if "structOptim" in components:
+                self.structOptim.restore(state = load("structOptim", device), spatial_lr_scale = spatial_lr_scale)
+            if "paramOptim" in components:
+                param_lr_group = self.representation.create_param_lr_groups(self.paramOptim.cfg)
+                # Adam moves the moments next to their parameters itself
+                self.paramOptim.restore(state = load("paramOptim", "cpu"), spatial_lr_scale = spatial_lr_scale, param_lr_group = param_lr_group, max_iter = self.cfg.iterations)
             
-            pcd_path = Path(self.view_dir) / "point_cloud" / f"iteration_{iteration}" / "point_cloud.ply"
-            self.representation.load_ply(str(pcd_path))
-            self.representation.restore(state = ckpt_dict["representation"], spatial_lr_scale = spatial_lr_scale)
-            
-            self.structOptim.restore(state = ckpt_dict["structOptim"], spatial_lr_scale = spatial_lr_scale)
-            
-            param_lr_group = self.representation.create_param_lr_groups(self.paramOptim.cfg)
-            self.paramOptim.restore(state = ckpt_dict["paramOptim"], spatial_lr_scale = spatial_lr_scale, param_lr_group = param_lr_group, max_iter = self.cfg.iterations)
-            
-            self.first_iteration = ckpt_dict["iteration"] + 1
+            self.first_iteration = load("iteration", "cpu") + 1
             # init progress bar
             self.progress_bar = ProgressBar(first_iter=self.first_iteration, total_iters=self.cfg.iterations)
             
@@ -74,28 +112,65 @@ class VanillaTrainer(BaseTrainer):
             self.logger.warning(f"Cannot load {ckpt_path}! Error: {e} Train from scratch")
             self.setup_components()
 
+    def batch_loss(self, render_pkgs, gt_images):
+        """Loss of a batch of views, the per-view losses reduced by loss_reduction."""
+        loss = sum(self.loss(render_pkg["render"], gt_image) for render_pkg, gt_image in zip(render_pkgs, gt_images))
+        if self.cfg.loss_reduction == "mean":
+            loss = loss / len(render_pkgs)
+        return loss
+
+    def per_view_grads(self, render_pkgs):
+        """Undo the 1 / batch size of the "mean" reduction on viewspace_points.grad, in place."""
+        if self.cfg.loss_reduction == "mean" and len(render_pkgs) > 1:
+            for render_pkg in render_pkgs:
+                render_pkg["viewspace_points"].grad *= len(render_pkgs)
+
     def train(self) -> None:
         ema_loss_for_log = 0.0
         viewpoint_stack = None
         is_white_background = self.renderer.background_color == [255,255,255]
+        prefetcher = None
+        if self.cfg.prefetch_depth > 0:
+            prefetcher = ViewpointPrefetcher(self.data.get_train_pair_list, total=(self.cfg.iterations + 1) * self.cfg.batch_size,
+                                             resolution_input=self.data.cfg.resolution,
+                                             resolution_scale=self.data.cfg.resolution_scales[0],
+                                             device=self.data.cfg.device, depth=self.cfg.prefetch_depth,
+                                             num_workers=self.cfg.prefetch_workers)
+        if self.cfg.async_save:
+            self.saver = AsyncSaver(max_in_flight=self.cfg.max_inflight_saves, logger=self.logger)
+        assert self.cfg.loss_reduction in ["mean", "sum"], f"Unknown loss_reduction {self.cfg.loss_reduction}"
+        assert self.cfg.lr_scaling in ["none", "linear", "sqrt"], f"Unknown lr_scaling {self.cfg.lr_scaling}"
+        lr_scale = {"none": 1.0, "linear": self.cfg.batch_size, "sqrt": math.sqrt(self.cfg.batch_size)}[self.cfg.lr_scaling]
+        if lr_scale != 1.0:
+            self.paramOptim.set_lr_scale(lr_scale)
+        num_images, train_start = 0, time.perf_counter()
         for iteration in range(self.first_iteration, self.first_iteration + self.cfg.iterations + 1):    
+            step_start = time.perf_counter()
             self.paramOptim.update_lr(iteration)
             # Every 1000 its we increase the levels of SH up to a maximum degree
             if iteration % 1000 == 0:
                 self.representation.increment_sh_degree()
 
-            # Pick a random Camera
-            if not viewpoint_stack:
-                viewpoint_stack = self.data.get_train_pair_list().copy()
-            viewpoint_pair = viewpoint_stack.pop(randint(0, len(viewpoint_stack)-1))
+            # Pick random Cameras
+            viewpoint_pairs, gt_images = [], []
+            for _ in range(self.cfg.batch_size):
+                if prefetcher is not None:
+                    viewpoint_pair, gt_image = prefetcher.next()
+                else:
+                    if not viewpoint_stack:
+                        viewpoint_stack = self.data.get_train_pair_list().copy()
+                    viewpoint_pair = viewpoint_stack.pop(randint(0, len(viewpoint_stack)-1))
+                    gt_image = viewpoint_pair.image.get_resolution_data_from_path(self.data.cfg.resolution, self.data.cfg.resolution_scales[0])
+                viewpoint_pairs.append(viewpoint_pair)
+                gt_images.append(gt_image)
 
             # Render
-            render_pkg = self.renderer.render(representation = self.representation, camera = viewpoint_pair.camera)
+            render_pkgs = self.renderer.render_views(representation = self.representation,
+                                                     cameras = [viewpoint_pair.camera for viewpoint_pair in viewpoint_pairs])
 
             # Loss
-            gt_image = viewpoint_pair.image.get_resolution_data_from_path(self.data.cfg.resolution, self.data.cfg.resolution_scales[0])
-            loss = self.loss(render_pkg["render"], gt_image)
-            loss.backward()
+            loss = self.batch_loss(render_pkgs, gt_images)
+            self.paramOptim.backward(loss)
             self.iteration = iteration
 
             with torch.no_grad():
@@ -104,16 +179,32 @@ class VanillaTrainer(BaseTrainer):
                 self.progress_bar.update(iteration, ema_loss_for_log=ema_loss_for_log)
                 self.recorder.snapshot("ema_loss_for_log", ema_loss_for_log)
                 self.recorder.snapshot("loss", loss.clone().detach().cpu().item())
+                memory_cache = getattr(self.data, "memory_cache", None)
+                if memory_cache is not None:
+                    self.recorder.snapshot_stats(memory_cache.stats)
+                self.recorder.snapshot_stats(self.renderer.stats)
+                if prefetcher is not None:
+                    self.recorder.snapshot_stats(prefetcher.stats)
+                if self.saver is not None:
+                    self.recorder.snapshot_stats(self.saver.stats)
 
                 # Log and save
                 if iteration in self.cfg.save_iterations:
                     self.save_scene(iteration)
 
-                # Densification
-                self.structOptim.update_optim(iteration, self.representation, self.paramOptim, render_pkg, is_white_background)
+                # Densification, on the per-view screen-space gradients whatever the loss reduction
+                self.per_view_grads(render_pkgs)
+                self.structOptim.update_optim(iteration, self.representation, self.paramOptim, render_pkgs, is_white_background)
+                self.recorder.snapshot_stats(self.structOptim.stats)
                 
-                # Optimizer step
-                self.paramOptim.update_optim(iteration)
+                # Optimizer step, sparse optims only update the Gaussians seen by one of the views
+                visibility_filter = render_pkgs[0]["visibility_filter"]
+                for render_pkg in render_pkgs[1:]:
+                    visibility_filter = visibility_filter | render_pkg["visibility_filter"]
+                self.paramOptim.update_optim(iteration, visibility_filter=visibility_filter)
+
+                num_images += len(render_pkgs)
+                self.recorder.snapshot_stats({"images_per_sec": len(render_pkgs) / (time.perf_counter() - step_start)})
 
                 # Recorder step
                 self.recorder.update(iteration)
@@ -122,6 +213,15 @@ class VanillaTrainer(BaseTrainer):
                 if iteration in self.cfg.ckpt_iterations:
                     self.save_ckpt(iteration)
 
+        self.logger.info(f"Throughput: {num_images / (time.perf_counter() - train_start):.2f} images/sec")
+        if prefetcher is not None:
+            self.logger.info(f"Prefetch stall time: {prefetcher.stall_time:.3f}s")
+            prefetcher.close()
+        if self.saver is not None:
+            self.saver.close()
+            self.logger.info(f"Save stall time: {self.saver.total_stall:.3f}s")
+            self.saver = None
+
         
 
     
@@ -0,0 +1,105 @@
+import os
+import time
+import threading
+import torch
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from gsplatstudio.utils.checkpoint_utils import replace_dir
+
+
+class AsyncSaver:
+    """
+    Saves objects holding tensors off the training loop.
+
+    save() copies every tensor into pinned host memory with non-blocking copies queued on
+    the current stream and returns; a worker thread waits for the copies, serializes to a
+    temporary file and renames it over the target, so a crash never leaves a truncated
+    file. At most max_in_flight saves are pending, further calls block until one is done.
+    A failed save raises from the next save() or from wait().
+    """
+    def __init__(self, max_in_flight=1, logger=None):
+        self.logger = logger
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        # a single writer keeps saves of the same path ordered
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.futures = []
+        self.last_latency = 0.0
+        self.last_stall = 0.0
+        self.total_stall = 0.0
+
+    @property
+    def stats(self):
+        return {"save_latency_ms": self.last_latency * 1000.0,
+                "save_stall_ms": self.last_stall * 1000.0,
+                "save_total_stall_ms": self.total_stall * 1000.0}
+
+    def snapshot(self, obj):
+        if isinstance(obj, torch.Tensor):
+            tensor = obj.detach()
+            if tensor.is_cuda:
+                host = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+                host.copy_(tensor, non_blocking=True)
+            else:
+                host = tensor.clone()
+            if isinstance(obj, torch.nn.Parameter):
+                host = torch.nn.Parameter(host, requires_grad=obj.requires_grad)
+            return host
+        if isinstance(obj, dict):
+            return type(obj)((key, self.snapshot(value)) for key, value in obj.items())
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self.snapshot(value) for value in obj)
+        return obj
+
+    def save(self, path, obj, writer=torch.save):
+        """Snapshot obj and write it with writer(obj, path) in the background."""
+        start = time.perf_counter()
+        self.raise_failed()
+        self.slots.acquire()
+        try:
+            host_obj = self.snapshot(obj)
+            event = None
+            if torch.cuda.is_available() and torch.cuda.is_initialized():
+                event = torch.cuda.Event()
+                event.record()
+        except BaseException:
+            self.slots.release()
+            raise
+        self.last_stall = time.perf_counter() - start
+        self.total_stall += self.last_stall
+        self.futures.append(self.executor.submit(self.write, Path(path), host_obj, writer, event, start))
+
+    def write(self, path, host_obj, writer, event, start):
+        try:
+            if event is not None:
+                event.synchronize()
+            tmp_path = path.with_name(path.name + ".tmp")
+            writer(host_obj, tmp_path)
+            if tmp_path.is_dir():
+                replace_dir(tmp_path, path)
+            else:
+                os.replace(tmp_path, path)
+            self.last_latency = time.perf_counter() - start
+        except Exception as e:
+            if self.logger is not None:
+                self.logger.error(f"Failed to save {path}: {e}")
+            raise
+        finally:
+            self.slots.release()
+
+    def raise_failed(self):
+        """Forget the finished saves, re-raising the exception of the first one that failed."""
+        done = [future for future in self.futures if future.done()]
+        self.futures = [future for future in self.futures if future not in done]
+        for future in done:
+            future.result()
+
+    def wait(self):
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self.executor.shutdown()
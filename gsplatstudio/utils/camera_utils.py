@@ -1,3 +1,4 @@
+import math
 import torch
 import numpy as np
 from PIL import Image
@@ -12,6 +13,9 @@ class BasicCamera(nn.Module):
                  z_far = 100.0, z_near = 0.01, uid = 0, device = 'cuda',
                  **kwargs):
         super(BasicCamera, self).__init__()
+        # set by CameraBank.attach, the camera then only indexes the bank
+        self.bank = None
+        self.bank_index = None
         self.R = R
         self.T = T
         self.fov_x, self.fov_y = fov_x, fov_y
@@ -25,34 +29,174 @@ class BasicCamera(nn.Module):
             setattr(self, key, value)
         self.trans=np.array([0.0, 0.0, 0.0]), 
         self.scale=1.0
+
+    @property
+    def R(self):
+        return self.bank.R[self.bank_index] if self.bank is not None else self._R
+    @R.setter
+    def R(self, value):
+        if self.bank is not None:
+            self.bank.set_pose(self.bank_index, R=value)
+        else:
+            self._R = value
+    @property
+    def T(self):
+        return self.bank.T[self.bank_index] if self.bank is not None else self._T
+    @T.setter
+    def T(self, value):
+        if self.bank is not None:
+            self.bank.set_pose(self.bank_index, T=value)
+        else:
+            self._T = value
+
+    @property
+    def tanfovx(self):
+        return float(self.bank.tanfov[self.bank_index, 0]) if self.bank is not None else math.tan(self.fov_x * 0.5)
+    @property
+    def tanfovy(self):
+        return float(self.bank.tanfov[self.bank_index, 1]) if self.bank is not None else math.tan(self.fov_y * 0.5)
     
     @property
     def world_view_transform(self):
+        if self.bank is not None:
+            return self.bank.world_view_transform[self.bank_index]
         return torch.tensor(getWorld2View(self.R, self.T, self.trans, self.scale)).transpose(0, 1).to(self.device)
     @property
     def projection_matrix(self):
+        if self.bank is not None:
+            return self.bank.projection_matrix[self.bank_index]
         return getProjectionMatrix(znear=self.z_near, zfar=self.z_far, fovX=self.fov_x, fovY=self.fov_y).transpose(0,1).to(self.device)
     @property
     def full_proj_transform(self):
+        if self.bank is not None:
+            return self.bank.full_proj_transform[self.bank_index]
         return (self.world_view_transform.unsqueeze(0).bmm(self.projection_matrix.unsqueeze(0))).squeeze(0).to(self.device)
     @property
     def camera_center(self):
+        if self.bank is not None:
+            return self.bank.camera_center[self.bank_index]
         return self.world_view_transform.inverse()[3, :3].to(self.device)
 
+class CameraBank:
+    """
+    Structure-of-arrays store of a camera list. View, projection and full projection matrices,
+    camera centers and tan(fov/2) of all cameras are computed in one batched pass and kept on
+    device; attached BasicCameras return views into these tensors. Changing a pose through
+    set_pose (or camera.R / camera.T) invalidates the matrices, other changes to the cameras
+    need an explicit invalidate().
+    """
+    def __init__(self, cameras, device='cuda'):
+        self.device = device
+        self.cameras = list(cameras)
+        self.R = np.array([camera.R for camera in self.cameras], dtype=np.float64).reshape(-1, 3, 3)
+        self.T = np.array([camera.T for camera in self.cameras], dtype=np.float64).reshape(-1, 3)
+        self.invalidate()
+        for index, camera in enumerate(self.cameras):
+            camera.bank, camera.bank_index = self, index
+
+    def __len__(self):
+        return len(self.cameras)
+
+    def set_pose(self, index, R=None, T=None):
+        if R is not None:
+            self.R[index] = R
+        if T is not None:
+            self.T[index] = T
+        self.invalidate()
+
+    def invalidate(self):
+        self.is_valid = False
+
+    def update(self):
+        """Recompute the matrices of every camera, same arithmetic as getWorld2View and getProjectionMatrix."""
+        num_cameras = len(self.cameras)
+        trans = np.array([np.asarray(camera.trans, dtype=np.float64).reshape(3) for camera in self.cameras]).reshape(-1, 3)
+        scale = np.array([camera.scale for camera in self.cameras], dtype=np.float64).reshape(-1, 1)
+        Rt = np.zeros((num_cameras, 4, 4))
+        Rt[:, :3, :3] = self.R.transpose(0, 2, 1)
+        Rt[:, :3, 3] = self.T
+        Rt[:, 3, 3] = 1.0
+        C2W = np.linalg.inv(Rt)
+        C2W[:, :3, 3] = (C2W[:, :3, 3] + trans) * scale
+        world_view = np.float32(np.linalg.inv(C2W))
+
+        fov = np.array([(camera.fov_x, camera.fov_y) for camera in self.cameras], dtype=np.float64).reshape(-1, 2)
+        z_near = np.array([camera.z_near for camera in self.cameras], dtype=np.float64)
+        z_far = np.array([camera.z_far for camera in self.cameras], dtype=np.float64)
+        self._tanfov = np.tan(fov / 2)
+        right = self._tanfov * z_near[:, None]
+        projection = np.zeros((num_cameras, 4, 4))
+        projection[:, 0, 0] = 2.0 * z_near / (2 * right[:, 0])
+        projection[:, 1, 1] = 2.0 * z_near / (2 * right[:, 1])
+        projection[:, 3, 2] = 1.0
+        projection[:, 2, 2] = z_far / (z_far - z_near)
+        projection[:, 2, 3] = -(z_far * z_near) / (z_far - z_near)
+
+        self._world_view_transform = torch.from_numpy(world_view).transpose(1, 2).contiguous().to(self.device)
+        self._projection_matrix = torch.from_numpy(np.float32(projection)).transpose(1, 2).contiguous().to(self.device)
+        self._full_proj_transform = self._world_view_transform.bmm(self._projection_matrix)
+        self._camera_center = self._world_view_transform.inverse()[:, 3, :3]
+        self.is_valid = True
+
+    @property
+    def world_view_transform(self):
+        if not self.is_valid:
+            self.update()
+        return self._world_view_transform
+    @property
+    def projection_matrix(self):
+        if not self.is_valid:
+            self.update()
+        return self._projection_matrix
+    @property
+    def full_proj_transform(self):
+        if not self.is_valid:
+            self.update()
+        return self._full_proj_transform
+    @property
+    def camera_center(self):
+        if not self.is_valid:
+            self.update()
+        return self._camera_center
+    @property
+    def tanfov(self):
+        if not self.is_valid:
+            self.update()
+        return self._tanfov
+
 class BasicImage:
-    def __init__(self, data=None, device = 'cuda', path = None, name = None, gt_alpha_mask = None, keep_data = False, **kwargs):
+    def __init__(self, data=None, device = 'cuda', path = None, name = None, gt_alpha_mask = None, keep_data = False, lazy = False, shape = None, **kwargs):
         # data is a [channels, height, width] tensor
+        # lazy images only read the header of path (or trust a known shape), pixels are decoded on first use
         self.device = device
-        self.data = self.format_data(data, gt_alpha_mask)
+        if lazy and data is None:
+            self.data = None
+            self.channels, self.height, self.width = shape if shape is not None else self.probe_header(path)
+        else:
+            self.data = self.format_data(data, gt_alpha_mask)
+            self.channels, self.height, self.width = self.data.shape
         self.gt_alpha_mask = gt_alpha_mask
-        self.channels, self.height, self.width = self.data.shape
         self.path, self.name = path,name
         for key, value in kwargs.items():
             setattr(self, key, value)
         if not keep_data:
             self.data = None
         self.resolution_data_dict = {}
+        # resolution -> DiskImageCache holding this image, filled by the data module
+        self.disk_cache = {}
+        # MemoryImageCache shared by the data module, replaces resolution_data_dict when set
+        self.memory_cache = None
         
+    @staticmethod
+    def probe_header(path):
+        # Image.open only parses the file header, no pixel data is decoded here
+        with Image.open(path) as image:
+            width, height = image.size
+            bands = image.getbands()
+        # format_data drops the alpha channel of RGBA images after applying it as mask
+        channels = 3 if bands == ("R", "G", "B", "A") else len(bands)
+        return channels, height, width
+
     @staticmethod
     def format_data(data, gt_alpha_mask):
         if data is None:
@@ -119,14 +263,28 @@ class BasicImage:
             resolution = (int(orig_h / scale), int(orig_w / scale))
         return resolution
 
+    def load_resolution_data(self, resolution):
+        # decode and resize on the host, resolution in (height, width)
+        resize_transform = transforms.Resize(resolution)
+        data = Image.open(self.path)
+        data = self.format_data(data, self.gt_alpha_mask)
+        return resize_transform(data.unsqueeze(0)).squeeze(0)
+
+    def read_resolution_data(self, resolution):
+        # host tensor, uint8 when served by the disk cache and float in [0, 1] otherwise
+        disk_cache = self.disk_cache.get(resolution)
+        if disk_cache is not None:
+            return disk_cache.read(self.path)
+        return self.load_resolution_data(resolution)
+
     def get_resolution_data_from_path(self, resolution_input, resolution_scale):
         resolution = self.get_resolution(resolution_input, resolution_scale)
+        if self.memory_cache is not None:
+            return self.memory_cache.get((str(self.path), resolution), lambda: self.read_resolution_data(resolution))
         if self.resolution_data_dict.get(resolution) is None:
-            resize_transform = transforms.Resize(resolution)
-            data = Image.open(self.path)
-            data = self.format_data(data, self.gt_alpha_mask)
-            resized_image_tensor = resize_transform(data.unsqueeze(0)).squeeze(0)
-            data = resized_image_tensor.to(self.device)
+            data = self.read_resolution_data(resolution).to(self.device)
+            if data.dtype == torch.uint8:
+                data = data.float() / 255.0
             self.resolution_data_dict[resolution] = data
         data = self.resolution_data_dict.get(resolution)
         return data
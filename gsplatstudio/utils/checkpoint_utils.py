@@ -0,0 +1,154 @@
+import os
+import json
+import shutil
+import numpy as np
+import torch
+from pathlib import Path
+
+CKPT_INDEX = "index.json"
+CKPT_ALIGNMENT = 64
+
+DTYPES = {str(dtype): dtype for dtype in [torch.float64, torch.float32, torch.float16, torch.bfloat16,
+                                          torch.int64, torch.int32, torch.int16, torch.int8,
+                                          torch.uint8, torch.bool]}
+
+def compact_storage(tensor):
+    """tensor if it spans its whole storage, else a compact copy: torch.save writes the storage of views whole."""
+    if tensor.untyped_storage().nbytes() == tensor.numel() * tensor.element_size():
+        return tensor
+    copy = tensor.detach().clone(memory_format=torch.contiguous_format)
+    return torch.nn.Parameter(copy, requires_grad=tensor.requires_grad) if isinstance(tensor, torch.nn.Parameter) else copy
+
+def encode_tree(obj, tensors):
+    """JSON-compatible copy of obj with every tensor and numpy array replaced by its index in tensors."""
+    if isinstance(obj, torch.Tensor):
+        tensors.append(obj)
+        return {"__tensor__": len(tensors) - 1}
+    if isinstance(obj, np.ndarray):
+        tensors.append(torch.from_numpy(np.ascontiguousarray(obj)))
+        return {"__ndarray__": len(tensors) - 1}
+    if isinstance(obj, np.generic):
+        # e.g. the numpy float radius of the data module's spatial scale
+        return obj.item()
+    if isinstance(obj, dict):
+        # optimizer state dicts use integer keys, keep them as pairs
+        return {"__dict__": [[key, encode_tree(value, tensors)] for key, value in obj.items()]}
+    if isinstance(obj, tuple):
+        return {"__tuple__": [encode_tree(value, tensors) for value in obj]}
+    if isinstance(obj, list):
+        return [encode_tree(value, tensors) for value in obj]
+    return obj
+
+def decode_tree(tree, tensors):
+    if isinstance(tree, dict):
+        if "__tensor__" in tree:
+            return tensors[tree["__tensor__"]]
+        if "__ndarray__" in tree:
+            return tensors[tree["__ndarray__"]].cpu().numpy()
+        if "__dict__" in tree:
+            return {key: decode_tree(value, tensors) for key, value in tree["__dict__"]}
+        if "__tuple__" in tree:
+            return tuple(decode_tree(value, tensors) for value in tree["__tuple__"])
+    if isinstance(tree, list):
+        return [decode_tree(value, tensors) for value in tree]
+    return tree
+
+def write_sharded(state, path):
+    """
+    Write a dict of components as a checkpoint directory: index.json holds the structure of
+    every component and <component>.bin the raw bytes of its tensors, 64-byte aligned.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    index = {"components": {}}
+    for name, component in state.items():
+        tensors = []
+        entry = {"tree": encode_tree(component, tensors), "tensors": []}
+        if tensors:
+            entry["file"] = f"{name}.bin"
+            offset = 0
+            with open(path / entry["file"], "wb") as file:
+                for tensor in tensors:
+                    data = tensor.detach().cpu().contiguous()
+                    nbytes = data.numel() * data.element_size()
+                    entry["tensors"].append({"dtype": str(data.dtype), "shape": list(data.shape), "offset": offset,
+                                             "nbytes": nbytes, "parameter": isinstance(tensor, torch.nn.Parameter),
+                                             "requires_grad": tensor.requires_grad})
+                    file.write(data.reshape(-1).view(torch.uint8).numpy().data)
+                    padding = -nbytes % CKPT_ALIGNMENT
+                    file.write(b"\x00" * padding)
+                    offset += nbytes + padding
+        index["components"][name] = entry
+    with open(path / CKPT_INDEX, "w") as file:
+        json.dump(index, file)
+
+def save_sharded(state, path):
+    """write_sharded into a temporary directory renamed over path once complete."""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    write_sharded(state, tmp_path)
+    replace_dir(tmp_path, path)
+
+def replace_dir(src, dst):
+    """
+    Rename the directory src over dst. An existing dst is renamed to <dst>.old first and only
+    deleted once src is in place, so a crash in between still leaves the old checkpoint.
+    """
+    dst = Path(dst)
+    old_path = None
+    if dst.is_dir():
+        old_path = dst.with_name(dst.name + ".old")
+        if old_path.exists():
+            shutil.rmtree(old_path)
+        os.replace(dst, old_path)
+    os.replace(src, dst)
+    if old_path is not None:
+        shutil.rmtree(old_path)
+
+def is_sharded(path):
+    return (Path(path) / CKPT_INDEX).is_file()
+
+
+class ShardedCheckpoint:
+    """
+    Read side of write_sharded. Components are decoded on first access only: their blob is
+    memory-mapped and tensors are moved to the requested device one component at a time,
+    so e.g. restoring the representation never reads the optimizer shard.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / CKPT_INDEX) as file:
+            self.index = json.load(file)["components"]
+        self.loaded = {}
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def keys(self):
+        return self.index.keys()
+
+    def __getitem__(self, name):
+        return self.load(name)
+
+    def load(self, name, device="cpu"):
+        key = (name, str(device))
+        if key not in self.loaded:
+            entry = self.index[name]
+            tensors = []
+            if entry["tensors"]:
+                blob_path = self.path / entry["file"]
+                blob = np.memmap(blob_path, dtype=np.uint8, mode="c") if blob_path.stat().st_size > 0 else np.zeros(0, np.uint8)
+                for meta in entry["tensors"]:
+                    if meta["nbytes"] == 0:
+                        # an empty slice of the blob cannot be viewed as a wider dtype
+                        tensor = torch.empty(meta["shape"], dtype=DTYPES[meta["dtype"]], device=device)
+                    else:
+                        raw = torch.from_numpy(blob[meta["offset"]:meta["offset"] + meta["nbytes"]])
+                        tensor = raw.view(DTYPES[meta["dtype"]]).reshape(meta["shape"]).to(device)
+                    if meta["parameter"]:
+                        tensor = torch.nn.Parameter(tensor, requires_grad=meta["requires_grad"])
+                    tensors.append(tensor)
+            self.loaded[key] = decode_tree(entry["tree"], tensors)
+        return self.loaded[key]
@@ -0,0 +1,193 @@
+import json
+import lzma
+import struct
+import numpy as np
+from pathlib import Path
+import torch
+
+COMPACT_MAGIC = b"GSVQ"
+COMPACT_VERSION = 1
+COMPACT_SUFFIX = ".gsvq"
+
+def compact_path(ply_path):
+    """Where the compact model of a PLY is stored: point_cloud.ply -> point_cloud.gsvq."""
+    return Path(ply_path).with_suffix(COMPACT_SUFFIX)
+
+def kmeans(data, num_clusters, num_iterations=10, sample_size=1 << 18, chunk_size=1 << 13, seed=0):
+    """
+    Lloyd's k-means on the device of data [N, D]. Centroids are fitted on a random subset of
+    at most sample_size rows, then every row is assigned. Returns (codebook [K, D], indices [N]).
+    """
+    if data.shape[0] == 0:
+        return data.new_empty((0, data.shape[1])), torch.empty(0, dtype=torch.long, device=data.device)
+    generator = torch.Generator().manual_seed(seed)
+    num_clusters = min(num_clusters, data.shape[0])
+    train = data
+    if data.shape[0] > sample_size:
+        train = data[torch.randperm(data.shape[0], generator=generator)[:sample_size].to(data.device)]
+    codebook = train[torch.randperm(train.shape[0], generator=generator)[:num_clusters].to(data.device)].clone()
+    for _ in range(num_iterations):
+        assignment = kmeans_assign(train, codebook, chunk_size)
+        sums = torch.zeros_like(codebook).index_add_(0, assignment, train)
+        counts = torch.bincount(assignment, minlength=num_clusters)[:, None]
+        # Empty clusters keep their previous centroid
+        codebook = torch.where(counts > 0, sums / counts.clamp_min(1), codebook)
+    return codebook, kmeans_assign(data, codebook, chunk_size)
+
+def kmeans_assign(data, codebook, chunk_size=1 << 13):
+    indices = torch.empty(data.shape[0], dtype=torch.long, device=data.device)
+    codebook_sq = (codebook ** 2).sum(dim=1)
+    for start in range(0, data.shape[0], chunk_size):
+        chunk = data[start:start + chunk_size]
+        indices[start:start + chunk_size] = (codebook_sq[None] - 2 * chunk @ codebook.T).argmin(dim=1)
+    return indices
+
+def morton_order(quantized_xyz):
+    """Permutation sorting uint16 positions [N, 3] along a 30-bit Morton curve."""
+    def spread(v):
+        v = (v >> 6).astype(np.uint64) & 0x3FF
+        v = (v | (v << 16)) & 0x030000FF
+        v = (v | (v << 8)) & 0x0300F00F
+        v = (v | (v << 4)) & 0x030C30C3
+        v = (v | (v << 2)) & 0x09249249
+        return v
+    codes = spread(quantized_xyz[:, 0]) | (spread(quantized_xyz[:, 1]) << 1) | (spread(quantized_xyz[:, 2]) << 2)
+    return np.argsort(codes, kind="stable")
+
+def index_dtype(num_clusters):
+    return np.uint8 if num_clusters <= 1 << 8 else np.uint16 if num_clusters <= 1 << 16 else np.uint32
+
+def write_compact(path, header, blobs):
+    """Write header (json) and named numpy blobs, each one lzma-compressed."""
+    payloads, header["blobs"] = [], []
+    for name, array in blobs.items():
+        array = np.ascontiguousarray(array)
+        payload = lzma.compress(array.tobytes())
+        header["blobs"].append({"name": name, "dtype": array.dtype.str, "shape": list(array.shape), "nbytes": len(payload)})
+        payloads.append(payload)
+    header_bytes = json.dumps(header).encode("utf-8")
+    with open(path, "wb") as file:
+        file.write(COMPACT_MAGIC + struct.pack("<II", COMPACT_VERSION, len(header_bytes)))
+        file.write(header_bytes)
+        for payload in payloads:
+            file.write(payload)
+
+def read_compact(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    assert data[:4] == COMPACT_MAGIC, f"{path} is not a compact Gaussian file"
+    version, header_size = struct.unpack_from("<II", data, 4)
+    assert version == COMPACT_VERSION, f"Unsupported compact Gaussian file version {version}"
+    header = json.loads(data[12:12 + header_size].decode("utf-8"))
+    offset, blobs = 12 + header_size, {}
+    for blob in header["blobs"]:
+        raw = lzma.decompress(data[offset:offset + blob["nbytes"]])
+        blobs[blob["name"]] = np.frombuffer(raw, dtype=np.dtype(blob["dtype"])).reshape(blob["shape"])
+        offset += blob["nbytes"]
+    return header, blobs
+
+def encode_gaussians(path, tensors, sh_codebook_size=4096, geometry_codebook_size=4096,
+                     position_format="uint16", kmeans_iterations=10, seed=0):
+    """
+    Write Gaussian parameters in the vector-quantized compact format.
+
+    tensors holds the raw parameters "xyz" [N, 3], "f_dc" [N, 1, 3], "f_rest" [N, K, 3],
+    "opacity" [N, 1], "scaling" [N, 3] and "rotation" [N, 4]. Positions are stored as
+    uint16 offsets in the bounding box (or float16), SH rest coefficients and
+    scaling/rotation are replaced by k-means codebook indices, DC colors are float16 and
+    opacities 8 bit. Gaussians are written in Morton order so the index streams compress
+    well. Returns the decoded tensors (in the stored order) and the RMSE of every attribute.
+    """
+    with torch.no_grad():
+        xyz = tensors["xyz"].detach().float()
+        num_points = xyz.shape[0]
+        if num_points > 0:
+            xyz_min, xyz_max = xyz.min(dim=0).values, xyz.max(dim=0).values
+        else:
+            # an empty model has no bounding box, store a unit one at the origin
+            xyz_min, xyz_max = xyz.new_zeros(3), xyz.new_ones(3)
+        extent = (xyz_max - xyz_min).clamp_min(1e-12)
+        quantized_xyz = ((xyz - xyz_min) / extent * 65535).round().clamp(0, 65535).cpu().numpy().astype(np.uint16)
+        order = torch.from_numpy(morton_order(quantized_xyz)).to(xyz.device)
+        tensors = {name: tensor.detach().float()[order] for name, tensor in tensors.items()}
+
+        header = {"num_points": num_points, "position_format": position_format,
+                  "f_rest_shape": list(tensors["f_rest"].shape[1:])}
+        blobs = {}
+        if position_format == "uint16":
+            header["xyz_min"], header["xyz_extent"] = xyz_min.tolist(), extent.tolist()
+            blobs["xyz"] = quantized_xyz[order.cpu().numpy()]
+        else:
+            blobs["xyz"] = tensors["xyz"].half().cpu().numpy()
+        blobs["f_dc"] = tensors["f_dc"].flatten(1).half().cpu().numpy()
+        blobs["opacity"] = (torch.sigmoid(tensors["opacity"]) * 255).round().to(torch.uint8).cpu().numpy()
+
+        if tensors["f_rest"].shape[1] > 0:
+            codebook, indices = kmeans(tensors["f_rest"].flatten(1), sh_codebook_size,
+                                       num_iterations=kmeans_iterations, seed=seed)
+            blobs["f_rest_codebook"] = codebook.half().cpu().numpy()
+            blobs["f_rest_indices"] = indices.cpu().numpy().astype(index_dtype(codebook.shape[0]))
+
+        # q and -q are the same rotation, keep the real part positive before clustering
+        rotation = torch.nn.functional.normalize(tensors["rotation"])
+        rotation = torch.where(rotation[:, :1] < 0, -rotation, rotation)
+        codebook, indices = kmeans(torch.cat((tensors["scaling"], rotation), dim=1), geometry_codebook_size,
+                                   num_iterations=kmeans_iterations, seed=seed)
+        blobs["geometry_codebook"] = codebook.cpu().numpy()
+        blobs["geometry_indices"] = indices.cpu().numpy().astype(index_dtype(codebook.shape[0]))
+
+    write_compact(path, header, blobs)
+    decoded = decode_blobs(header, blobs, xyz.device)
+    tensors["rotation"] = rotation
+    decoded["rotation"] = torch.nn.functional.normalize(decoded["rotation"])
+    with torch.no_grad():
+        errors = {f"{name}_rmse": torch.sqrt(((decoded[name] - tensors[name]) ** 2).mean()).item()
+                  for name in decoded if decoded[name].numel() > 0}
+    return decoded, errors
+
+def decode_gaussians(path, device="cuda"):
+    """Read a compact Gaussian file back into float32 raw parameter tensors on device."""
+    header, blobs = read_compact(path)
+    return decode_blobs(header, blobs, device)
+
+def decode_blobs(header, blobs, device):
+    num_points = header["num_points"]
+
+    def to_tensor(array):
+        return torch.from_numpy(np.array(array)).to(device)
+
+    if header["position_format"] == "uint16":
+        xyz_min, extent = torch.tensor(header["xyz_min"], device=device), torch.tensor(header["xyz_extent"], device=device)
+        xyz = to_tensor(blobs["xyz"].astype(np.float32)) / 65535 * extent + xyz_min
+    else:
+        xyz = to_tensor(blobs["xyz"]).float()
+    opacity = to_tensor(blobs["opacity"]).float().div(255).clamp(1e-6, 1 - 1e-6)
+    geometry = to_tensor(blobs["geometry_codebook"]).float()[to_tensor(blobs["geometry_indices"]).long()]
+    f_rest_shape = header["f_rest_shape"]
+    if "f_rest_codebook" in blobs:
+        f_rest = to_tensor(blobs["f_rest_codebook"]).float()[to_tensor(blobs["f_rest_indices"]).long()]
+    else:
+        f_rest = torch.zeros((num_points, *f_rest_shape), device=device)
+    return {
+        "xyz": xyz.contiguous(),
+        "f_dc": to_tensor(blobs["f_dc"]).float().reshape(num_points, 1, 3),
+        "f_rest": f_rest.reshape(num_points, *f_rest_shape).contiguous(),
+        "opacity": torch.log(opacity / (1 - opacity)),
+        "scaling": geometry[:, :3].contiguous(),
+        "rotation": geometry[:, 3:].contiguous(),
+    }
+
+def psnr_drift(renderer, representation, compressed_representation, pair_list, resolution_input=-1, resolution_scale=1.0):
+    """Mean PSNR against the ground truth of pair_list before and after compression, and their difference."""
+    def mean_psnr(model):
+        values = []
+        for pair in pair_list:
+            rendered = torch.clamp(renderer.render(representation=model, camera=pair.camera)["render"], 0.0, 1.0)
+            gt_image = pair.image.get_resolution_data_from_path(resolution_input, resolution_scale)
+            mse = ((rendered - gt_image) ** 2).mean()
+            values.append((20 * torch.log10(1.0 / torch.sqrt(mse))).item())
+        return float(np.mean(values))
+
+    with torch.no_grad():
+        original, compressed = mean_psnr(representation), mean_psnr(compressed_representation)
+    return {"psnr": original, "compressed_psnr": compressed, "psnr_drift": original - compressed}
@@ -40,7 +40,7 @@ def get_expon_lr_func(
     return helper
 
 def strip_lowerdiag(L):
-    uncertainty = torch.zeros((L.shape[0], 6), dtype=torch.float, device="cuda")
+    uncertainty = torch.zeros((L.shape[0], 6), dtype=L.dtype, device=L.device)
 
     uncertainty[:, 0] = L[:, 0, 0]
     uncertainty[:, 1] = L[:, 0, 1]
@@ -58,7 +58,7 @@ def build_rotation(r):
 
     q = r / norm[:, None]
 
-    R = torch.zeros((q.size(0), 3, 3), device='cuda')
+    R = torch.zeros((q.size(0), 3, 3), dtype=q.dtype, device=q.device)
 
     r = q[:, 0]
     x = q[:, 1]
@@ -76,6 +76,22 @@ def build_rotation(r):
     R[:, 2, 2] = 1 - 2 * (x*x + y*y)
     return R
 
+def rotation_to_quaternion(R):
+    """Inverse of build_rotation: unit quaternions (r, x, y, z) with r >= 0 of rotation matrices [N, 3, 3]."""
+    m00, m01, m02 = R[:, 0, 0], R[:, 0, 1], R[:, 0, 2]
+    m10, m11, m12 = R[:, 1, 0], R[:, 1, 1], R[:, 1, 2]
+    m20, m21, m22 = R[:, 2, 0], R[:, 2, 1], R[:, 2, 2]
+    # row i is 4 q_i q, use the row of the largest component for stability
+    candidates = torch.stack((
+        torch.stack((1 + m00 + m11 + m22, m21 - m12, m02 - m20, m10 - m01), dim=1),
+        torch.stack((m21 - m12, 1 + m00 - m11 - m22, m01 + m10, m02 + m20), dim=1),
+        torch.stack((m02 - m20, m01 + m10, 1 - m00 + m11 - m22, m12 + m21), dim=1),
+        torch.stack((m10 - m01, m02 + m20, m12 + m21, 1 - m00 - m11 + m22), dim=1)), dim=1)
+    best = torch.diagonal(candidates, dim1=1, dim2=2).argmax(dim=1)
+    q = candidates[torch.arange(R.shape[0], device=R.device), best]
+    q = q / q.norm(dim=1, keepdim=True)
+    return torch.where(q[:, :1] < 0, -q, q)
+
 def build_covariance_from_scaling_rotation(scaling, rotation, scaling_modifier=1):
     L = build_scaling_rotation(scaling_modifier * scaling, rotation)
     actual_covariance = L @ L.transpose(1, 2)
@@ -83,7 +99,7 @@ def build_covariance_from_scaling_rotation(scaling, rotation, scaling_modifier=1
     return symm
 
 def build_scaling_rotation(s, r):
-    L = torch.zeros((s.shape[0], 3, 3), dtype=torch.float, device="cuda")
+    L = torch.zeros((s.shape[0], 3, 3), dtype=s.dtype, device=s.device)
     R = build_rotation(r)
 
     L[:,0,0] = s[:,0]
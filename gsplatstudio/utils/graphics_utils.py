@@ -1,3 +1,4 @@
+import math
 import torch
 import numpy as np
 
@@ -65,6 +66,14 @@ def qvec2rotmat(qvec):
          2 * qvec[2] * qvec[3] + 2 * qvec[0] * qvec[1],
          1 - 2 * qvec[1]**2 - 2 * qvec[2]**2]])
 
+def qvec2rotmat_batch(qvecs):
+    """Vectorized qvec2rotmat: (N, 4) quaternions (w, x, y, z) to (N, 3, 3) rotation matrices."""
+    w, x, y, z = np.asarray(qvecs, dtype=np.float64).T
+    return np.stack([
+        np.stack([1 - 2 * y**2 - 2 * z**2, 2 * x * y - 2 * w * z, 2 * z * x + 2 * w * y], axis=-1),
+        np.stack([2 * x * y + 2 * w * z, 1 - 2 * x**2 - 2 * z**2, 2 * y * z - 2 * w * x], axis=-1),
+        np.stack([2 * z * x - 2 * w * y, 2 * y * z + 2 * w * x, 1 - 2 * x**2 - 2 * y**2], axis=-1)], axis=1)
+
 def rotmat2qvec(R):
     Rxx, Ryx, Rzx, Rxy, Ryy, Rzy, Rxz, Ryz, Rzz = R.flat
     K = (
@@ -82,4 +91,26 @@ def rotmat2qvec(R):
     qvec = eigvecs[[3, 0, 1, 2], np.argmax(eigvals)]
     if qvec[0] < 0:
         qvec *= -1
-    return qvec
\ No newline at end of file
+    return qvec
+
+def frustum_cull_mask(means3D, radii3D, viewmatrix, projmatrix, tanfovx, tanfovy, height, width,
+                      near=0.2, margin=16.0):
+    """
+    Conservative per-camera culling of Gaussians bounded by spheres of radii3D (3 sigma) around means3D.
+    A Gaussian is kept unless its center is behind the rasterizer's near plane or its sphere,
+    projected with an upper bound of the EWA Jacobian norm, lies margin pixels outside the image.
+    viewmatrix and projmatrix are the transposed 4x4 matrices used by the rasterizer.
+    """
+    homogeneous = torch.cat((means3D, torch.ones_like(means3D[:, :1])), dim=1)
+    depth = homogeneous @ viewmatrix[:, 2]
+    p_hom = homogeneous @ projmatrix
+    p_ndc = p_hom[:, :2] / (p_hom[:, 3:4] + 1e-7)
+    pixels = ((p_ndc + 1.0) * torch.tensor([width, height], dtype=p_ndc.dtype, device=p_ndc.device) - 1.0) * 0.5
+
+    focal_x, focal_y = width / (2.0 * tanfovx), height / (2.0 * tanfovy)
+    jacobian_norm = math.sqrt(focal_x ** 2 * (1 + (1.3 * tanfovx) ** 2) + focal_y ** 2 * (1 + (1.3 * tanfovy) ** 2))
+    # 3 sigma of the 0.3 dilation and the sqrt(0.1) eigenvalue floor, plus the ceil of the rasterizer
+    radii2D = jacobian_norm * radii3D / depth.clamp_min(near) + 3.4 + margin
+    inside_x = (pixels[:, 0] + radii2D > 0) & (pixels[:, 0] - radii2D < width)
+    inside_y = (pixels[:, 1] + radii2D > 0) & (pixels[:, 1] - radii2D < height)
+    return (depth > near) & inside_x & inside_y
@@ -0,0 +1,61 @@
+import torch
+
+COMPACT_CHUNK_SIZE = 1 << 18
+
+
+class GrowableStorage:
+    """
+    Rows of a tensor along dim with reserved capacity beyond the active count. active is a
+    view of the first count rows; append() writes behind them and only reallocates, by
+    growth_factor, when the capacity runs out, and compact() moves the kept rows to the front
+    in place. Views of the active rows are invalidated by both.
+    """
+    def __init__(self, tensor, dim=0, growth_factor=2.0):
+        self.storage = tensor
+        self.dim = dim
+        self.count = tensor.shape[dim]
+        self.growth_factor = growth_factor
+
+    @property
+    def capacity(self):
+        return self.storage.shape[self.dim]
+
+    @property
+    def active(self):
+        return self.storage.narrow(self.dim, 0, self.count)
+
+    def rows(self, start, end):
+        return self.storage.narrow(self.dim, start, end - start)
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, int(self.capacity * self.growth_factor))
+        shape = list(self.storage.shape)
+        shape[self.dim] = capacity
+        storage = torch.empty(shape, dtype=self.storage.dtype, device=self.storage.device)
+        storage.narrow(self.dim, 0, self.count).copy_(self.active)
+        self.storage = storage
+
+    def resize(self, count):
+        """Set the active count; rows that become active are uninitialized."""
+        self.reserve(count)
+        self.count = count
+
+    def append(self, rows):
+        num_rows = rows.shape[self.dim]
+        self.resize(self.count + num_rows)
+        self.rows(self.count - num_rows, self.count).copy_(rows)
+
+    def compact(self, index, chunk_size=None):
+        """Keep the active rows of index (increasing) as the new active rows, in place."""
+        chunk_size = chunk_size or COMPACT_CHUNK_SIZE
+        # rows before the first removed one stay where they are
+        identity = index == torch.arange(index.shape[0], device=index.device)
+        start = index.shape[0] if bool(identity.all()) else int(torch.nonzero(~identity)[0])
+        # row index[i] >= i, so a chunk never overwrites the sources of the chunks after it
+        for chunk_start in range(start, index.shape[0], chunk_size):
+            chunk = index[chunk_start:chunk_start + chunk_size]
+            self.rows(chunk_start, chunk_start + chunk.shape[0]).copy_(self.storage.index_select(self.dim, chunk))
+        self.count = index.shape[0]
+
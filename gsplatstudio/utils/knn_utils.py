@@ -0,0 +1,85 @@
+import os
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from gsplatstudio.utils.spatial_index import GridIndex
+
+KNN_BACKENDS = ["auto", "simple_knn", "kdtree", "grid"]
+
+
+def simple_knn_available():
+    try:
+        from simple_knn._C import distCUDA2
+    except ImportError:
+        return False
+    return distCUDA2 is not None and torch.cuda.is_available()
+
+def kdtree_available():
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        return False
+    return True
+
+def robust_cell_size(points, points_per_cell=1, sample_size=1 << 20, quantile=0.01):
+    """Cell size for about points_per_cell points per cell, ignoring the outliers SfM clouds usually have."""
+    if points.shape[0] > sample_size:
+        points = points[torch.randint(0, points.shape[0], (sample_size,), generator=torch.Generator().manual_seed(0)).to(points.device)]
+    bounds = torch.quantile(points.float(), torch.tensor([quantile, 1.0 - quantile], device=points.device), dim=0)
+    extent = (bounds[1] - bounds[0]).clamp_min(1e-6)
+    return float((extent.prod() * points_per_cell / points.shape[0]) ** (1.0 / 3.0)) if points.shape[0] > 0 else 1.0
+
+def mean_finite(dist2):
+    # fewer than k other points: average what exists, like distCUDA2 leaves them out
+    finite = torch.isfinite(dist2)
+    return torch.where(finite, dist2, 0).sum(dim=1) / finite.sum(dim=1).clamp_min(1)
+
+def kdtree_mean_knn_dist2(points, k=3, num_threads=None):
+    """Exact mean squared distance to the k nearest other points with scipy's cKDTree, on all cores by default."""
+    from scipy.spatial import cKDTree
+    host_points = points.detach().cpu().double().numpy()
+    # the nearest hit of every point is itself, or a duplicate at the same distance 0
+    dist, _ = cKDTree(host_points).query(host_points, k=k + 1, workers=num_threads or -1)
+    return mean_finite(torch.from_numpy(dist[:, 1:] ** 2)).to(device=points.device, dtype=points.dtype)
+
+def grid_mean_knn_dist2(points, k=3, chunk_size=1 << 16, num_threads=None, points_per_cell=2):
+    """Exact mean squared distance to the k nearest other points, on the device of points."""
+    points = points.detach()
+    index = GridIndex(points, cell_size=robust_cell_size(points, points_per_cell))
+    result = torch.empty(points.shape[0], dtype=points.dtype, device=points.device)
+
+    def run(start):
+        # queries in key order touch neighbouring cells only
+        ids = index.order[start:start + chunk_size]
+        dist2, _ = index.knn(points[ids], k, exclude=ids)
+        result[ids] = mean_finite(dist2)
+
+    starts = range(0, points.shape[0], chunk_size)
+    num_threads = num_threads or min(8, os.cpu_count() or 1)
+    if points.is_cuda or num_threads <= 1:
+        for start in starts:
+            run(start)
+    else:
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            list(executor.map(run, starts))
+    return result
+
+def mean_knn_dist2(points, backend="auto", **kwargs):
+    """
+    Mean squared distance of every point to its 3 nearest neighbours, as used for the initial
+    Gaussian scales. "simple_knn" is the CUDA distCUDA2 kernel, "kdtree" scipy's multithreaded
+    cKDTree on the host and "grid" the exact chunked grid search on the device of points, which
+    needs neither; "auto" picks simple_knn when CUDA is available, else kdtree for host points
+    when scipy is installed, else grid.
+    """
+    assert backend in KNN_BACKENDS, f"Unknown kNN backend {backend}, expected one of {KNN_BACKENDS}"
+    if backend == "auto":
+        if simple_knn_available():
+            backend = "simple_knn"
+        else:
+            backend = "kdtree" if kdtree_available() and not points.is_cuda else "grid"
+    if backend == "simple_knn":
+        from simple_knn._C import distCUDA2
+        return distCUDA2(points.float().cuda())
+    if backend == "kdtree":
+        return kdtree_mean_knn_dist2(points, **kwargs)
+    return grid_mean_knn_dist2(points, **kwargs)
@@ -0,0 +1,222 @@
+import math
+import torch
+from pathlib import Path
+from gsplatstudio.utils.gaussian_utils import build_scaling_rotation, rotation_to_quaternion, inverse_sigmoid
+
+LOD_VERSION = 1
+LOD_SUFFIX = "_lod.pth"
+# nodes of a cut are never closer than the rasterizer's near plane
+NEAR_PLANE = 0.2
+OPACITY_MAX = 0.99
+
+def lod_path(ply_path):
+    """Where the hierarchy of a PLY is stored: point_cloud.ply -> point_cloud_lod.pth."""
+    ply_path = Path(ply_path)
+    return ply_path.with_name(ply_path.stem + LOD_SUFFIX)
+
+def pack_cells(cells):
+    return (cells[:, 0] << 42) | (cells[:, 1] << 21) | cells[:, 2]
+
+def merge_nodes(group, num_groups, weight, mean, cov, dc, rest, radius):
+    """Moment-matched parents of the nodes in every group, weighted by opacity x area."""
+    total = torch.zeros(num_groups, dtype=weight.dtype, device=weight.device).index_add_(0, group, weight)
+    def average(values):
+        shape = (num_groups,) + values.shape[1:]
+        weighted = weight.view(-1, *([1] * (values.dim() - 1))) * values
+        return torch.zeros(shape, dtype=values.dtype, device=values.device).index_add_(0, group, weighted) / total.view(-1, *([1] * (values.dim() - 1)))
+    parent_mean = average(mean)
+    offset = mean - parent_mean[group]
+    parent_cov = average(cov + offset[:, :, None] * offset[:, None, :])
+    # bounding sphere of the children's spheres, at least 3 sigma of the merged Gaussian
+    eigenvalues, eigenvectors = torch.linalg.eigh(parent_cov)
+    eigenvalues = eigenvalues.clamp_min(1e-20)
+    parent_radius = torch.zeros(num_groups, dtype=radius.dtype, device=radius.device).scatter_reduce_(
+        0, group, offset.norm(dim=1) + radius, "amax", include_self=False)
+    parent_radius = torch.maximum(parent_radius, 3.0 * eigenvalues[:, -1].sqrt())
+    # the children's area-weighted coverage spread over the area of the parent
+    area = eigenvalues.prod(dim=1) ** (1.0 / 3.0)
+    opacity = (total / area).clamp(1e-6, OPACITY_MAX)
+    # eigh may return a reflection, rotations need det +1
+    eigenvectors[:, :, 2] *= torch.sign(torch.linalg.det(eigenvectors))[:, None]
+    return {"weight": total, "mean": parent_mean, "cov": parent_cov, "dc": average(dc), "rest": average(rest),
+            "radius": parent_radius, "opacity": opacity, "scaling": 0.5 * torch.log(eigenvalues),
+            "rotation": rotation_to_quaternion(eigenvectors)}
+
+def build_hierarchy(tensors, depth=16):
+    """
+    Build a GaussianHierarchy over the raw Gaussian tensors of GaussianRepr.compact_tensors().
+
+    Gaussians are binned in an octree of the given depth over their bounding box. Walking up
+    the levels, the nodes sharing an octree cell are merged into one parent (moment-matched
+    mean and covariance, opacity x area weighted colour and SH), until a single root is left.
+    """
+    xyz = tensors["xyz"].detach()
+    device, num_leaves = xyz.device, xyz.shape[0]
+    with torch.no_grad():
+        mean = xyz.double()
+        scales = torch.exp(tensors["scaling"].detach().double())
+        L = build_scaling_rotation(scales, tensors["rotation"].detach().double())
+        cov = L @ L.transpose(1, 2)
+        opacity = torch.sigmoid(tensors["opacity"].detach().double()).squeeze(1)
+        weight = (opacity * scales.prod(dim=1) ** (2.0 / 3.0)).clamp_min(1e-30)
+        dc = tensors["f_dc"].detach().double().flatten(1)
+        rest = tensors["f_rest"].detach().double().flatten(1)
+        radius = 3.0 * scales.max(dim=1).values
+
+        lower = mean.min(dim=0).values if num_leaves > 0 else torch.zeros(3, dtype=mean.dtype, device=device)
+        extent = float((mean.max(dim=0).values - lower).max()) if num_leaves > 0 else 1.0
+        cells = ((mean - lower) / max(extent, 1e-12) * ((1 << depth) - 1)).long()
+
+        active = torch.arange(num_leaves, device=device)
+        active_stats = {"weight": weight, "mean": mean, "cov": cov, "dc": dc, "rest": rest, "radius": radius}
+        nodes, parents, children, child_counts = [], [], [], []
+        num_nodes = num_leaves
+        for level in range(1, depth + 1):
+            if active.shape[0] <= 1:
+                break
+            _, inverse, counts = torch.unique(pack_cells(cells >> level), return_inverse=True, return_counts=True)
+            merged = counts[inverse] >= 2
+            if not bool(merged.any()):
+                continue
+            group_index = torch.cumsum(counts >= 2, dim=0) - 1
+            members = torch.nonzero(merged).squeeze(1)
+            group = group_index[inverse[members]]
+            num_groups = int((counts >= 2).sum())
+            parent = merge_nodes(group, num_groups, *[active_stats[name][members] for name in
+                                                      ["weight", "mean", "cov", "dc", "rest", "radius"]])
+            ids = torch.arange(num_nodes, num_nodes + num_groups, device=device)
+            parents.append((active[members], ids[group]))
+            children.append(active[members][torch.argsort(group, stable=True)])
+            child_counts.append(torch.bincount(group, minlength=num_groups))
+            nodes.append(parent)
+            group_cells = torch.empty((num_groups, 3), dtype=cells.dtype, device=device)
+            group_cells[group] = cells[members]
+
+            keep = ~merged
+            active = torch.cat((active[keep], ids))
+            cells = torch.cat((cells[keep], group_cells))
+            active_stats = {name: torch.cat((value[keep], parent[name])) for name, value in active_stats.items()}
+            num_nodes += num_groups
+
+        node_tensors = {name: tensor.detach() for name, tensor in tensors.items()}
+        if nodes:
+            dtype, num_interior = tensors["xyz"].dtype, num_nodes - num_leaves
+            interior = {"xyz": torch.cat([node["mean"] for node in nodes]),
+                        "f_dc": torch.cat([node["dc"] for node in nodes]).reshape(num_interior, *tensors["f_dc"].shape[1:]),
+                        "f_rest": torch.cat([node["rest"] for node in nodes]).reshape(num_interior, *tensors["f_rest"].shape[1:]),
+                        "opacity": inverse_sigmoid(torch.cat([node["opacity"] for node in nodes]))[:, None],
+                        "scaling": torch.cat([node["scaling"] for node in nodes]),
+                        "rotation": torch.cat([node["rotation"] for node in nodes])}
+            node_tensors = {name: torch.cat((node_tensors[name], interior[name].to(dtype))) for name in node_tensors}
+        # rounded up so a float32 parent sphere still contains its children
+        node_radius = torch.cat([radius] + [node["radius"] for node in nodes]).float() * (1.0 + 1e-6)
+        parent_ids = torch.full((num_nodes,), -1, dtype=torch.long, device=device)
+        for child_ids, ids in parents:
+            parent_ids[child_ids] = ids
+        counts = torch.cat([torch.zeros(num_leaves, dtype=torch.long, device=device)] + child_counts)
+        child_ptr = torch.cat((torch.zeros(1, dtype=torch.long, device=device), torch.cumsum(counts, dim=0)))
+        child_ids = torch.cat(children) if children else torch.zeros(0, dtype=torch.long, device=device)
+    return GaussianHierarchy(node_tensors, node_radius, parent_ids, child_ptr, child_ids, num_leaves)
+
+
+class GaussianHierarchy:
+    """
+    Tree of Gaussians whose first num_leaves nodes are the trained ones and the others their
+    merged ancestors. Every node carries a bounding sphere containing those of its children,
+    so its projected size bounds theirs and cut() can descend from the roots only where a
+    node is too large on screen: the work per frame follows the cut, not the scene.
+    """
+    def __init__(self, tensors, radius, parent, child_ptr, child_ids, num_leaves):
+        self.tensors = tensors
+        self.radius = radius
+        self.parent = parent
+        self.child_ptr = child_ptr
+        self.child_ids = child_ids
+        self.num_leaves = num_leaves
+        self.roots = torch.nonzero(parent < 0).squeeze(1)
+
+    @property
+    def num_nodes(self):
+        return self.radius.shape[0]
+
+    def save(self, path):
+        torch.save({"version": LOD_VERSION, "tensors": self.tensors, "radius": self.radius, "parent": self.parent,
+                    "child_ptr": self.child_ptr, "child_ids": self.child_ids, "num_leaves": self.num_leaves}, str(path))
+
+    @classmethod
+    def load(cls, path, device="cpu"):
+        state = torch.load(str(path), map_location=device)
+        assert state["version"] == LOD_VERSION, f"Unsupported LoD version {state['version']}"
+        return cls(state["tensors"], state["radius"], state["parent"], state["child_ptr"], state["child_ids"], state["num_leaves"])
+
+    def children(self, nodes):
+        start, end = self.child_ptr[nodes], self.child_ptr[nodes + 1]
+        counts = end - start
+        slots = torch.arange(int(counts.sum()), device=nodes.device) - torch.repeat_interleave(torch.cumsum(counts, 0) - counts - start, counts)
+        return self.child_ids[slots]
+
+    def cut(self, camera, threshold, margin=16.0):
+        """
+        Nodes to render for camera: the highest ones whose bounding sphere projects to at most
+        threshold pixels (leaves otherwise), skipping subtrees outside the view frustum
+        extended by margin pixels.
+        """
+        device = self.radius.device
+        viewmatrix = camera.world_view_transform.to(device=device, dtype=torch.float32)
+        campos = camera.camera_center.to(device=device, dtype=torch.float32)
+        height, width = int(camera.height), int(camera.width)
+        focal = max(width / (2.0 * camera.tanfovx), height / (2.0 * camera.tanfovy))
+        tan_x = camera.tanfovx * (1.0 + 2.0 * margin / width)
+        tan_y = camera.tanfovy * (1.0 + 2.0 * margin / height)
+        norm_x, norm_y = math.sqrt(1.0 + tan_x ** 2), math.sqrt(1.0 + tan_y ** 2)
+
+        frontier, selected = self.roots, []
+        while frontier.shape[0] > 0:
+            xyz, radius = self.tensors["xyz"][frontier].float(), self.radius[frontier]
+            p_view = torch.cat((xyz, torch.ones_like(xyz[:, :1])), dim=1) @ viewmatrix
+            x, y, z = p_view[:, 0], p_view[:, 1], p_view[:, 2]
+            # signed distances to the side planes of the frustum, positive outside
+            inside = ((z + radius > NEAR_PLANE) & ((x.abs() - tan_x * z) / norm_x < radius)
+                      & ((y.abs() - tan_y * z) / norm_y < radius))
+            frontier, xyz, radius = frontier[inside], xyz[inside], radius[inside]
+            distance = (xyz - campos).norm(dim=1)
+            size = focal * radius / (distance - radius).clamp_min(NEAR_PLANE)
+            expand = (size > threshold) & (self.child_ptr[frontier + 1] > self.child_ptr[frontier])
+            selected.append(frontier[~expand])
+            frontier = self.children(frontier[expand])
+        return torch.cat(selected) if selected else frontier
+
+    def subset(self, representation, index):
+        return GaussianCut(representation, {name: tensor[index] for name, tensor in self.tensors.items()})
+
+
+class GaussianCut:
+    """Rows of a hierarchy that render in place of the representation, with its activations."""
+    def __init__(self, representation, tensors):
+        self.representation = representation
+        self.tensors = tensors
+        self.sh_degree = representation.sh_degree
+        self.max_sh_degree = representation.max_sh_degree
+
+    @property
+    def xyz(self):
+        return self.tensors["xyz"]
+
+    @property
+    def scaling(self):
+        return self.representation.scaling_activation(self.tensors["scaling"])
+
+    @property
+    def rotation(self):
+        return self.representation.rotation_activation(self.tensors["rotation"])
+
+    @property
+    def opacity(self):
+        return self.representation.opacity_activation(self.tensors["opacity"])
+
+    @property
+    def features(self):
+        return torch.cat((self.tensors["f_dc"], self.tensors["f_rest"]), dim=1)
+
+    def covariance(self, scaling_modifier=1):
+        return self.representation.covariance_activation(self.scaling, self.tensors["rotation"], scaling_modifier)
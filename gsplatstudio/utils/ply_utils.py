@@ -0,0 +1,115 @@
+import numpy as np
+import torch
+from plyfile import PlyData
+
+PLY_TYPE_NAMES = {
+    "i1": "char", "u1": "uchar", "i2": "short", "u2": "ushort",
+    "i4": "int", "u4": "uint", "f4": "float", "f8": "double",
+}
+PLY_TYPES = {name: code for code, name in PLY_TYPE_NAMES.items()}
+PLY_TYPES.update({"int8": "i1", "uint8": "u1", "int16": "i2", "uint16": "u2",
+                  "int32": "i4", "uint32": "u4", "float32": "f4", "float64": "f8"})
+
+def ply_header(num_elements, properties, element="vertex"):
+    """Binary little-endian PLY header, formatted like plyfile writes it. properties: [(name, dtype), ...]"""
+    lines = ["ply", "format binary_little_endian 1.0", f"element {element} {num_elements}"]
+    lines += [f"property {PLY_TYPE_NAMES[np.dtype(dtype).str[1:]]} {name}" for name, dtype in properties]
+    lines.append("end_header")
+    return ("\n".join(lines) + "\n").encode("ascii")
+
+def write_ply(path, columns, chunk_size=1 << 20, element="vertex"):
+    """
+    Write a single-element binary little-endian PLY without building Python tuples per row.
+
+    columns is a list of (names, dtype, data) groups; data is a numpy array or torch
+    tensor on any device with N rows of len(names) values each (in C order), or None for
+    zeros. The body is written in chunks of chunk_size rows: each group is copied into a
+    field view of a reusable structured buffer, so device tensors are moved to the host
+    one chunk at a time and no second full copy of the model is held in memory.
+    """
+    properties = [(name, np.dtype(dtype).newbyteorder("<")) for names, dtype, _ in columns for name in names]
+    record_dtype = np.dtype(properties)
+    num_elements = next(len(data) for _, _, data in columns if data is not None)
+    chunk_size = chunk_size if chunk_size and chunk_size > 0 else max(num_elements, 1)
+
+    with open(path, "wb") as file:
+        file.write(ply_header(num_elements, properties, element))
+        records = np.empty(min(chunk_size, num_elements), dtype=record_dtype)
+        for start in range(0, num_elements, chunk_size):
+            end = min(start + chunk_size, num_elements)
+            chunk = records[:end - start]
+            for names, dtype, data in columns:
+                # Fields of a group are contiguous in the record, fill them through one strided view
+                # shaped like the rows of data, so transposed tensors are never flattened into a copy
+                field_dtype, field_offset = record_dtype.fields[names[0]][:2]
+                row_shape = tuple(data.shape[1:]) if data is not None else (len(names),)
+                row_strides = tuple(int(np.prod(row_shape[axis + 1:])) * field_dtype.itemsize for axis in range(len(row_shape)))
+                view = np.ndarray(shape=(len(chunk),) + row_shape, dtype=field_dtype, buffer=chunk,
+                                  offset=field_offset, strides=(record_dtype.itemsize,) + row_strides)
+                if data is None:
+                    view[...] = 0
+                elif isinstance(data, torch.Tensor):
+                    view[...] = data[start:end].detach().cpu().numpy()
+                else:
+                    view[...] = data[start:end]
+            file.write(chunk.view(np.uint8).data)
+
+def read_ply_header(path):
+    """
+    Parse a PLY header. Returns (format, elements, header_size) where elements is a list of
+    (name, count, properties) and properties is a list of (name, type) or (name, None) for
+    list properties.
+    """
+    fmt, elements = None, []
+    with open(path, "rb") as file:
+        assert file.readline().strip() == b"ply", f"{path} is not a PLY file"
+        while True:
+            line = file.readline()
+            assert line, f"Unexpected end of PLY header in {path}"
+            words = line.decode("ascii").split()
+            if not words or words[0] in ("comment", "obj_info"):
+                continue
+            if words[0] == "end_header":
+                return fmt, elements, file.tell()
+            if words[0] == "format":
+                fmt = words[1]
+            elif words[0] == "element":
+                elements.append((words[1], int(words[2]), []))
+            elif words[0] == "property":
+                if words[1] == "list":
+                    elements[-1][2].append((words[4], None))
+                else:
+                    elements[-1][2].append((words[2], PLY_TYPES[words[1]]))
+
+def load_ply_element(path, element="vertex"):
+    """
+    Return the rows of a PLY element as a structured array. Binary elements made of
+    scalar properties (and preceded only by such elements) are memory-mapped, so nothing
+    is read until fields or rows are accessed; other files are parsed with plyfile.
+    """
+    fmt, elements, offset = read_ply_header(path)
+    if fmt in ("binary_little_endian", "binary_big_endian"):
+        byte_order = "<" if fmt == "binary_little_endian" else ">"
+        for name, count, properties in elements:
+            if any(dtype is None for _, dtype in properties):
+                break
+            record_dtype = np.dtype([(prop, byte_order + dtype) for prop, dtype in properties])
+            if name == element:
+                return np.memmap(path, dtype=record_dtype, mode="r", offset=offset, shape=(count,))
+            offset += count * record_dtype.itemsize
+    return PlyData.read(path)[element].data
+
+def read_ply_columns(data, names, dtype=np.float32):
+    """Gather the properties names of a structured array into an (N, len(names)) array of dtype."""
+    field_dtype, field_offset = data.dtype.fields[names[0]][:2]
+    is_contiguous = all(data.dtype.fields[name][:2] == (field_dtype, field_offset + idx * field_dtype.itemsize)
+                        for idx, name in enumerate(names))
+    if is_contiguous and data.strides[0] == data.dtype.itemsize:
+        # Consecutive fields of one type: a single strided view, converted with one copy
+        view = np.ndarray(shape=(len(data), len(names)), dtype=field_dtype, buffer=data,
+                          offset=field_offset, strides=(data.dtype.itemsize, field_dtype.itemsize))
+        return view.astype(dtype)
+    columns = np.empty((len(data), len(names)), dtype=dtype)
+    for idx, name in enumerate(names):
+        columns[:, idx] = data[name]
+    return columns
@@ -37,6 +37,12 @@ class Recorder:
     def snapshot(self, name, value):
         self.data[name].append(value)
 
+    def snapshot_stats(self, stats):
+        # only the statistics configured in the recorder are kept
+        for name, value in stats.items():
+            if name in self.data:
+                self.snapshot(name, value)
+
     def update(self, iteration):
         for record_var in self.cfgs.keys():
             cfg = self.cfgs[record_var]
@@ -0,0 +1,338 @@
+import math
+import threading
+import numpy as np
+import torch
+
+# cell coordinates are packed into 21 bits per axis, z varies fastest
+CELL_BITS = 21
+CELL_OFFSET = 1 << (CELL_BITS - 1)
+
+
+class GridIndex:
+    """
+    Uniform grid over a point set, stored as point ids sorted by packed cell key, on the
+    device of the points.
+
+    The index is maintained incrementally: prune() drops rows with a gather, append()
+    merges the sorted keys of new points and refresh() re-inserts only the points that
+    changed cell. Queries are batched and return (query_ids, point_ids) pairs, sorted
+    by query.
+    """
+    def __init__(self, points, cell_size=None, points_per_cell=8):
+        points = points.detach()
+        if cell_size is None:
+            extent = float((points.max(dim=0).values - points.min(dim=0).values).max()) if points.shape[0] > 0 else 1.0
+            cell_size = max(extent, 1e-6) / max(1.0, (points.shape[0] / points_per_cell) ** (1.0 / 3.0))
+        self.cell_size = float(cell_size)
+        self.device = points.device
+        self.points = points
+        self.keys = self.cell_keys(points)
+        self.order = torch.argsort(self.keys)
+        self.sorted_keys = self.keys[self.order]
+        self._sorted_points = None
+        self._coarser = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.points.shape[0]
+
+    def cells(self, points):
+        return torch.floor(points / self.cell_size).clamp(-CELL_OFFSET, CELL_OFFSET - 1).long()
+
+    def pack(self, cells):
+        cells = cells + CELL_OFFSET
+        return (cells[..., 0] << (2 * CELL_BITS)) | (cells[..., 1] << CELL_BITS) | cells[..., 2]
+
+    def cell_keys(self, points):
+        return self.pack(self.cells(points))
+
+    def prune(self, valid_mask, points=None):
+        """
+        Keep the points of valid_mask, ids are renumbered like the pruned tensors. points are the
+        kept points when the caller has them, e.g. because they were compacted in place.
+        """
+        self.invalidate()
+        new_ids = torch.cumsum(valid_mask.long(), dim=0) - 1
+        keep = valid_mask[self.order]
+        self.order = new_ids[self.order[keep]]
+        self.sorted_keys = self.sorted_keys[keep]
+        self.keys = self.keys[valid_mask]
+        self.points = self.points[valid_mask] if points is None else points.detach()
+
+    def append(self, new_points):
+        """Add points after the existing ones, as torch.cat does for the parameters."""
+        self.invalidate()
+        new_points = new_points.detach()
+        new_keys = self.cell_keys(new_points)
+        new_order = torch.argsort(new_keys) + self.points.shape[0]
+        self.points = torch.cat((self.points, new_points))
+        self.keys = torch.cat((self.keys, new_keys))
+        self.merge(new_order, self.keys[new_order])
+
+    def merge(self, new_order, new_sorted_keys):
+        num_old, num_new = self.sorted_keys.shape[0], new_sorted_keys.shape[0]
+        old_position = torch.arange(num_old, device=self.device) + torch.searchsorted(new_sorted_keys, self.sorted_keys)
+        new_position = torch.arange(num_new, device=self.device) + torch.searchsorted(self.sorted_keys, new_sorted_keys, right=True)
+        order = torch.empty(num_old + num_new, dtype=self.order.dtype, device=self.device)
+        sorted_keys = torch.empty(num_old + num_new, dtype=self.sorted_keys.dtype, device=self.device)
+        order[old_position], order[new_position] = self.order, new_order
+        sorted_keys[old_position], sorted_keys[new_position] = self.sorted_keys, new_sorted_keys
+        self.order, self.sorted_keys = order, sorted_keys
+
+    def refresh(self, points, rebuild_fraction=0.25):
+        """Track moved points; only those that left their cell are re-inserted."""
+        points = points.detach()
+        assert points.shape[0] == self.points.shape[0], "refresh expects the same points, use prune/append for topology changes"
+        self.invalidate()
+        self.points = points
+        keys = self.cell_keys(points)
+        moved = keys != self.keys
+        self.keys = keys
+        num_moved = int(moved.sum())
+        if num_moved == 0:
+            return
+        if num_moved > rebuild_fraction * points.shape[0]:
+            self.order = torch.argsort(keys)
+            self.sorted_keys = keys[self.order]
+            return
+        stay = ~moved[self.order]
+        self.order, self.sorted_keys = self.order[stay], self.sorted_keys[stay]
+        moved_ids = torch.nonzero(moved).squeeze(1)
+        moved_ids = moved_ids[torch.argsort(keys[moved_ids])]
+        self.merge(moved_ids, keys[moved_ids])
+
+    def invalidate(self):
+        self._sorted_points = None
+        self._coarser = None
+
+    @property
+    def sorted_points(self):
+        """Points in key order, so the candidates of a cell range are read contiguously."""
+        with self._lock:
+            if self._sorted_points is None:
+                self._sorted_points = self.points[self.order]
+            return self._sorted_points
+
+    def coarser(self):
+        """Index over the same points with twice the cell size, built on demand for wide searches."""
+        with self._lock:
+            if self._coarser is None:
+                self._coarser = GridIndex(self.points, cell_size=2.0 * self.cell_size)
+            return self._coarser
+
+    def candidates(self, lower, upper):
+        """(query_ids, slots in key order) of all points in the cells overlapped by the boxes [lower, upper]."""
+        lower_cells, upper_cells = self.cells(lower), self.cells(upper)
+        spans = (upper_cells - lower_cells + 1).clamp_min(0)
+        # one contiguous key range per (x, y) column of cells
+        num_columns = spans[:, 0] * spans[:, 1]
+        query_ids = torch.repeat_interleave(torch.arange(lower.shape[0], device=self.device), num_columns)
+        local = torch.arange(query_ids.shape[0], device=self.device) - torch.repeat_interleave(torch.cumsum(num_columns, 0) - num_columns, num_columns)
+        column = torch.stack((lower_cells[query_ids, 0] + local // spans[query_ids, 1],
+                              lower_cells[query_ids, 1] + local % spans[query_ids, 1]), dim=1)
+        start = self.pack(torch.cat((column, lower_cells[query_ids, 2:]), dim=1))
+        end = self.pack(torch.cat((column, upper_cells[query_ids, 2:]), dim=1))
+        begin = torch.searchsorted(self.sorted_keys, start)
+        counts = torch.searchsorted(self.sorted_keys, end, right=True) - begin
+        pair_query = torch.repeat_interleave(query_ids, counts)
+        slots = torch.arange(pair_query.shape[0], device=self.device) - torch.repeat_interleave(torch.cumsum(counts, 0) - counts - begin, counts)
+        return pair_query, slots
+
+    def box(self, lower, upper):
+        """Points inside the axis-aligned boxes lower [B, 3] to upper [B, 3]."""
+        query_ids, slots = self.candidates(lower, upper)
+        points = self.sorted_points[slots]
+        inside = ((points >= lower[query_ids]) & (points <= upper[query_ids])).all(dim=1)
+        return query_ids[inside], self.order[slots[inside]]
+
+    def radius(self, centers, radius):
+        """Points within radius (float or [B]) of centers [B, 3]."""
+        query_ids, point_ids, _ = self.radius_distance2(centers, radius)
+        return query_ids, point_ids
+
+    def radius_distance2(self, centers, radius):
+        radius = torch.as_tensor(radius, dtype=centers.dtype, device=self.device).expand(centers.shape[0])
+        query_ids, slots = self.candidates(centers - radius[:, None], centers + radius[:, None])
+        distance2 = ((self.sorted_points[slots] - centers[query_ids]) ** 2).sum(dim=1)
+        inside = distance2 <= radius[query_ids] ** 2
+        return query_ids[inside], self.order[slots[inside]], distance2[inside]
+
+    def knn(self, queries, k, exclude=None, group_size=32, max_block_size=1 << 22):
+        """
+        Exact k nearest neighbours of queries [B, 3]: squared distances and ids [B, k],
+        padded with inf / -1 when fewer than k points exist. exclude [B] optionally names
+        one point id per query to skip, e.g. the query point itself.
+        Queries are first compared with all points of the 3x3x3 cells around their own (see
+        block_neighbours). When the k-th of those may be beaten by a point outside, it bounds a
+        radius search that settles the query; queries without k candidates retry on the level
+        of coarser(), so a search always visits few cells however far an outlier is from the
+        other points.
+        """
+        num_queries = queries.shape[0]
+        distances = torch.full((num_queries, k), math.inf, dtype=queries.dtype, device=self.device)
+        ids = torch.full((num_queries, k), -1, dtype=torch.long, device=self.device)
+        if len(self) == 0:
+            return distances, ids
+        extent = float((self.points.max(dim=0).values - self.points.min(dim=0).values).norm())
+        pending = torch.arange(num_queries, device=self.device)
+        level = self
+        while pending.shape[0] > 0:
+            level_exclude = None if exclude is None else exclude[pending]
+            level_distances, level_ids, done = level.block_neighbours(queries[pending], k, level_exclude,
+                                                                      group_size=group_size, max_block_size=max_block_size)
+            # once the blocks cover every point, the remaining queries take whatever exists
+            if level.cell_size > extent + float((queries[pending] - self.points[0]).norm(dim=1).max()):
+                done[:] = True
+            distances[pending[done]], ids[pending[done]] = level_distances[done], level_ids[done]
+            bounded = ~done & torch.isfinite(level_distances[:, -1])
+            if bool(bounded.any()):
+                # slightly wider than the k-th distance so rounding never drops it
+                radius = level_distances[bounded, -1].sqrt() * (1.0 + 1e-5)
+                query_ids, point_ids, distance2 = level.radius_distance2(queries[pending[bounded]], radius)
+                if exclude is not None:
+                    keep = point_ids != level_exclude[bounded][query_ids]
+                    query_ids, point_ids, distance2 = query_ids[keep], point_ids[keep], distance2[keep]
+                rows = pending[bounded]
+                distances[rows], ids[rows] = self.nearest_pairs(query_ids, point_ids, distance2, rows.shape[0], k)
+            pending = pending[~done & ~bounded]
+            if pending.shape[0] > 0:
+                level = level.coarser()
+        return distances, ids
+
+    def nearest_pairs(self, query_ids, point_ids, distance2, num_queries, k):
+        """The k nearest of (query_ids, point_ids, distance2) pairs per query, as knn returns them."""
+        distances = torch.full((num_queries, k), math.inf, dtype=distance2.dtype, device=self.device)
+        ids = torch.full((num_queries, k), -1, dtype=torch.long, device=self.device)
+        # rank the hits of every query by distance: sort by distance, then stably by query
+        order = torch.argsort(distance2)
+        order = order[torch.argsort(query_ids[order], stable=True)]
+        query_ids, point_ids, distance2 = query_ids[order], point_ids[order], distance2[order]
+        counts = torch.bincount(query_ids, minlength=num_queries)
+        rank = torch.arange(query_ids.shape[0], device=self.device) - (torch.cumsum(counts, 0) - counts)[query_ids]
+        top = rank < k
+        distances[query_ids[top], rank[top]] = distance2[top]
+        ids[query_ids[top], rank[top]] = point_ids[top]
+        return distances, ids
+
+    def block_neighbours(self, queries, k, exclude=None, group_size=32, max_block_size=1 << 22):
+        """
+        k nearest neighbours of queries among the points of the 3x3x3 cells around theirs, and
+        whether they are exact: no point outside those cells is closer than the margin of the
+        query to their boundary. Queries are grouped by cell, at most group_size per group, and
+        groups of similar candidate counts are compared as padded [groups, queries, candidates]
+        blocks of at most max_block_size distances.
+        """
+        num_queries = queries.shape[0]
+        distances = torch.full((num_queries, k), math.inf, dtype=queries.dtype, device=self.device)
+        ids = torch.full((num_queries, k), -1, dtype=torch.long, device=self.device)
+        keys = self.cell_keys(queries)
+        query_order = torch.argsort(keys)
+        _, cell_counts = torch.unique_consecutive(keys[query_order], return_counts=True)
+
+        # groups of at most group_size queries of one cell, consecutive in query_order
+        num_groups = (cell_counts + group_size - 1) // group_size
+        group_cell_start = torch.repeat_interleave(torch.cumsum(cell_counts, 0) - cell_counts, num_groups)
+        group_rank = torch.arange(group_cell_start.shape[0], device=self.device) - torch.repeat_interleave(torch.cumsum(num_groups, 0) - num_groups, num_groups)
+        group_start = group_cell_start + group_rank * group_size
+        group_count = torch.minimum(torch.repeat_interleave(cell_counts, num_groups) - group_rank * group_size,
+                                    torch.full_like(group_start, group_size))
+        cells = self.cells(queries[query_order[group_start]])
+
+        # candidates: the key ranges of the 3x3 columns of cells around the group's, z varies fastest
+        offsets = torch.tensor([[dx, dy] for dx in (-1, 0, 1) for dy in (-1, 0, 1)], device=self.device)
+        columns = (cells[:, None, :2] + offsets).clamp(-CELL_OFFSET, CELL_OFFSET - 1).expand(-1, 9, -1)
+        lower = self.pack(torch.cat((columns, (cells[:, None, 2:] - 1).clamp_min(-CELL_OFFSET).expand(-1, 9, -1)), dim=2))
+        upper = self.pack(torch.cat((columns, (cells[:, None, 2:] + 1).clamp_max(CELL_OFFSET - 1).expand(-1, 9, -1)), dim=2))
+        column_begin = torch.searchsorted(self.sorted_keys, lower)
+        column_count = torch.searchsorted(self.sorted_keys, upper, right=True) - column_begin
+        num_candidates = column_count.sum(dim=1)
+
+        query_planes, point_planes = queries.T.contiguous(), self.sorted_points.T.contiguous()
+        # batches of groups of equal size in order of candidate count, padded to the widest of the batch
+        group_order = torch.argsort(group_count * (int(num_candidates.max()) + 1) + num_candidates)
+        widths = num_candidates[group_order].clamp_min(1).cpu().numpy()
+        heights = group_count[group_order].cpu().numpy()
+        batch_start = 0
+        while batch_start < widths.shape[0]:
+            batch_end = batch_start + int(np.searchsorted(heights[batch_start:], heights[batch_start], side="right"))
+            sizes = np.arange(1, batch_end - batch_start + 1) * widths[batch_start:batch_end] * heights[batch_start]
+            batch_end = batch_start + max(1, int(np.searchsorted(sizes, max_block_size, side="right")))
+            groups = group_order[batch_start:batch_end]
+            batch_start = batch_end
+            width, height = int(num_candidates[groups].max()), int(group_count[groups].max())
+            if width == 0:
+                continue
+
+            counts = column_count[groups].flatten()
+            pair_group = torch.repeat_interleave(torch.arange(groups.shape[0], device=self.device), num_candidates[groups])
+            pair_index = torch.arange(pair_group.shape[0], device=self.device)
+            pair_slot = pair_index - torch.repeat_interleave(torch.cumsum(counts, 0) - counts - column_begin[groups].flatten(), counts)
+            pair_column = pair_index - (torch.cumsum(num_candidates[groups], 0) - num_candidates[groups])[pair_group]
+            slots = torch.zeros((groups.shape[0], width), dtype=torch.long, device=self.device)
+            slots[pair_group, pair_column] = pair_slot
+            slots = slots.flatten()
+
+            member = torch.arange(height, device=self.device)
+            valid = member < group_count[groups, None]
+            query_ids = query_order[(group_start[groups, None] + member).clamp_max(num_queries - 1)]
+            # summed per axis over contiguous coordinate planes, broadcast to [groups, queries, candidates]
+            block_distances = None
+            for axis in range(3):
+                query_axis = query_planes[axis].index_select(0, query_ids.flatten()).view(groups.shape[0], height, 1)
+                candidate_axis = point_planes[axis].index_select(0, slots).view(groups.shape[0], 1, width)
+                difference = (query_axis - candidate_axis).square_()
+                block_distances = difference if block_distances is None else block_distances.add_(difference)
+            padding = torch.arange(width, device=self.device) >= num_candidates[groups, None]
+            block_distances.masked_fill_(padding[:, None, :], math.inf)
+            candidate_ids = self.order.index_select(0, slots).view(groups.shape[0], 1, width)
+            if exclude is not None:
+                block_distances.masked_fill_(candidate_ids == exclude[query_ids][:, :, None], math.inf)
+            # k rounds of min, topk is slow on many short rows
+            rows = query_ids[valid]
+            for rank in range(min(k, width)):
+                nearest, nearest_index = block_distances.min(dim=2, keepdim=True)
+                block_distances.scatter_(2, nearest_index, math.inf)
+                nearest_ids = torch.gather(candidate_ids.expand(-1, height, -1), 2, nearest_index)
+                nearest, nearest_ids = nearest.squeeze(2)[valid], nearest_ids.squeeze(2)[valid]
+                distances[rows, rank] = nearest
+                ids[rows, rank] = torch.where(torch.isfinite(nearest), nearest_ids, -1)
+
+        # distance of each query to the boundary of its 3x3x3 cells
+        query_cells = self.cells(queries)
+        margin = torch.minimum(queries - (query_cells - 1) * self.cell_size, (query_cells + 2) * self.cell_size - queries).min(dim=1).values
+        done = distances[:, -1] <= margin.clamp_min(0) ** 2
+        return distances, ids, done
+
+    def ray(self, origins, directions, max_t, radius=0.0, segment_cells=4):
+        """
+        Points within radius of the ray segments origins + t * directions, 0 <= t <= max_t.
+        Returns (ray_ids, point_ids, t) sorted by ray then t. Rays are split into segments
+        of segment_cells cells whose bounding boxes are queried.
+        """
+        directions = directions / directions.norm(dim=1, keepdim=True)
+        max_t = torch.as_tensor(max_t, dtype=origins.dtype, device=self.device).expand(origins.shape[0])
+        segment = segment_cells * self.cell_size
+        num_segments = torch.ceil(max_t / segment).long().clamp_min(1)
+        ray_of_segment = torch.repeat_interleave(torch.arange(origins.shape[0], device=self.device), num_segments)
+        step = torch.arange(ray_of_segment.shape[0], device=self.device) - torch.repeat_interleave(torch.cumsum(num_segments, 0) - num_segments, num_segments)
+        t0 = step * segment
+        t1 = torch.minimum(t0 + segment, max_t[ray_of_segment])
+        p0 = origins[ray_of_segment] + t0[:, None] * directions[ray_of_segment]
+        p1 = origins[ray_of_segment] + t1[:, None] * directions[ray_of_segment]
+        segment_ids, slots = self.candidates(torch.minimum(p0, p1) - radius, torch.maximum(p0, p1) + radius)
+        ray_ids, point_ids = ray_of_segment[segment_ids], self.order[slots]
+
+        offset = self.sorted_points[slots] - origins[ray_ids]
+        t = (offset * directions[ray_ids]).sum(dim=1).clamp(min=0).minimum(max_t[ray_ids])
+        distance2 = ((offset - t[:, None] * directions[ray_ids]) ** 2).sum(dim=1)
+        hit = distance2 <= radius ** 2
+        ray_ids, point_ids, t = ray_ids[hit], point_ids[hit], t[hit]
+        # a point can be found by two neighbouring segments
+        pair_key = ray_ids * len(self) + point_ids
+        pair_key, first = torch.unique(pair_key, return_inverse=True)
+        keep = torch.full((pair_key.shape[0],), -1, dtype=torch.long, device=self.device).scatter_(
+            0, first, torch.arange(first.shape[0], device=self.device))
+        ray_ids, point_ids, t = ray_ids[keep], point_ids[keep], t[keep]
+        order = torch.argsort(t)
+        order = order[torch.argsort(ray_ids[order], stable=True)]
+        return ray_ids[order], point_ids[order], t[order]
@@ -0,0 +1,40 @@
+import logging
+import pytest
+import torch
+import gsplatstudio
+
+
+def make_gaussians(num_points, sh_degree=3, seed=0):
+    """GaussianRepr on the CPU holding num_points random Gaussians."""
+    generator = torch.Generator().manual_seed(seed)
+    representation = gsplatstudio.find("gaussian-representation")({"max_sh_degree": sh_degree, "device": "cpu"}, logging.getLogger("tests"))
+    representation.set_compact_tensors({
+        "xyz": torch.randn(num_points, 3, generator=generator),
+        "f_dc": torch.randn(num_points, 1, 3, generator=generator),
+        "f_rest": torch.randn(num_points, (sh_degree + 1) ** 2 - 1, 3, generator=generator),
+        "opacity": torch.randn(num_points, 1, generator=generator),
+        "scaling": torch.randn(num_points, 3, generator=generator) - 3.0,
+        "rotation": torch.randn(num_points, 4, generator=generator),
+    })
+    return representation
+
+
+def make_optim(optim_type, representation, spatial_lr_scale=1.0, **cfg):
+    paramOptim = gsplatstudio.find(optim_type)(cfg, logging.getLogger("tests"))
+    paramOptim.init_optim(representation.create_param_lr_groups(paramOptim.cfg), spatial_lr_scale=spatial_lr_scale, max_iter=100)
+    return paramOptim
+
+
+def train_step(representation, paramOptim, iteration, visibility_filter=None):
+    """One optimizer step on a loss whose gradient is sin(x) on the visible rows and zero on the others."""
+    mask = torch.ones(representation.xyz.shape[0]) if visibility_filter is None else visibility_filter.float()
+    loss = sum((tensor * tensor.detach().sin() * mask.view(-1, *[1] * (tensor.dim() - 1))).sum()
+               for tensor in representation.compact_tensors().values())
+    paramOptim.backward(loss)
+    paramOptim.update_lr(iteration)
+    paramOptim.update_optim(iteration, visibility_filter=visibility_filter)
+
+
+@pytest.fixture
+def gaussians():
+    return make_gaussians(257)
@@ -0,0 +1,57 @@
+import os
+import pytest
+import torch
+from gsplatstudio.utils.async_saver import AsyncSaver
+from gsplatstudio.utils.checkpoint_utils import ShardedCheckpoint, write_sharded
+
+
+def failing_writer(obj, path):
+    raise OSError("disk full")
+
+
+def test_failed_save_raises_from_the_next_save(tmp_path):
+    saver = AsyncSaver()
+    saver.save(tmp_path / "1.pth", {"x": torch.ones(3)}, writer=failing_writer)
+    saver.futures[0].exception()
+    with pytest.raises(OSError, match="disk full"):
+        saver.save(tmp_path / "2.pth", {"x": torch.ones(3)})
+    # the slot of the failed save was released, saving works again
+    saver.save(tmp_path / "3.pth", {"x": torch.ones(3)})
+    saver.close()
+    assert torch.equal(torch.load(tmp_path / "3.pth")["x"], torch.ones(3))
+    assert not (tmp_path / "1.pth").exists()
+
+
+def test_failed_save_raises_from_wait(tmp_path):
+    saver = AsyncSaver()
+    saver.save(tmp_path / "1.pth", {"x": torch.ones(3)}, writer=failing_writer)
+    with pytest.raises(OSError, match="disk full"):
+        saver.close()
+
+
+def test_sharded_save_replaces_the_old_checkpoint(tmp_path):
+    saver = AsyncSaver()
+    for value in [1.0, 2.0]:
+        saver.save(tmp_path / "ckpt", {"x": torch.full((3,), value)}, writer=write_sharded)
+        saver.wait()
+    assert torch.equal(ShardedCheckpoint(tmp_path / "ckpt")["x"], torch.full((3,), 2.0))
+    assert sorted(os.listdir(tmp_path)) == ["ckpt"]
+
+
+def test_crash_while_replacing_keeps_the_old_checkpoint(tmp_path, monkeypatch):
+    saver = AsyncSaver()
+    saver.save(tmp_path / "ckpt", {"x": torch.ones(3)}, writer=write_sharded)
+    saver.wait()
+
+    replace = os.replace
+    def crash_on_second_replace(src, dst, calls=[]):
+        calls.append(dst)
+        if len(calls) == 2:
+            raise OSError("crash")
+        replace(src, dst)
+    monkeypatch.setattr(os, "replace", crash_on_second_replace)
+    saver.save(tmp_path / "ckpt", {"x": torch.zeros(3)}, writer=write_sharded)
+    with pytest.raises(OSError, match="crash"):
+        saver.close()
+    assert torch.equal(ShardedCheckpoint(tmp_path / "ckpt.old")["x"], torch.ones(3))
+    assert torch.equal(ShardedCheckpoint(tmp_path / "ckpt.tmp")["x"], torch.zeros(3))
@@ -0,0 +1,58 @@
+import math
+import logging
+import numpy as np
+import pytest
+import torch
+import gsplatstudio
+from gsplatstudio.utils.camera_utils import BasicCamera
+from conftest import make_gaussians
+
+
+def make_trainer(**cfg):
+    trainer = gsplatstudio.find("vanilla-trainer")(cfg, logging.getLogger("tests"))
+    trainer.loss = gsplatstudio.find("l1+ssim-loss")({}, logging.getLogger("tests"))
+    return trainer
+
+def make_views(num_views):
+    renderer = gsplatstudio.find("torchRasterizer-renderer")({"background_color": [0, 0, 0], "device": "cpu", "num_threads": 1},
+                                                              logging.getLogger("tests"))
+    cameras = [BasicCamera(R=np.eye(3), T=np.array([0.3 * view, 0.0, 4.0]), fov_x=math.radians(60), fov_y=math.radians(45),
+                           height=24, width=32, device="cpu") for view in range(num_views)]
+    generator = torch.Generator().manual_seed(1)
+    gt_images = [torch.rand(3, 24, 32, generator=generator) for _ in range(num_views)]
+    return renderer, cameras, gt_images
+
+def make_scene():
+    representation = make_gaussians(64, sh_degree=1)
+    with torch.no_grad():
+        representation._scaling += 1.5
+    return representation
+
+def test_batch_size_one_matches_single_view_loss():
+    renderer, cameras, gt_images = make_views(1)
+    trainer, representation = make_trainer(batch_size=1), make_scene()
+    render_pkg = renderer.render(representation, cameras[0])
+    expected = trainer.loss(render_pkg["render"], gt_images[0])
+    assert torch.equal(trainer.batch_loss([render_pkg], gt_images), expected)
+
+    viewspace_points = render_pkg["viewspace_points"]
+    expected.backward()
+    expected_grad = viewspace_points.grad.clone()
+    trainer.per_view_grads([render_pkg])
+    assert torch.equal(viewspace_points.grad, expected_grad)
+
+@pytest.mark.parametrize("loss_reduction", ["mean", "sum"])
+def test_batched_viewspace_grads_are_per_view(loss_reduction):
+    renderer, cameras, gt_images = make_views(3)
+    trainer = make_trainer(batch_size=3, loss_reduction=loss_reduction)
+    representation = make_scene()
+    render_pkgs = renderer.render_views(representation, cameras)
+    trainer.batch_loss(render_pkgs, gt_images).backward()
+    trainer.per_view_grads(render_pkgs)
+
+    for camera, gt_image, render_pkg in zip(cameras, gt_images, render_pkgs):
+        single = make_scene()
+        single_pkg = renderer.render(single, camera)
+        trainer.loss(single_pkg["render"], gt_image).backward()
+        assert single_pkg["viewspace_points"].grad.abs().sum() > 0
+        torch.testing.assert_close(render_pkg["viewspace_points"].grad, single_pkg["viewspace_points"].grad, rtol=1e-4, atol=1e-8)
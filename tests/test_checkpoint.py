@@ -0,0 +1,69 @@
+import logging
+import numpy as np
+import pytest
+import torch
+import gsplatstudio
+from gsplatstudio.utils.checkpoint_utils import save_sharded, ShardedCheckpoint
+from conftest import make_gaussians, make_optim, train_step
+
+
+def test_sharded_tree_round_trip(tmp_path):
+    state = {
+        "tree": {0: (torch.arange(5), [torch.ones(2, 3, dtype=torch.bfloat16), None]), "name": "xyz", "lr": 0.5},
+        "params": [torch.nn.Parameter(torch.randn(4, 3)), torch.nn.Parameter(torch.randn(2), requires_grad=False)],
+        "data": {"radius": np.float32(2.5), "translate": np.arange(3.0), "mask": np.array([[True], [False]]),
+                 "transposed": np.arange(6, dtype=np.int16).reshape(2, 3).T},
+        "iteration": 7,
+        "empty": torch.empty(0, 3),
+    }
+    save_sharded(state, tmp_path / "ckpt")
+    checkpoint = ShardedCheckpoint(tmp_path / "ckpt")
+    assert sorted(checkpoint.keys()) == sorted(state)
+    assert checkpoint["iteration"] == 7
+
+    tree = checkpoint.load("tree")
+    assert list(tree) == [0, "name", "lr"] and isinstance(tree[0], tuple)
+    assert torch.equal(tree[0][0], state["tree"][0][0]) and tree[0][1][1] is None
+    assert tree[0][1][0].dtype == torch.bfloat16 and torch.equal(tree[0][1][0], state["tree"][0][1][0])
+
+    for param, expected in zip(checkpoint["params"], state["params"]):
+        assert isinstance(param, torch.nn.Parameter) and param.requires_grad == expected.requires_grad
+        assert torch.equal(param, expected)
+
+    data = checkpoint["data"]
+    assert data["radius"] == 2.5 and isinstance(data["radius"], float)
+    for name in ["translate", "mask", "transposed"]:
+        assert isinstance(data[name], np.ndarray) and data[name].dtype == state["data"][name].dtype
+        np.testing.assert_array_equal(data[name], state["data"][name])
+    assert checkpoint["empty"].shape == (0, 3)
+
+
+@pytest.mark.parametrize("optim_type", ["adam+customLR-paramOptim", "flatAdam-paramOptim"])
+def test_training_state_round_trip(tmp_path, optim_type):
+    representation = make_gaussians(100)
+    paramOptim = make_optim(optim_type, representation)
+    for iteration in range(1, 4):
+        train_step(representation, paramOptim, iteration)
+    # densify so the parameters and moments live in storage with spare rows
+    keep_index = torch.arange(0, 100, 2)
+    new_tensors = {name: tensor.detach()[:30] + 1.0 for name, tensor in make_gaussians(30, seed=1).compact_tensors().items()}
+    representation.update_params(paramOptim.rebuild_tensors(keep_index, new_tensors))
+    train_step(representation, paramOptim, 4)
+
+    save_sharded({"representation": representation.state, "paramOptim": paramOptim.state, "iteration": 4,
+                  "data": {"radius": np.float64(1.5), "translate": np.zeros(3, dtype=np.float32)}}, tmp_path / "ckpt")
+    # only the 80 active rows are written, not the reserved capacity
+    assert (tmp_path / "ckpt" / "representation.bin").stat().st_size < 80 * 60 * 4 + 64 * 6
+
+    checkpoint = ShardedCheckpoint(tmp_path / "ckpt")
+    restored = make_gaussians(1, seed=2)
+    restored.restore(state=checkpoint["representation"], spatial_lr_scale=1.0)
+    restored_optim = gsplatstudio.find(optim_type)({}, logging.getLogger("tests"))
+    restored_optim.restore(state=checkpoint["paramOptim"], max_iter=100, spatial_lr_scale=1.0,
+                           param_lr_group=restored.create_param_lr_groups(restored_optim.cfg))
+
+    for iteration in range(5, 7):
+        train_step(representation, paramOptim, iteration)
+        train_step(restored, restored_optim, iteration)
+    for name, tensor in representation.compact_tensors().items():
+        assert torch.equal(restored.compact_tensors()[name], tensor), name
@@ -0,0 +1,107 @@
+import struct
+import numpy as np
+import pytest
+from gsplatstudio.data.colmap_helper import (read_extrinsics_binary, read_extrinsics_text,
+                                             read_intrinsics_binary, read_intrinsics_text,
+                                             read_points3D_binary, read_points3D_text, qvec2rotmat)
+
+
+@pytest.fixture
+def model():
+    rng = np.random.default_rng(0)
+    cameras = [(1, 640, 480, [500.0, 510.0, 320.0, 240.0]), (3, 800, 600, [400.0, 400.0, 400.5, 300.0])]
+    images = []
+    for idx, num_points2D in enumerate([0, 3, 1, 5]):
+        qvec = rng.normal(size=4)
+        qvec /= np.linalg.norm(qvec)
+        images.append((idx + 10, qvec, rng.normal(size=3), 1 + 2 * (idx % 2), f"img_{idx}é.jpg",
+                       rng.normal(size=(num_points2D, 2)), rng.integers(-1, 100, size=num_points2D)))
+    points = [(idx, rng.normal(size=3), rng.integers(0, 256, size=3), rng.random(), rng.integers(0, 10, size=(idx % 3, 2)))
+              for idx in range(7)]
+    return cameras, images, points
+
+
+def write_binary(path, cameras, images, points):
+    with open(path / "cameras.bin", "wb") as fid:
+        fid.write(struct.pack("<Q", len(cameras)))
+        for camera_id, width, height, params in cameras:
+            # model id 1 is PINHOLE
+            fid.write(struct.pack("<iiQQ4d", camera_id, 1, width, height, *params))
+    with open(path / "images.bin", "wb") as fid:
+        fid.write(struct.pack("<Q", len(images)))
+        for image_id, qvec, tvec, camera_id, name, xys, point3D_ids in images:
+            fid.write(struct.pack("<idddddddi", image_id, *qvec, *tvec, camera_id))
+            fid.write(name.encode("utf-8") + b"\x00")
+            fid.write(struct.pack("<Q", len(xys)))
+            for xy, point3D_id in zip(xys, point3D_ids):
+                fid.write(struct.pack("<ddq", *xy, point3D_id))
+    with open(path / "points3D.bin", "wb") as fid:
+        fid.write(struct.pack("<Q", len(points)))
+        for point_id, xyz, rgb, error, track in points:
+            fid.write(struct.pack("<QdddBBBdQ", point_id, *xyz, *rgb, error, len(track)))
+            for element in track:
+                fid.write(struct.pack("<ii", *element))
+
+
+def write_text(path, cameras, images, points):
+    with open(path / "cameras.txt", "w") as fid:
+        fid.write("# CAMERA_ID, MODEL, WIDTH, HEIGHT, PARAMS[]\n")
+        for camera_id, width, height, params in cameras:
+            fid.write(" ".join([str(camera_id), "PINHOLE", str(width), str(height), *map(repr, params)]) + "\n")
+    with open(path / "images.txt", "w", encoding="utf-8") as fid:
+        fid.write("# IMAGE_ID, QW, QX, QY, QZ, TX, TY, TZ, CAMERA_ID, NAME\n")
+        for image_id, qvec, tvec, camera_id, name, xys, point3D_ids in images:
+            fid.write(" ".join([str(image_id), *map(repr, qvec.tolist()), *map(repr, tvec.tolist()), str(camera_id), name]) + "\n")
+            fid.write(" ".join(f"{x!r} {y!r} {point3D_id}" for (x, y), point3D_id in zip(xys.tolist(), point3D_ids.tolist())) + "\n")
+    with open(path / "points3D.txt", "w") as fid:
+        fid.write("# POINT3D_ID, X, Y, Z, R, G, B, ERROR, TRACK[] as (IMAGE_ID, POINT2D_IDX)\n")
+        for point_id, xyz, rgb, error, track in points:
+            fid.write(" ".join([str(point_id), *map(repr, xyz.tolist()), *map(str, rgb.tolist()), repr(error),
+                                *map(str, track.ravel().tolist())]) + "\n")
+
+
+def test_binary_and_text_readers_agree(tmp_path, model):
+    cameras, images, points = model
+    write_binary(tmp_path, *model)
+    write_text(tmp_path, *model)
+
+    for intrinsics in [read_intrinsics_binary(tmp_path / "cameras.bin"), read_intrinsics_text(tmp_path / "cameras.txt")]:
+        assert sorted(intrinsics) == [camera_id for camera_id, _, _, _ in cameras]
+        for camera_id, width, height, params in cameras:
+            camera = intrinsics[camera_id]
+            assert (camera.model, camera.width, camera.height) == ("PINHOLE", width, height)
+            np.testing.assert_array_equal(camera.params, params)
+
+    for extrinsics in [read_extrinsics_binary(tmp_path / "images.bin"), read_extrinsics_text(tmp_path / "images.txt")]:
+        assert list(extrinsics) == [image_id for image_id, *_ in images]
+        for image_id, qvec, tvec, camera_id, name, xys, point3D_ids in images:
+            image = extrinsics[image_id]
+            assert (image.camera_id, image.name) == (camera_id, name)
+            np.testing.assert_array_equal(image.qvec, qvec)
+            np.testing.assert_array_equal(image.T, tvec)
+            np.testing.assert_allclose(image.R, qvec2rotmat(qvec).T, atol=1e-12)
+            np.testing.assert_array_equal(image.xys.reshape(-1, 2), xys)
+            np.testing.assert_array_equal(image.point3D_ids, point3D_ids)
+
+
+@pytest.mark.parametrize("chunk_size", [3, 1 << 16])
+def test_points3D_readers_agree(tmp_path, model, chunk_size):
+    _, _, points = model
+    write_binary(tmp_path, *model)
+    write_text(tmp_path, *model)
+    expected = (np.stack([xyz for _, xyz, _, _, _ in points]),
+                np.stack([rgb for _, _, rgb, _, _ in points]).astype(np.float64),
+                np.array([[error] for _, _, _, error, _ in points]))
+    for actual in [read_points3D_binary(tmp_path / "points3D.bin", chunk_size), read_points3D_text(tmp_path / "points3D.txt", chunk_size)]:
+        for array, expected_array in zip(actual, expected):
+            assert array.dtype == np.float64
+            np.testing.assert_array_equal(array, expected_array)
+
+
+def test_empty_model(tmp_path):
+    write_binary(tmp_path, [], [], [])
+    write_text(tmp_path, [], [], [])
+    assert read_extrinsics_binary(tmp_path / "images.bin") == {}
+    assert read_extrinsics_text(tmp_path / "images.txt") == {}
+    for reader, name in [(read_points3D_binary, "points3D.bin"), (read_points3D_text, "points3D.txt")]:
+        assert [array.shape for array in reader(tmp_path / name)] == [(0, 3), (0, 3), (0, 1)]
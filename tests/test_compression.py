@@ -0,0 +1,17 @@
+import os
+import pytest
+from conftest import make_gaussians
+
+
+@pytest.mark.parametrize("num_points", [0, 1, 300])
+def test_save_compact_round_trip(tmp_path, num_points):
+    gaussians = make_gaussians(num_points)
+    report = gaussians.save_compact(tmp_path / "scene.gsvq", sh_codebook_size=64, geometry_codebook_size=64)
+    gaussians.save_ply(tmp_path / "scene.ply")
+    assert report["ply_bytes"] == os.path.getsize(tmp_path / "scene.ply")
+    assert report["compression_ratio"] == pytest.approx(report["ply_bytes"] / report["compact_bytes"])
+
+    loaded = make_gaussians(1, seed=1)
+    loaded.load_compact(tmp_path / "scene.gsvq", device="cpu")
+    for name, tensor in gaussians.compact_tensors().items():
+        assert loaded.compact_tensors()[name].shape == tensor.shape, name
@@ -0,0 +1,94 @@
+import logging
+import pytest
+import torch
+import gsplatstudio
+from gsplatstudio.models.structOptim.split_clone_prune import SplitWithCloneWithPrune
+from gsplatstudio.utils.gaussian_utils import build_rotation
+from conftest import make_gaussians
+
+
+class ThreePassDensification(SplitWithCloneWithPrune):
+    """Cloning, splitting and pruning as three passes over the parameters, before plan_densification."""
+    def densify_and_prune(self, iteration, representation, paramOptim):
+        grads = self.xyz_gradient_accum / self.denom
+        grads[grads.isnan()] = 0.0
+        self.densify_and_clone(representation, paramOptim, grads)
+        self.densify_and_split(representation, paramOptim, grads)
+
+        prune_mask = (representation.opacity < self.cfg.min_opacity).squeeze()
+        if self.should_start_limit_size(iteration):
+            big_points_vs = self.max_radii2D > self.cfg.size_threshold
+            big_points_ws = representation.scaling.max(dim=1).values > 0.1 * self.spatial_lr_scale
+            prune_mask = prune_mask | big_points_vs | big_points_ws
+        self.prune_points(prune_mask, representation, paramOptim)
+
+    def densify_and_clone(self, representation, paramOptim, grads):
+        selected = torch.norm(grads, dim=-1) >= self.cfg.densify_grad_threshold
+        selected &= representation.scaling.max(dim=1).values <= self.cfg.percent_dense * self.spatial_lr_scale
+        self.densification_postfix(representation, paramOptim, {name: tensor[selected] for name, tensor in representation.compact_tensors().items()})
+
+    def densify_and_split(self, representation, paramOptim, grads):
+        num_split = self.cfg.num_split
+        padded_grad = torch.zeros(representation.xyz.shape[0])
+        padded_grad[:grads.shape[0]] = grads.squeeze()
+        selected = padded_grad >= self.cfg.densify_grad_threshold
+        selected &= representation.scaling.max(dim=1).values > self.cfg.percent_dense * self.spatial_lr_scale
+
+        stds = representation.scaling[selected].repeat(num_split, 1)
+        samples = torch.normal(mean=torch.zeros((stds.size(0), 3)), std=stds)
+        rots = build_rotation(representation._rotation[selected]).repeat(num_split, 1, 1)
+        self.densification_postfix(representation, paramOptim, {
+            "xyz": torch.bmm(rots, samples.unsqueeze(-1)).squeeze(-1) + representation.xyz[selected].repeat(num_split, 1),
+            "f_dc": representation._features_dc[selected].repeat(num_split, 1, 1),
+            "f_rest": representation._features_rest[selected].repeat(num_split, 1, 1),
+            "opacity": representation._opacity[selected].repeat(num_split, 1),
+            "scaling": representation.scaling_inverse_activation(representation.scaling[selected].repeat(num_split, 1) / (0.8 * num_split)),
+            "rotation": representation._rotation[selected].repeat(num_split, 1),
+        })
+        self.prune_points(torch.cat((selected, torch.zeros(num_split * int(selected.sum()), dtype=torch.bool))), representation, paramOptim)
+
+    def densification_postfix(self, representation, paramOptim, new_tensors_dict):
+        representation.update_params(paramOptim.cat_tensors(new_tensors_dict))
+        self.reset_stats(representation)
+
+
+def densify(struct_class, optim_type, iteration, **cfg):
+    logger = logging.getLogger("tests")
+    representation = make_gaussians(300)
+    paramOptim = gsplatstudio.find(optim_type)({}, logger)
+    paramOptim.init_optim(representation.create_param_lr_groups(paramOptim.cfg), spatial_lr_scale=5.0, max_iter=100)
+    structOptim = struct_class(dict(dict(min_opacity=0.2, opacity_reset_interval=10), **cfg), logger)
+    structOptim.init_optim(representation, spatial_lr_scale=5.0)
+
+    generator = torch.Generator().manual_seed(1)
+    structOptim.xyz_gradient_accum.copy_(torch.rand(300, 1, generator=generator) * 4e-4)
+    # Gaussians that were never visible have a zero denominator and no gradient
+    structOptim.denom.copy_(torch.randint(0, 3, (300, 1), generator=generator))
+    structOptim.max_radii2D.copy_(torch.rand(300, generator=generator) * 40)
+    torch.manual_seed(0)
+    structOptim.densify_and_prune(iteration, representation, paramOptim)
+    return representation, structOptim
+
+
+@pytest.mark.parametrize("optim_type", ["adam+customLR-paramOptim", "flatAdam-paramOptim"])
+@pytest.mark.parametrize("iteration", [5, 20])
+@pytest.mark.parametrize("densify_chunk_size", [0, 7])
+def test_plan_densification_matches_three_passes(optim_type, iteration, densify_chunk_size):
+    expected, _ = densify(ThreePassDensification, optim_type, iteration)
+    actual, structOptim = densify(SplitWithCloneWithPrune, optim_type, iteration, densify_chunk_size=densify_chunk_size)
+    for name, tensor in expected.compact_tensors().items():
+        assert torch.equal(actual.compact_tensors()[name], tensor), name
+    assert structOptim.xyz_gradient_accum.shape[0] == actual.xyz.shape[0]
+    assert not structOptim.denom.any()
+
+
+def test_densification_budget():
+    unlimited, _ = densify(SplitWithCloneWithPrune, "adam+customLR-paramOptim", 5)
+    budget = unlimited.xyz.shape[0] - 20
+    limited, structOptim = densify(SplitWithCloneWithPrune, "adam+customLR-paramOptim", 5, max_gaussians=budget)
+    assert budget - 1 <= limited.xyz.shape[0] <= budget
+    assert structOptim.stats["densify_skipped"] > 0
+    roomy, structOptim = densify(SplitWithCloneWithPrune, "adam+customLR-paramOptim", 5, max_gaussians=10 ** 6)
+    assert structOptim.stats["densify_skipped"] == 0
+    for name, tensor in unlimited.compact_tensors().items():
+        assert torch.equal(roomy.compact_tensors()[name], tensor), name
@@ -0,0 +1,82 @@
+import pytest
+import torch
+from conftest import make_gaussians, make_optim, train_step
+
+NAMES = ["xyz", "f_dc", "f_rest", "opacity", "scaling", "rotation"]
+
+
+def assert_same_gaussians(actual, expected):
+    for name in NAMES:
+        torch.testing.assert_close(actual.compact_tensors()[name], expected.compact_tensors()[name], rtol=1e-5, atol=1e-6, msg=name)
+
+
+def test_flat_adam_matches_torch_adam():
+    reference, flat = make_gaussians(64), make_gaussians(64)
+    reference_optim = make_optim("adam+customLR-paramOptim", reference)
+    flat_optim = make_optim("flatAdam-paramOptim", flat)
+    for iteration in range(1, 6):
+        train_step(reference, reference_optim, iteration)
+        train_step(flat, flat_optim, iteration)
+    assert_same_gaussians(flat, reference)
+
+    # densification keeps the moments of the kept rows and starts the new ones from zero
+    keep_index = torch.arange(3, 64, 3)
+    new_tensors = make_gaussians(40, seed=1).compact_tensors()
+    for representation, paramOptim in [(reference, reference_optim), (flat, flat_optim)]:
+        representation.update_params(paramOptim.rebuild_tensors(keep_index, {name: tensor.detach() for name, tensor in new_tensors.items()}))
+        representation.update_params(paramOptim.prune_optim(torch.arange(representation.xyz.shape[0]) % 5 != 1))
+        representation.update_params(paramOptim.replace_tensor(torch.full_like(representation._opacity, -2.0), "opacity"))
+    for iteration in range(6, 11):
+        train_step(reference, reference_optim, iteration)
+        train_step(flat, flat_optim, iteration)
+    assert_same_gaussians(flat, reference)
+
+
+def test_flat_adam_skips_steps_without_gradient():
+    reference, flat = make_gaussians(16), make_gaussians(16)
+    reference_optim = make_optim("adam+customLR-paramOptim", reference)
+    flat_optim = make_optim("flatAdam-paramOptim", flat)
+    for representation, paramOptim in [(reference, reference_optim), (flat, flat_optim)]:
+        train_step(representation, paramOptim, 1)
+        representation.update_params(paramOptim.cat_tensors({name: tensor.detach() for name, tensor in make_gaussians(4, seed=1).compact_tensors().items()}))
+        # no backward pass since the topology change
+        paramOptim.update_optim(2)
+        train_step(representation, paramOptim, 3)
+    assert_same_gaussians(flat, reference)
+
+
+def test_sparse_update_matches_per_gaussian_adam():
+    num_points = 12
+    flat = make_gaussians(num_points)
+    flat_optim = make_optim("flatAdam-paramOptim", flat, sparse_update=True)
+    # one torch.optim.Adam per Gaussian, stepped only when it is visible
+    rows = [{name: tensor.detach()[row:row + 1].clone().requires_grad_(True) for name, tensor in flat.compact_tensors().items()}
+            for row in range(num_points)]
+    lrs = {group["name"]: group["lr"] for group in flat.create_param_lr_groups(flat_optim.cfg)}
+    row_optims = [torch.optim.Adam([{"params": [row[name]], "lr": lrs[name]} for name in NAMES], lr=0.0, eps=1e-15) for row in rows]
+
+    generator = torch.Generator().manual_seed(0)
+    for iteration in range(1, 8):
+        visibility_filter = torch.rand(num_points, generator=generator) < 0.5
+        loss = sum((tensor * tensor.detach().sin() * visibility_filter.float().view(-1, *[1] * (tensor.dim() - 1))).sum()
+                   for tensor in flat.compact_tensors().values())
+        flat_optim.backward(loss)
+        flat_optim.update_optim(iteration, visibility_filter=visibility_filter)
+        for row in torch.nonzero(visibility_filter).squeeze(1).tolist():
+            for tensor in rows[row].values():
+                tensor.grad = tensor.detach().sin()
+            row_optims[row].step()
+
+    for name in NAMES:
+        expected = torch.cat([row[name].detach() for row in rows])
+        torch.testing.assert_close(flat.compact_tensors()[name], expected, rtol=1e-5, atol=1e-6, msg=name)
+
+
+def test_sparse_update_with_everything_visible_is_dense():
+    dense, sparse = make_gaussians(32), make_gaussians(32)
+    dense_optim = make_optim("flatAdam-paramOptim", dense)
+    sparse_optim = make_optim("flatAdam-paramOptim", sparse, sparse_update=True)
+    for iteration in range(1, 5):
+        train_step(dense, dense_optim, iteration)
+        train_step(sparse, sparse_optim, iteration, visibility_filter=torch.ones(32, dtype=torch.bool))
+    assert_same_gaussians(sparse, dense)
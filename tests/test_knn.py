@@ -0,0 +1,50 @@
+import math
+import pytest
+import torch
+from gsplatstudio.utils.knn_utils import mean_knn_dist2
+
+pytest.importorskip("scipy")
+
+
+def brute_force_mean_knn_dist2(points, k=3):
+    distance2 = torch.cdist(points.double(), points.double()) ** 2
+    distance2.fill_diagonal_(math.inf)
+    # fewer than k other points: the mean of those that exist, 0 for a lone point
+    nearest = torch.topk(distance2, min(k, points.shape[0] - 1), dim=1, largest=False).values
+    return nearest.mean(dim=1).float() if nearest.shape[1] > 0 else torch.zeros(points.shape[0])
+
+def make_points(num_points, seed=0):
+    return torch.randn(num_points, 3, generator=torch.Generator().manual_seed(seed))
+
+def check_backends(points, k=3):
+    expected = brute_force_mean_knn_dist2(points, k)
+    for backend in ["grid", "kdtree"]:
+        result = mean_knn_dist2(points, backend=backend, k=k)
+        assert result.shape == (points.shape[0],) and result.dtype == points.dtype
+        assert torch.allclose(result, expected, rtol=1e-5, atol=1e-7), backend
+
+@pytest.mark.parametrize("k", [1, 3, 8])
+def test_backends_agree(k):
+    check_backends(make_points(2000), k)
+
+@pytest.mark.parametrize("num_points", [1, 2, 3, 4])
+def test_fewer_points_than_neighbours(num_points):
+    check_backends(make_points(num_points))
+
+def test_duplicates():
+    points = make_points(300)
+    points = torch.cat((points, points[:100], points[:10]))
+    check_backends(points)
+    # the first 10 points exist three times, their 2 nearest others are copies
+    for backend in ["grid", "kdtree"]:
+        assert (mean_knn_dist2(points, backend=backend, k=2)[:10] == 0).all()
+
+def test_all_duplicates():
+    points = torch.ones(50, 3)
+    check_backends(points)
+    assert (mean_knn_dist2(points, backend="grid") == 0).all()
+
+def test_outliers():
+    points = make_points(1000)
+    points[:8] = points[:8] * 1e4 + torch.tensor([1e5, -3e4, 2e4])
+    check_backends(points)
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+import torch
+from plyfile import PlyData, PlyElement
+from gsplatstudio.data.colmap_helper import fetchPly, storePly
+from conftest import make_gaussians
+
+
+def write_reference_ply(representation, path, text=False, byte_order="<"):
+    """save_ply as it was written with plyfile, one tuple per Gaussian."""
+    xyz = representation._xyz.detach().numpy()
+    f_dc = representation._features_dc.detach().transpose(1, 2).flatten(start_dim=1).numpy()
+    f_rest = representation._features_rest.detach().transpose(1, 2).flatten(start_dim=1).numpy()
+    attributes = np.concatenate((xyz, np.zeros_like(xyz), f_dc, f_rest, representation._opacity.detach().numpy(),
+                                 representation._scaling.detach().numpy(), representation._rotation.detach().numpy()), axis=1)
+    elements = np.empty(xyz.shape[0], dtype=[(attribute, 'f4') for attribute in representation.construct_list_of_attributes()])
+    elements[:] = list(map(tuple, attributes))
+    PlyData([PlyElement.describe(elements, 'vertex')], text=text, byte_order=byte_order).write(str(path))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 20])
+def test_save_ply_matches_plyfile(tmp_path, gaussians, chunk_size):
+    write_reference_ply(gaussians, tmp_path / "reference.ply")
+    gaussians.save_ply(tmp_path / "scene.ply", chunk_size=chunk_size)
+    assert (tmp_path / "scene.ply").read_bytes() == (tmp_path / "reference.ply").read_bytes()
+
+
+def test_save_ply_of_strided_parameters(tmp_path, gaussians):
+    # parameters that are views into a wider buffer, like the ones of flatAdam-paramOptim
+    tensors = {name: torch.cat([tensor, torch.zeros_like(tensor)], dim=-1)[..., :tensor.shape[-1]]
+               for name, tensor in gaussians.compact_tensors().items()}
+    write_reference_ply(gaussians, tmp_path / "reference.ply")
+    gaussians.save_ply(tmp_path / "scene.ply", chunk_size=10, tensors=tensors)
+    assert (tmp_path / "scene.ply").read_bytes() == (tmp_path / "reference.ply").read_bytes()
+
+
+@pytest.mark.parametrize("text, byte_order", [(False, "<"), (False, ">"), (True, "=")])
+def test_load_ply_round_trip(tmp_path, gaussians, text, byte_order):
+    write_reference_ply(gaussians, tmp_path / "scene.ply", text=text, byte_order=byte_order)
+    loaded = make_gaussians(1, seed=1)
+    loaded.load_ply(tmp_path / "scene.ply")
+    for name, tensor in gaussians.compact_tensors().items():
+        assert torch.equal(loaded.compact_tensors()[name], tensor), name
+    assert loaded.sh_degree == loaded.max_sh_degree
+
+
+@pytest.mark.parametrize("rows", [slice(10, 50), np.array([3, 0, 256]), np.arange(257) % 3 == 0])
+def test_load_ply_rows(tmp_path, gaussians, rows):
+    gaussians.save_ply(tmp_path / "scene.ply")
+    gaussians.build_lod()
+    gaussians.spatial_index
+    index = torch.as_tensor(rows) if not isinstance(rows, slice) else rows
+    gaussians.load_ply(tmp_path / "scene.ply", rows=rows)
+    expected = make_gaussians(257)
+    for name, tensor in gaussians.compact_tensors().items():
+        assert isinstance(tensor, torch.nn.Parameter) and tensor.requires_grad
+        assert torch.equal(tensor, expected.compact_tensors()[name][index]), name
+    assert gaussians.lod is None and gaussians._spatial_index is None
+
+
+def test_read_ply_tensors_leaves_the_model(tmp_path, gaussians):
+    gaussians.save_ply(tmp_path / "scene.ply")
+    other = make_gaussians(5, seed=1)
+    before = {name: tensor.clone() for name, tensor in other.compact_tensors().items()}
+    tensors = other.read_ply_tensors(tmp_path / "scene.ply", attributes=["xyz", "rotation"], rows=slice(0, 4))
+    assert sorted(tensors) == ["rotation", "xyz"]
+    assert torch.equal(tensors["xyz"], gaussians._xyz[:4]) and torch.equal(tensors["rotation"], gaussians._rotation[:4])
+    for name, tensor in other.compact_tensors().items():
+        assert torch.equal(tensor, before[name]), name
+
+
+def test_store_and_fetch_point_cloud(tmp_path):
+    rng = np.random.default_rng(0)
+    xyz = rng.normal(size=(100, 3)).astype(np.float32)
+    rgb = rng.integers(0, 256, size=(100, 3)).astype(np.uint8)
+    storePly(tmp_path / "points3D.ply", xyz, rgb)
+
+    elements = np.empty(100, dtype=[('x', 'f4'), ('y', 'f4'), ('z', 'f4'), ('nx', 'f4'), ('ny', 'f4'), ('nz', 'f4'),
+                                    ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')])
+    elements[:] = list(map(tuple, np.concatenate((xyz, np.zeros_like(xyz), rgb), axis=1)))
+    PlyData([PlyElement.describe(elements, 'vertex')]).write(str(tmp_path / "reference.ply"))
+    assert (tmp_path / "points3D.ply").read_bytes() == (tmp_path / "reference.ply").read_bytes()
+
+    point_cloud = fetchPly(tmp_path / "points3D.ply")
+    np.testing.assert_array_equal(point_cloud.points, xyz)
+    np.testing.assert_array_equal(point_cloud.colors, rgb / 255.0)
+    np.testing.assert_array_equal(point_cloud.normals, np.zeros_like(xyz))
@@ -0,0 +1,102 @@
+import math
+import pytest
+import torch
+from gsplatstudio.utils.spatial_index import GridIndex
+
+
+def make_points(num_points=600, num_outliers=5, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    points = torch.randn(num_points, 3, generator=generator)
+    points[:num_outliers] *= 50.0
+    return points
+
+def pairs(query_ids, point_ids):
+    return sorted(zip(query_ids.tolist(), point_ids.tolist()))
+
+def mask_pairs(mask):
+    return pairs(*torch.nonzero(mask, as_tuple=True))
+
+def assert_consistent(index, points):
+    """index holds points, with the same keys and key order as an index built from scratch."""
+    fresh = GridIndex(points, cell_size=index.cell_size)
+    assert torch.equal(index.points, points)
+    assert torch.equal(index.keys, fresh.keys)
+    assert torch.equal(index.sorted_keys, fresh.sorted_keys)
+    assert torch.equal(index.keys[index.order], index.sorted_keys)
+    assert torch.equal(torch.sort(index.order).values, torch.arange(points.shape[0]))
+
+def test_box_matches_brute_force():
+    points = make_points()
+    index = GridIndex(points, cell_size=0.4)
+    generator = torch.Generator().manual_seed(1)
+    lower = torch.randn(40, 3, generator=generator)
+    upper = lower + torch.rand(40, 3, generator=generator) * 2.0
+    inside = ((points[None] >= lower[:, None]) & (points[None] <= upper[:, None])).all(dim=2)
+    assert pairs(*index.box(lower, upper)) == mask_pairs(inside)
+
+def test_radius_matches_brute_force():
+    points = make_points()
+    index = GridIndex(points, cell_size=0.4)
+    centers = torch.cat((points[:20], torch.randn(20, 3, generator=torch.Generator().manual_seed(1))))
+    radius = torch.linspace(0.1, 1.5, centers.shape[0])
+    inside = torch.cdist(centers, points) ** 2 <= radius[:, None] ** 2
+    assert pairs(*index.radius(centers, radius)) == mask_pairs(inside)
+
+@pytest.mark.parametrize("k", [1, 3, 16])
+def test_knn_matches_brute_force(k):
+    points = make_points()
+    index = GridIndex(points, cell_size=0.4)
+    distances, ids = index.knn(points, k, exclude=torch.arange(points.shape[0]))
+    distance2 = torch.cdist(points, points) ** 2
+    distance2.fill_diagonal_(math.inf)
+    expected_distances, expected_ids = torch.topk(distance2, k, dim=1, largest=False)
+    assert torch.equal(ids, expected_ids)
+    assert torch.allclose(distances, expected_distances, rtol=1e-4, atol=1e-6)
+
+def test_knn_pads_missing_neighbours():
+    points = make_points(4, num_outliers=1)
+    distances, ids = GridIndex(points, cell_size=0.4).knn(points, 5, exclude=torch.arange(4))
+    assert (ids[:, 3:] == -1).all() and torch.isinf(distances[:, 3:]).all()
+    assert (ids[:, :3] >= 0).all() and torch.isfinite(distances[:, :3]).all()
+
+def test_ray_matches_brute_force():
+    points = make_points()
+    index = GridIndex(points, cell_size=0.4)
+    generator = torch.Generator().manual_seed(1)
+    origins = torch.randn(12, 3, generator=generator) * 1.5
+    directions = torch.randn(12, 3, generator=generator)
+    max_t, radius = 6.0, 0.4
+    ray_ids, point_ids, t = index.ray(origins, directions, max_t, radius=radius)
+
+    directions = directions / directions.norm(dim=1, keepdim=True)
+    offset = points[None] - origins[:, None]
+    expected_t = (offset * directions[:, None]).sum(dim=2).clamp(0, max_t)
+    distance2 = ((offset - expected_t[..., None] * directions[:, None]) ** 2).sum(dim=2)
+    assert pairs(ray_ids, point_ids) == mask_pairs(distance2 <= radius ** 2)
+    assert torch.allclose(t, expected_t[ray_ids, point_ids], atol=1e-5)
+    assert all((ray_ids[1:] > ray_ids[:-1]) | ((ray_ids[1:] == ray_ids[:-1]) & (t[1:] >= t[:-1])))
+
+@pytest.mark.parametrize("moved_fraction", [0.05, 0.5])
+def test_incremental_updates_match_rebuild(moved_fraction):
+    generator = torch.Generator().manual_seed(2)
+    points = make_points()
+    index = GridIndex(points, cell_size=0.4)
+
+    valid_mask = torch.rand(points.shape[0], generator=generator) > 0.3
+    points = points[valid_mask]
+    index.prune(valid_mask)
+    assert_consistent(index, points)
+
+    new_points = torch.randn(150, 3, generator=generator)
+    points = torch.cat((points, new_points))
+    index.append(new_points)
+    assert_consistent(index, points)
+
+    moved = torch.rand(points.shape[0], generator=generator) < moved_fraction
+    points = torch.where(moved[:, None], points + torch.randn(points.shape, generator=generator), points)
+    index.refresh(points)
+    assert_consistent(index, points)
+
+    centers = points[:30]
+    inside = torch.cdist(centers, points) ** 2 <= 0.25
+    assert pairs(*index.radius(centers, 0.5)) == mask_pairs(inside)
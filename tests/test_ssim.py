@@ -0,0 +1,73 @@
+import math
+import pytest
+import torch
+import torch.nn.functional as F
+from gsplatstudio.models.loss.l1_ssim_loss import SSIMFunction, gaussian_window, ssim
+
+
+def reference_ssim(img1, img2, window_size=11, size_average=True):
+    """The 2D depthwise-convolution SSIM that ssim replaced, differentiated by autograd."""
+    channel = img1.size(-3)
+    gauss = torch.tensor([math.exp(-(x - window_size // 2) ** 2 / (2 * 1.5 ** 2)) for x in range(window_size)], dtype=img1.dtype)
+    gauss = (gauss / gauss.sum()).unsqueeze(1)
+    window = (gauss @ gauss.t()).expand(channel, 1, window_size, window_size).contiguous()
+
+    def filter(image):
+        return F.conv2d(image, window, padding=window_size // 2, groups=channel)
+    mu1, mu2 = filter(img1), filter(img2)
+    sigma1_sq = filter(img1 * img1) - mu1 * mu1
+    sigma2_sq = filter(img2 * img2) - mu2 * mu2
+    sigma12 = filter(img1 * img2) - mu1 * mu2
+    C1, C2 = 0.01 ** 2, 0.03 ** 2
+    ssim_map = ((2 * mu1 * mu2 + C1) * (2 * sigma12 + C2)) / ((mu1 * mu1 + mu2 * mu2 + C1) * (sigma1_sq + sigma2_sq + C2))
+    if size_average:
+        return ssim_map.mean()
+    return ssim_map.mean(1).mean(1).mean(1)
+
+
+def random_images(shape, dtype=torch.float64, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    img1 = torch.rand(shape, generator=generator, dtype=dtype)
+    # correlated images, like a render and its ground truth
+    img2 = (img1 + 0.2 * torch.randn(shape, generator=generator, dtype=dtype)).clamp(0, 1)
+    return img1.requires_grad_(True), img2.requires_grad_(True)
+
+
+@pytest.mark.parametrize("shape", [(3, 32, 40), (2, 3, 17, 23), (1, 1, 6, 5)])
+@pytest.mark.parametrize("size_average", [True, False])
+def test_ssim_matches_reference(shape, size_average):
+    img1, img2 = random_images(shape)
+    batched = (img1, img2) if len(shape) == 4 else (img1.unsqueeze(0), img2.unsqueeze(0))
+    expected = reference_ssim(*batched, size_average=size_average)
+    if len(shape) == 3 and not size_average:
+        expected = expected[0]
+    actual = ssim(img1, img2, size_average=size_average)
+    torch.testing.assert_close(actual, expected, rtol=1e-10, atol=1e-12)
+
+    weights = torch.rand(actual.shape, dtype=torch.float64)
+    expected_grads = torch.autograd.grad((expected * weights).sum(), (img1, img2))
+    actual_grads = torch.autograd.grad((actual * weights).sum(), (img1, img2))
+    for actual_grad, expected_grad in zip(actual_grads, expected_grads):
+        torch.testing.assert_close(actual_grad, expected_grad, rtol=1e-8, atol=1e-12)
+
+
+def test_ssim_float32_close_to_reference():
+    img1, img2 = random_images((3, 64, 48), dtype=torch.float32)
+    torch.testing.assert_close(ssim(img1, img2), reference_ssim(img1.unsqueeze(0), img2.unsqueeze(0)), rtol=1e-5, atol=1e-6)
+    grad = torch.autograd.grad(ssim(img1, img2), img1)[0]
+    expected_grad = torch.autograd.grad(reference_ssim(img1.unsqueeze(0), img2.unsqueeze(0)), img1)[0]
+    torch.testing.assert_close(grad, expected_grad, rtol=1e-4, atol=1e-7)
+
+
+def test_ssim_gradcheck():
+    img1, img2 = random_images((2, 2, 9, 7))
+    window = gaussian_window(5, 1.5, torch.float64, img1.device)
+    assert torch.autograd.gradcheck(lambda a, b: SSIMFunction.apply(a, b, window), (img1, img2))
+
+
+def test_ssim_only_differentiates_what_needs_it():
+    img1, img2 = random_images((3, 16, 16))
+    img2 = img2.detach()
+    ssim(img1, img2).backward()
+    assert img1.grad is not None and img2.grad is None
+    assert gaussian_window(11, 1.5, torch.float64, img1.device) is gaussian_window(11, 1.5, torch.float64, img1.device)
@@ -0,0 +1,94 @@
+import math
+import logging
+import numpy as np
+import pytest
+import torch
+import gsplatstudio
+from gsplatstudio.utils.camera_utils import BasicCamera
+from gsplatstudio.models.renderer.torchRasterizer import ALPHA_MAX, ALPHA_MIN, TRANSMITTANCE_MIN
+from conftest import make_gaussians
+
+HEIGHT, WIDTH = 20, 28
+
+
+def make_renderer(**cfg):
+    cfg = {"background_color": [0.1, 0.2, 0.3], "device": "cpu", "tile_size": 8, **cfg}
+    return gsplatstudio.find("torchRasterizer-renderer")(cfg, logging.getLogger("tests"))
+
+def make_camera():
+    return BasicCamera(R=np.eye(3), T=np.array([0.0, 0.0, 4.0]), fov_x=math.radians(60), fov_y=math.radians(45),
+                       height=HEIGHT, width=WIDTH, device="cpu")
+
+def make_scene(num_points=48, seed=0):
+    representation = make_gaussians(num_points, sh_degree=1, seed=seed)
+    with torch.no_grad():
+        representation._scaling += 1.5
+        # one Gaussian behind the camera and one far outside the image
+        representation._xyz[0] = torch.tensor([0.0, 0.0, -5.0])
+        representation._xyz[1] = torch.tensor([40.0, 0.0, 0.0])
+    return representation
+
+def naive_render(renderer, representation, camera):
+    """Front-to-back composite of every pixel in a Python loop, over the Gaussians of its tile."""
+    with torch.no_grad():
+        xyz = representation.xyz
+        means2D, conics, depths, radii = renderer.project(
+            xyz, torch.zeros_like(xyz), representation, camera.world_view_transform, camera.full_proj_transform,
+            camera.tanfovx, camera.tanfovy, HEIGHT, WIDTH)
+        visible = torch.nonzero(radii > 0).squeeze(1).tolist()
+        colors = renderer.compute_colors(representation, camera.camera_center, torch.arange(xyz.shape[0]))
+        rect_min, rect_max = renderer.tile_rect(means2D, radii.to(means2D.dtype), HEIGHT, WIDTH)
+        order = sorted(visible, key=lambda index: depths[index].item())
+        background = renderer.background_color
+        tile = renderer.cfg.tile_size
+
+        image = torch.empty(3, HEIGHT, WIDTH)
+        for y in range(HEIGHT):
+            for x in range(WIDTH):
+                color, T = torch.zeros(3), 1.0
+                for index in order:
+                    if not (rect_min[index, 0] <= x // tile < rect_max[index, 0] and rect_min[index, 1] <= y // tile < rect_max[index, 1]):
+                        continue
+                    dx, dy = means2D[index, 0].item() - x, means2D[index, 1].item() - y
+                    a, b, c = conics[index].tolist()
+                    power = -0.5 * (a * dx * dx + c * dy * dy) - b * dx * dy
+                    if power > 0:
+                        continue
+                    alpha = min(ALPHA_MAX, representation.opacity[index, 0].item() * math.exp(power))
+                    if alpha < ALPHA_MIN:
+                        continue
+                    if T * (1 - alpha) < TRANSMITTANCE_MIN:
+                        break
+                    color += alpha * T * colors[index]
+                    T *= 1 - alpha
+                image[:, y, x] = color + T * background
+    return image, radii
+
+@pytest.mark.parametrize("cfg", [{}, {"tiles_per_batch": 1, "chunk_elements": 256, "num_threads": 2}])
+def test_render_matches_per_pixel_composite(cfg):
+    renderer, representation, camera = make_renderer(**cfg), make_scene(), make_camera()
+    output = renderer.render(representation, camera)
+    expected, radii = naive_render(renderer, representation, camera)
+    assert output["render"].shape == (3, HEIGHT, WIDTH)
+    assert torch.allclose(output["render"], expected, atol=1e-5)
+    assert torch.equal(output["radii"], radii)
+
+def test_radii_and_visibility_filter():
+    representation = make_scene()
+    output = make_renderer().render(representation, make_camera())
+    radii, visibility_filter = output["radii"], output["visibility_filter"]
+    assert radii.shape == visibility_filter.shape == (representation.xyz.shape[0],)
+    assert torch.equal(visibility_filter, radii > 0)
+    assert radii[0] == 0 and radii[1] == 0
+    assert visibility_filter[2:].sum() > 0
+
+def test_viewspace_points_grad():
+    representation = make_scene()
+    output = make_renderer().render(representation, make_camera())
+    output["render"].sum().backward()
+    grad = output["viewspace_points"].grad
+    assert grad is not None and grad.shape == representation.xyz.shape
+    assert torch.isfinite(grad).all()
+    assert (grad[~output["visibility_filter"]] == 0).all()
+    assert grad[output["visibility_filter"], :2].abs().sum() > 0
+    assert torch.isfinite(representation._xyz.grad).all()